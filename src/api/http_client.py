@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import time
+
+import aiohttp
+from telegram.ext import Application
+
+from config import (HTTP_CONNECT_TIMEOUT, HTTP_CONNECTION_LIMIT,
+                    HTTP_CONNECTION_LIMIT_PER_HOST, HTTP_DNS_CACHE_TTL,
+                    HTTP_KEEPALIVE_TIMEOUT, HTTP_REQUEST_TIMEOUT)
+
+_session: aiohttp.ClientSession = None
+
+
+def create_http_session() -> aiohttp.ClientSession:
+    """
+    Создает HTTP-сессию с пулом соединений, keep-alive и кэшем DNS.
+
+    :return: Объект aiohttp.ClientSession
+    """
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_CONNECTION_LIMIT,
+        limit_per_host=HTTP_CONNECTION_LIMIT_PER_HOST,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        use_dns_cache=True,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=HTTP_REQUEST_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+async def start_http_session(application: Application = None) -> None:
+    """
+    Открывает общую HTTP-сессию при старте приложения.
+
+    :param application: Объект Application (передается из post_init)
+    :return: None
+    """
+    global _session
+    if _session is None or _session.closed:
+        _session = create_http_session()
+        logging.info("HTTP session for API Gismeteo was opened")
+
+
+async def close_http_session(application: Application = None) -> None:
+    """
+    Закрывает общую HTTP-сессию при остановке приложения.
+
+    :param application: Объект Application (передается из post_shutdown)
+    :return: None
+    """
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logging.info("HTTP session for API Gismeteo was closed")
+    _session = None
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """
+    Возвращает общую HTTP-сессию, создавая ее при первом обращении.
+
+    :return: Объект aiohttp.ClientSession
+    """
+    global _session
+    if _session is None or _session.closed:
+        _session = create_http_session()
+    return _session
+
+
+if __name__ == "__main__":
+    from aiohttp import web
+
+    REQUESTS = 2000
+    CONCURRENCY = 50
+
+    async def stub(request: web.Request) -> web.Response:
+        return web.json_response({"response": {"temperature": {"air": {"C": 3.2}}}})
+
+    async def run(fetch) -> float:
+        semaphore = asyncio.Semaphore(CONCURRENCY)
+
+        async def one():
+            async with semaphore:
+                await fetch()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(REQUESTS)))
+        return REQUESTS / (time.perf_counter() - started)
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/", stub)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        url = f"http://127.0.0.1:{port}/"
+
+        async def per_request():
+            async with aiohttp.ClientSession() as session:
+                async with session.get(url) as response:
+                    await response.json()
+
+        async def pooled():
+            async with get_http_session().get(url) as response:
+                await response.json()
+
+        print(f"per-request session: {await run(per_request):.0f} req/s")
+        await start_http_session()
+        print(f"pooled session: {await run(pooled):.0f} req/s")
+        await close_http_session()
+        await runner.cleanup()
+
+    asyncio.run(main())
@@ -0,0 +1,324 @@
+import codecs
+import json
+from typing import AsyncIterable, List, NamedTuple, Union
+
+from config import OFFSET
+
+INCOMPLETE = object()
+
+
+class ForecastRecord(NamedTuple):
+    time: str
+    description: str
+    humidity: int
+    pressure: int
+    temperature: float
+    wind: float
+    wind_direction: int
+
+
+def project(interval: dict) -> dict:
+    """
+    Оставляет в интервале прогноза только поля, которые использует парсер.
+
+    :param interval: Интервал из ответа API Gismeteo
+    :return: Dict с полями date, description, humidity, pressure, temperature, wind
+    """
+    projected = {}
+    if "date" in interval:
+        projected["date"] = {"local": interval["date"]["local"]}
+        if "time_zone_offset" in interval["date"]:
+            # Нужен, чтобы выбирать интервалы единого прогноза по местному времени
+            projected["date"]["time_zone_offset"] = interval["date"]["time_zone_offset"]
+    if "description" in interval:
+        projected["description"] = {"full": interval["description"]["full"]}
+    if "humidity" in interval:
+        projected["humidity"] = {"percent": interval["humidity"]["percent"]}
+    if "pressure" in interval:
+        projected["pressure"] = {"mm_hg_atm": interval["pressure"]["mm_hg_atm"]}
+    if "temperature" in interval:
+        projected["temperature"] = {"air": {"C": interval["temperature"]["air"]["C"]}}
+    if "wind" in interval:
+        projected["wind"] = {
+            "speed": {"m_s": interval["wind"]["speed"]["m_s"]},
+            "direction": {"scale_8": interval["wind"]["direction"]["scale_8"]},
+        }
+    return projected
+
+
+def parse_interval(interval: dict) -> ForecastRecord:
+    """
+    Извлекает поля одного интервала прогноза за один проход.
+
+    :param interval: Интервал из ответа API Gismeteo
+    :return: ForecastRecord
+    """
+    wind = interval["wind"]
+    return ForecastRecord(
+        interval["date"]["local"],
+        interval["description"]["full"],
+        interval["humidity"]["percent"],
+        interval["pressure"]["mm_hg_atm"],
+        interval["temperature"]["air"]["C"],
+        wind["speed"]["m_s"],
+        wind["direction"]["scale_8"],
+    )
+
+
+def parse_forecast(response: Union[List[dict], dict], offset: bool) -> List[ForecastRecord]:
+    """
+    Парсит ответ API: текущую погоду (dict) и интервалы прогноза (list) одинаково.
+
+    :param response: Ответ API Gismeteo
+    :param offset: Применять ли смещение для прогноза на завтра
+    :return: Список ForecastRecord
+    """
+    if isinstance(response, dict):
+        return [parse_interval(response)]
+    if offset:
+        response = response[OFFSET:]
+    return [parse_interval(interval) for interval in response]
+
+
+class StreamingResponseParser:
+    """
+    Разбирает тело ответа API Gismeteo по частям.
+
+    Интервалы массива response декодируются по мере поступления и сразу
+    сокращаются до нужных полей, поэтому полный документ в памяти не строится.
+    Ключ response ищется только среди ключей верхнего уровня, значения других
+    ключей (например, meta) декодируются целиком и отбрасываются.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buffer = ""
+        self._position = 0
+        self._key = ""
+        self._state = "start"
+        self._intervals: List[dict] = []
+        self._single = INCOMPLETE
+
+    def feed(self, chunk: bytes) -> None:
+        """
+        Передает парсеру очередную часть тела ответа.
+
+        :param chunk: Байты тела ответа
+        :return: None
+        :raise ValueError: Если тело ответа не является корректным JSON
+        """
+        self._buffer += self._decoder.decode(chunk)
+        self._advance()
+
+    def close(self) -> Union[List[dict], dict, None]:
+        """
+        Завершает разбор и возвращает данные поля response.
+
+        :return: Список интервалов, один интервал или None, если поля нет
+        :raise ValueError: Если тело ответа оборвалось
+        """
+        self._buffer += self._decoder.decode(b"", final=True)
+        self._advance()
+        if self._state == "end" or (self._state == "start" and not self._buffer.strip()):
+            return None
+        if self._state != "done":
+            raise ValueError("Unexpected end of response body")
+        if self._single is not INCOMPLETE:
+            return self._single
+        return self._intervals
+
+    def _skip_whitespace(self) -> None:
+        buffer = self._buffer
+        position = self._position
+        while position < len(buffer) and buffer[position] in " \t\r\n":
+            position += 1
+        self._position = position
+
+    def _compact(self) -> None:
+        # Уже разобранную часть буфера отбрасываем
+        if self._position:
+            self._buffer = self._buffer[self._position:]
+            self._position = 0
+
+    def _advance(self) -> None:
+        self._step()
+        self._compact()
+
+    def _step(self) -> None:
+        while True:
+            if self._state == "start":
+                self._skip_whitespace()
+                if self._position >= len(self._buffer):
+                    return
+                if self._buffer[self._position] != "{":
+                    raise ValueError("Response body is not a JSON object")
+                self._position += 1
+                self._state = "key"
+            elif self._state == "key":
+                self._skip_whitespace()
+                if self._position >= len(self._buffer):
+                    return
+                char = self._buffer[self._position]
+                if char == ",":
+                    self._position += 1
+                    continue
+                if char == "}":
+                    self._position += 1
+                    self._state = "end"
+                    continue
+                if char != '"':
+                    raise ValueError("Expected a key in response body")
+                key = self._decode()
+                if key is INCOMPLETE:
+                    return
+                self._key = key
+                self._state = "colon"
+            elif self._state == "colon":
+                self._skip_whitespace()
+                if self._position >= len(self._buffer):
+                    return
+                if self._buffer[self._position] != ":":
+                    raise ValueError(f"Expected ':' after {self._key} key")
+                self._position += 1
+                self._state = "value" if self._key == "response" else "skip"
+            elif self._state == "skip":
+                self._skip_whitespace()
+                if self._position >= len(self._buffer):
+                    return
+                if self._decode() is INCOMPLETE:
+                    return
+                self._state = "key"
+            elif self._state == "value":
+                self._skip_whitespace()
+                if self._position >= len(self._buffer):
+                    return
+                if self._buffer[self._position] == "[":
+                    self._position += 1
+                    self._state = "item"
+                else:
+                    self._state = "single"
+            elif self._state == "single":
+                value = self._decode()
+                if value is INCOMPLETE:
+                    return
+                self._single = project(value) if isinstance(value, dict) else value
+                self._state = "done"
+            elif self._state == "item":
+                self._skip_whitespace()
+                if self._position >= len(self._buffer):
+                    return
+                char = self._buffer[self._position]
+                if char == ",":
+                    self._position += 1
+                    continue
+                if char == "]":
+                    self._position += 1
+                    self._state = "done"
+                    continue
+                value = self._decode()
+                if value is INCOMPLETE:
+                    return
+                self._intervals.append(project(value))
+            else:
+                return
+
+    def _decode(self):
+        try:
+            value, end = self._json.raw_decode(self._buffer, self._position)
+        except json.JSONDecodeError:
+            # Объект еще не пришел целиком
+            return INCOMPLETE
+        self._position = end
+        return value
+
+
+async def read_response(stream: AsyncIterable[bytes]) -> Union[List[dict], dict, None]:
+    """
+    Читает тело ответа API по частям и возвращает сокращенное поле response.
+
+    :param stream: Асинхронный итератор частей тела (например, response.content.iter_any())
+    :return: Список интервалов, один интервал или None
+    :raise ValueError: Если тело ответа не является корректным JSON
+    """
+    parser = StreamingResponseParser()
+    async for chunk in stream:
+        parser.feed(chunk)
+    return parser.close()
+
+
+if __name__ == "__main__":
+    import asyncio
+    import time
+
+    from api.samples import current_response, envelope, forecast_response
+
+    ROUNDS = 5000
+
+    def legacy_parse(response, offset):
+        data = {name: [] for name in ForecastRecord._fields}
+        intervals = [response] if isinstance(response, dict) else response
+        if offset and not isinstance(response, dict):
+            intervals = response[OFFSET:]
+        for interval in intervals:
+            for key in interval:
+                if key == "date":
+                    data["time"].append(interval[key]["local"])
+                if key == "description":
+                    data["description"].append(interval[key]["full"])
+                if key == "humidity":
+                    data["humidity"].append(interval[key]["percent"])
+                if key == "pressure":
+                    data["pressure"].append(interval[key]["mm_hg_atm"])
+                if key == "temperature":
+                    data["temperature"].append(interval[key]["air"]["C"])
+                if key == "wind":
+                    data["wind"].append(interval[key]["speed"]["m_s"])
+                    data["wind_direction"].append(interval[key]["direction"]["scale_8"])
+        return list(zip(*data.values()))
+
+    def measure(func, *args) -> float:
+        started = time.perf_counter()
+        for _ in range(ROUNDS):
+            func(*args)
+        return (time.perf_counter() - started) / ROUNDS * 1e6
+
+    async def stream_parse(body: bytes):
+        async def chunks():
+            for start in range(0, len(body), 8192):
+                yield body[start:start + 8192]
+        return await read_response(chunks())
+
+    def feed_parse(body: bytes):
+        parser = StreamingResponseParser()
+        for start in range(0, len(body), 8192):
+            parser.feed(body[start:start + 8192])
+        return parser.close()
+
+    for name, response in (("current", current_response()), ("8 intervals", forecast_response(8)), ("16 intervals", forecast_response(16))):
+        assert legacy_parse(response, False) == parse_forecast(response, False)
+        body = json.dumps(envelope(response)).encode()
+        assert asyncio.run(stream_parse(body)) == (
+            project(response) if isinstance(response, dict) else [project(item) for item in response]
+        )
+        print(
+            f"{name}: legacy {measure(legacy_parse, response, False):.1f} us, "
+            f"single-pass {measure(parse_forecast, response, False):.1f} us, "
+            f"json.loads {measure(json.loads, body):.1f} us, "
+            f"streaming {measure(feed_parse, body):.1f} us"
+        )
+
+    # Ключ response учитывается только на верхнем уровне, в том числе при разбиении по байту
+    intervals = forecast_response(2)
+    body = json.dumps({
+        "meta": {"message": "response", "response": {"code": "200"}},
+        "response": intervals,
+        "extra": "response",
+    }).encode()
+    for size in (1, 7, len(body)):
+        parser = StreamingResponseParser()
+        for start in range(0, len(body), size):
+            parser.feed(body[start:start + size])
+        assert parser.close() == [project(item) for item in intervals]
+    assert feed_parse(b'{"meta": {"response": [1]}}') is None
+    assert feed_parse(b"") is None
@@ -0,0 +1,150 @@
+import logging
+import time
+
+from redis import RedisError
+
+from cache.redis_cache import get_redis_client
+from config import (BREAKER_FAILURE_THRESHOLD, BREAKER_HALF_OPEN_PROBES,
+                    BREAKER_RESET_TIMEOUT, GISMETEO_BURST, GISMETEO_RATE_LIMIT)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Время берется из Redis, чтобы расхождение часов реплик не влияло на лимит
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return allowed
+"""
+
+
+class TokenBucket:
+    """
+    Токен-бакет в памяти процесса.
+    """
+
+    def __init__(self, rate: float, capacity: int, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = float(capacity)
+        self._updated_at = clock()
+
+    def try_acquire(self) -> bool:
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+class RateLimiter:
+    """
+    Токен-бакет в Redis, общий для всех реплик. Если Redis недоступен,
+    используется бакет в памяти процесса.
+    """
+
+    def __init__(self, key: str, rate: float, capacity: int):
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity
+        self.fallback = TokenBucket(rate, capacity)
+        self._script = None
+
+    async def try_acquire(self) -> bool:
+        """
+        Забирает токен на один запрос к API.
+
+        :return: False, если лимит запросов исчерпан
+        """
+        if self._script is None:
+            self._script = get_redis_client().register_script(TOKEN_BUCKET_SCRIPT)
+        try:
+            return bool(await self._script(keys=[self.key], args=[self.rate, self.capacity]))
+        except RedisError as e:
+            logging.warning(f"Rate limiter falls back to in-process bucket: {e}")
+            return self.fallback.try_acquire()
+
+
+class CircuitBreaker:
+    """
+    Размыкается после failure_threshold ошибок подряд, через reset_timeout
+    пропускает до half_open_probes пробных запросов и замыкается после успешного.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int,
+        reset_timeout: float,
+        half_open_probes: int,
+        clock=time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self._clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+
+    def allow(self) -> bool:
+        """
+        Разрешает ли выключатель запрос к API.
+
+        :return: True, если запрос можно отправить
+        """
+        if self.state == OPEN:
+            if self._clock() - self._opened_at < self.reset_timeout:
+                return False
+            self.state = HALF_OPEN
+            self._probes = 0
+            logging.info("Circuit breaker for API Gismeteo is half-open")
+        if self.state == HALF_OPEN:
+            if self._probes >= self.half_open_probes:
+                return False
+            self._probes += 1
+        return True
+
+    def release(self) -> None:
+        """
+        Возвращает пробный запрос, который был разрешен, но не отправлен.
+
+        :return: None
+        """
+        if self.state == HALF_OPEN and self._probes:
+            self._probes -= 1
+
+    def record_success(self) -> None:
+        if self.state != CLOSED:
+            logging.info("Circuit breaker for API Gismeteo is closed")
+        self.state = CLOSED
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                logging.warning(f"Circuit breaker for API Gismeteo is open after {self.failures} failures")
+            self.state = OPEN
+            self._opened_at = self._clock()
+
+
+rate_limiter = RateLimiter("ratelimit:gismeteo", GISMETEO_RATE_LIMIT, GISMETEO_BURST)
+breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT, BREAKER_HALF_OPEN_PROBES)
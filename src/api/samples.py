@@ -0,0 +1,78 @@
+"""
+Образцы ответов API Gismeteo для бенчмарков и локальных заглушек.
+"""
+from datetime import date, timedelta
+from typing import List
+
+SAMPLE_DAY = date(2026, 3, 9)
+
+
+def forecast_interval(hour: int, day: date = SAMPLE_DAY) -> dict:
+    """
+    Интервал прогноза в формате ответа API Gismeteo (со всеми полями ответа).
+
+    :param hour: Час интервала
+    :param day: Дата интервала
+    :return: Dict интервала
+    """
+    return {
+        "date": {
+            "local": f"{day}T{hour:02}:00:00+03:00",
+            "UTC": f"{day}T{hour:02}:00:00Z",
+            "unix": 1773000000 + hour * 3600,
+            "time_zone_offset": 180,
+        },
+        "description": {"full": "Пасмурно, небольшой снег"},
+        "humidity": {"percent": 86},
+        "pressure": {"mm_hg_atm": 742, "h_pa": 989, "in_hg": 29.2},
+        "temperature": {
+            "air": {"C": 3.2, "F": 37.8},
+            "comfort": {"C": -1.1, "F": 30},
+            "water": {"C": 2, "F": 35.6},
+        },
+        "wind": {
+            "speed": {"m_s": 4, "km_h": 14, "mi_h": 9},
+            "direction": {"degree": 135, "scale_8": 3},
+        },
+        "cloudiness": {"percent": 100, "scale_3": 3},
+        "precipitation": {"type": 2, "amount": 0.3, "intensity": 1},
+        "phenomenon": {"thunderstorm": False, "fog": False},
+        "radiation": {"uvb_index": 1, "UVB": 1},
+        "gm": 1,
+        "storm": False,
+        "kind": "Frc",
+    }
+
+
+def forecast_response(intervals: int, start: date = SAMPLE_DAY) -> List[dict]:
+    """
+    Прогноз из нескольких трехчасовых интервалов, начиная с полуночи.
+
+    :param intervals: Количество интервалов
+    :param start: Дата первого интервала
+    :return: Список интервалов
+    """
+    return [
+        forecast_interval((index * 3) % 24, start + timedelta(days=index * 3 // 24))
+        for index in range(intervals)
+    ]
+
+
+def current_response(day: date = SAMPLE_DAY) -> dict:
+    """
+    Ответ на запрос текущей погоды.
+
+    :param day: Дата ответа
+    :return: Dict
+    """
+    return forecast_interval(12, day)
+
+
+def envelope(response) -> dict:
+    """
+    Оборачивает данные в конверт ответа API.
+
+    :param response: Данные прогноза
+    :return: Dict с полями meta и response
+    """
+    return {"meta": {"message": "", "code": "200"}, "response": response}
@@ -0,0 +1,124 @@
+"""
+Срезы единого многодневного прогноза: текущий интервал, сегодня и завтра.
+
+Интервалы выбираются по местному времени из date.local, поэтому один ответ
+API на ячейку обслуживает все три команды.
+"""
+from datetime import datetime, timedelta, timezone, tzinfo
+from typing import List, Optional, Union
+
+from config import OFFSET_DATE
+
+# Тип кэша для единого прогноза
+KIND = "forecast"
+# Шаг интервалов прогноза Gismeteo
+INTERVAL = timedelta(hours=3)
+
+
+def interval_time(interval: dict) -> datetime:
+    """
+    Начало интервала по местному времени.
+
+    :param interval: Интервал прогноза
+    :return: datetime с часовым поясом места, если API его сообщил
+    """
+    moment = datetime.fromisoformat(interval["date"]["local"])
+    offset = interval["date"].get("time_zone_offset")
+    if moment.tzinfo is None and offset is not None:
+        moment = moment.replace(tzinfo=timezone(timedelta(minutes=offset)))
+    return moment
+
+
+def local_now(intervals: List[dict], now: datetime = None) -> datetime:
+    """
+    Текущее время в часовом поясе места прогноза.
+
+    :param intervals: Интервалы прогноза
+    :param now: Текущий момент с часовым поясом (для тестов и бенчмарков)
+    :return: datetime
+    """
+    zone: Optional[tzinfo] = interval_time(intervals[0]).tzinfo
+    if zone is None:
+        return (now.astimezone() if now else datetime.now()).replace(tzinfo=None)
+    return (now or datetime.now(timezone.utc)).astimezone(zone)
+
+
+def day_view(intervals: List[dict], days_ahead: int, now: datetime = None) -> List[dict]:
+    """
+    Интервалы одного местного дня.
+
+    :param intervals: Интервалы прогноза
+    :param days_ahead: 0 — сегодня, 1 — завтра
+    :param now: Текущий момент
+    :return: Интервалы дня, пустой список, если их нет в прогнозе
+    """
+    day = (local_now(intervals, now).date() + timedelta(days=days_ahead)).isoformat()
+    return [interval for interval in intervals if interval["date"]["local"][:OFFSET_DATE] == day]
+
+
+def current_view(intervals: List[dict], now: datetime = None) -> Optional[dict]:
+    """
+    Интервал, в который попадает текущий момент.
+
+    :param intervals: Интервалы прогноза по возрастанию времени
+    :param now: Текущий момент
+    :return: Интервал или None, если прогноз его не покрывает
+    """
+    moment = local_now(intervals, now)
+    for interval in intervals:
+        start = interval_time(interval)
+        if start <= moment < start + INTERVAL:
+            return interval
+    return None
+
+
+def is_outdated(response: Union[List[dict], dict, None], now: datetime = None) -> bool:
+    """
+    Начинается ли прогноз раньше сегодняшнего местного дня, например если он получен до полуночи.
+
+    :param response: Интервалы единого прогноза
+    :param now: Текущий момент
+    :return: True, если первый интервал относится к прошедшему дню
+    """
+    if not response or not isinstance(response, list):
+        return False
+    return interval_time(response[0]).date() < local_now(response, now).date()
+
+
+def select_view(kind: str, response: Union[List[dict], dict, None], now: datetime = None) -> Union[List[dict], dict, None]:
+    """
+    Вырезает из единого прогноза данные для команды.
+
+    :param kind: Тип прогноза: now, today, tomorrow
+    :param response: Интервалы единого прогноза
+    :param now: Текущий момент
+    :return: Интервал для now, список интервалов для today и tomorrow или None, если данных нет
+    """
+    if not response or not isinstance(response, list):
+        return None
+    if kind == "now":
+        return current_view(response, now)
+    return day_view(response, 1 if kind == "tomorrow" else 0, now) or None
+
+
+if __name__ == "__main__":
+    import time
+
+    from api.samples import forecast_response
+
+    intervals = forecast_response(16)
+    # Образец начинается 9 марта 2026 в 00:00 по Москве
+    moment = datetime(2026, 3, 9, 13, 30, tzinfo=timezone(timedelta(hours=3)))
+    assert select_view("now", intervals, moment)["date"]["local"].endswith("12:00:00+03:00")
+    assert len(select_view("today", intervals, moment)) == 8
+    assert select_view("tomorrow", intervals, moment)[0]["date"]["local"].startswith("2026-03-10")
+    assert select_view("tomorrow", intervals, moment + timedelta(days=1)) is None
+    assert not is_outdated(intervals, moment) and is_outdated(intervals, moment + timedelta(days=1))
+
+    runs = 10000
+    started = time.perf_counter()
+    for _ in range(runs):
+        for kind in ("now", "today", "tomorrow"):
+            select_view(kind, intervals, moment)
+    elapsed = time.perf_counter() - started
+    print(f"select_view: {elapsed / runs / 3 * 1e6:.1f} us per view of {len(intervals)} intervals")
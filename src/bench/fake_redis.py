@@ -0,0 +1,198 @@
+"""
+Минимальный Redis в памяти процесса (протоколы RESP2 и RESP3) для нагрузочных замеров без Redis.
+
+Поддерживает команды, которые использует бот: строки с TTL, MGET, MULTI/EXEC,
+PUBLISH/SUBSCRIBE. Lua-скрипты не выполняются: EVALSHA всегда возвращает 1,
+то есть ограничение частоты запросов к Gismeteo на заглушке не действует.
+"""
+import asyncio
+import hashlib
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class Error(str):
+    pass
+
+
+class Status(str):
+    pass
+
+
+class Push(list):
+    pass
+
+
+class Map(dict):
+    pass
+
+
+OK = Status("OK")
+QUEUED = Status("QUEUED")
+
+
+def encode(value, resp3: bool = False) -> bytes:
+    if value is None:
+        return b"_\r\n" if resp3 else b"$-1\r\n"
+    if isinstance(value, Error):
+        return b"-" + value.encode() + b"\r\n"
+    if isinstance(value, Status):
+        return b"+" + value.encode() + b"\r\n"
+    if isinstance(value, bool):
+        return b":%d\r\n" % int(value)
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, str):
+        value = value.encode()
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    if isinstance(value, Map):
+        items = [item for pair in value.items() for item in pair]
+        if not resp3:
+            return encode(items)
+        return b"%%%d\r\n" % len(value) + b"".join(encode(item, resp3) for item in items)
+    prefix = b">" if resp3 and isinstance(value, Push) else b"*"
+    return prefix + b"%d\r\n" % len(value) + b"".join(encode(item, resp3) for item in value)
+
+
+async def read_command(reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+    line = await reader.readline()
+    if not line:
+        return None
+    count = int(line[1:])
+    arguments = []
+    for _ in range(count):
+        size = int((await reader.readline())[1:])
+        arguments.append((await reader.readexactly(size + 2))[:-2])
+    return arguments
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+        self.subscribers: Dict[bytes, List[asyncio.StreamWriter]] = {}
+        self.resp3 = set()
+        self.clients = set()
+        self.commands = 0
+        self.server: asyncio.AbstractServer = None
+        self.port: int = None
+
+    def _get(self, key: bytes) -> Optional[bytes]:
+        item = self.data.get(key)
+        if item is None:
+            return None
+        value, expire_at = item
+        if expire_at is not None and expire_at <= time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+    def _set(self, key: bytes, value: bytes, ttl: Optional[float]) -> None:
+        self.data[key] = (value, time.monotonic() + ttl if ttl is not None else None)
+
+    def execute(self, name: str, args: List[bytes], writer: asyncio.StreamWriter):
+        if name == "GET":
+            return self._get(args[0])
+        if name == "MGET":
+            return [self._get(key) for key in args]
+        if name == "SETEX":
+            self._set(args[0], args[2], int(args[1]))
+            return OK
+        if name == "SET":
+            options = [arg.upper() for arg in args[2:]]
+            ttl = None
+            if b"EX" in options:
+                ttl = int(args[2 + options.index(b"EX") + 1])
+            if b"PX" in options:
+                ttl = int(args[2 + options.index(b"PX") + 1]) / 1000
+            if b"NX" in options and self._get(args[0]) is not None:
+                return None
+            self._set(args[0], args[1], ttl)
+            return OK
+        if name == "PTTL":
+            if self._get(args[0]) is None:
+                return -2
+            expire_at = self.data[args[0]][1]
+            return -1 if expire_at is None else int((expire_at - time.monotonic()) * 1000)
+        if name == "DEL":
+            return sum(self.data.pop(key, None) is not None for key in args)
+        if name == "PUBLISH":
+            receivers = self.subscribers.get(args[0], [])
+            for receiver in receivers:
+                receiver.write(encode(Push([b"message", args[0], args[1]]), receiver in self.resp3))
+            return len(receivers)
+        if name == "SUBSCRIBE":
+            for channel in args:
+                self.subscribers.setdefault(channel, []).append(writer)
+                writer.write(encode(Push([b"subscribe", channel, 1]), writer in self.resp3))
+            return Ellipsis
+        if name == "UNSUBSCRIBE":
+            for channel in args:
+                if writer in self.subscribers.get(channel, []):
+                    self.subscribers[channel].remove(writer)
+                writer.write(encode(Push([b"unsubscribe", channel, 0]), writer in self.resp3))
+            return Ellipsis
+        if name in ("EVALSHA", "EVAL"):
+            return 1
+        if name == "SCRIPT":
+            return hashlib.sha1(args[1]).hexdigest()
+        if name == "HELLO":
+            protocol = int(args[0]) if args else 2
+            if protocol == 3:
+                self.resp3.add(writer)
+            return Map({
+                b"server": b"redis", b"version": b"7.2.0", b"proto": protocol, b"id": 1,
+                b"mode": b"standalone", b"role": b"master", b"modules": [],
+            })
+        if name == "PING":
+            return Status("PONG")
+        if name in ("CLIENT", "SELECT", "FLUSHALL"):
+            if name == "FLUSHALL":
+                self.data.clear()
+            return OK
+        return Error(f"ERR unknown command '{name}'")
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        transaction = None
+        self.clients.add(writer)
+        try:
+            while True:
+                command = await read_command(reader)
+                if command is None:
+                    break
+                self.commands += 1
+                name, args = command[0].decode().upper(), command[1:]
+                if name == "MULTI":
+                    transaction = []
+                    reply = OK
+                elif name == "EXEC":
+                    reply = [self.execute(*queued, writer) for queued in transaction or []]
+                    transaction = None
+                elif transaction is not None:
+                    transaction.append((name, args))
+                    reply = QUEUED
+                else:
+                    reply = self.execute(name, args, writer)
+                if reply is not Ellipsis:
+                    writer.write(encode(reply, writer in self.resp3))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for receivers in self.subscribers.values():
+                if writer in receivers:
+                    receivers.remove(writer)
+            self.resp3.discard(writer)
+            self.clients.discard(writer)
+            writer.close()
+
+    async def start(self, port: int = 0) -> None:
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self.server.close()
+        # С Python 3.12 wait_closed ждет закрытия всех клиентских соединений
+        for writer in list(self.clients):
+            writer.close()
+        await self.server.wait_closed()
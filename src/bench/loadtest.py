@@ -0,0 +1,181 @@
+"""
+Нагрузочный замер обработчиков прогноза без внешних сервисов.
+
+Запускает заглушки Telegram Bot API, Gismeteo и Redis в одном процессе,
+прогоняет через настоящие обработчики main.py синтетические обновления
+и печатает результат в JSON для сравнения между версиями:
+
+python -m bench.loadtest --requests 5000 --concurrency 64 --output result.json
+
+С --redis используется Redis из REDIS_HOST/REDIS_PORT, с --database координаты
+пользователей записываются в базу из DATABASE_URL или PG*, иначе только в кэш координат.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+from typing import List
+
+from bench.fake_redis import FakeRedis
+from bench.stub_gismeteo import StubGismeteo
+from bot.fake_telegram import FAKE_TOKEN, FakeBotApi, make_command_update
+
+COMMANDS = ("/current_weather", "/weather_today", "/weather_tomorrow")
+# Города, вокруг которых разбросаны пользователи
+CITIES = [(55.75, 37.62), (59.94, 30.31), (56.84, 60.6), (55.03, 82.92), (43.12, 131.89)]
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline load test of the forecast handlers")
+    parser.add_argument("--requests", type=int, default=2000, help="Number of updates")
+    parser.add_argument("--concurrency", type=int, default=64, help="Updates processed at the same time")
+    parser.add_argument("--users", type=int, default=500, help="Number of distinct chats")
+    parser.add_argument("--spread", type=float, default=0.2, help="Spread of user coordinates around a city, degrees")
+    parser.add_argument("--latency", type=float, default=50, help="Mean Gismeteo latency, ms")
+    parser.add_argument("--jitter", type=float, default=10, help="Gismeteo latency jitter, ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of Gismeteo 500 responses")
+    parser.add_argument("--commands", default=",".join(COMMANDS), help="Comma-separated command mix")
+    parser.add_argument("--redis", action="store_true", help="Use Redis from REDIS_HOST/REDIS_PORT")
+    parser.add_argument("--database", action="store_true", help="Store coordinates in the configured database")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the JSON result to this file")
+    return parser.parse_args()
+
+
+async def run(args: argparse.Namespace) -> dict:
+    redis = None
+    if not args.redis:
+        redis = FakeRedis()
+        await redis.start()
+        os.environ["REDIS_HOST"] = "127.0.0.1"
+        os.environ["REDIS_PORT"] = str(redis.port)
+    gismeteo = StubGismeteo(args.latency / 1000, args.jitter / 1000, args.error_rate, args.seed)
+    await gismeteo.start()
+    telegram = FakeBotApi()
+    await telegram.start()
+
+    # Конфигурация читается при импорте, поэтому модули бота импортируются после запуска заглушек
+    os.environ["GISMETEO_BASE_URL"] = gismeteo.base_url
+    os.environ["TELEGRAM_TOKEN"] = FAKE_TOKEN
+    os.environ.setdefault("API_KEY", "stub")
+    for name, value in (("PGHOST", "localhost"), ("PGPORT", "5432"), ("POSTGRES_DB", "weather"),
+                        ("POSTGRES_USER", "weather"), ("POSTGRES_PASSWORD", "weather")):
+        os.environ.setdefault(name, value)
+
+    from telegram import Update
+    from telegram.ext import ApplicationBuilder
+
+    import main
+    from api.http_client import close_http_session, start_http_session
+    from bot.dispatch import ChatOrderedUpdateProcessor
+    from cache.coordinates_cache import set_cached_coordinates
+    from cache.redis_cache import close_redis_clients, get_cache_stats
+    from db.database import dispose_engine
+    from db.query.orm import create_data_base_and_tables, update_coordinates
+
+    processor = ChatOrderedUpdateProcessor(max_concurrent=args.concurrency)
+    application = (
+        ApplicationBuilder()
+        .token(FAKE_TOKEN)
+        .base_url(telegram.base_url)
+        .updater(None)
+        .concurrent_updates(processor)
+        .build()
+    )
+    main.register_handlers(application)
+    handler_errors = []
+
+    async def on_error(update, context) -> None:
+        handler_errors.append(type(context.error).__name__)
+
+    application.add_error_handler(on_error)
+    await application.initialize()
+    await start_http_session()
+
+    rng = random.Random(args.seed)
+    if args.database:
+        await create_data_base_and_tables()
+    for chat_id in range(1, args.users + 1):
+        city_latitude, city_longitude = rng.choice(CITIES)
+        latitude = round(city_latitude + rng.uniform(-args.spread, args.spread), 6)
+        longitude = round(city_longitude + rng.uniform(-args.spread, args.spread), 6)
+        if args.database:
+            await update_coordinates(f"user{chat_id}", "User", chat_id, latitude, longitude)
+        else:
+            await set_cached_coordinates(chat_id, latitude, longitude)
+
+    commands = args.commands.split(",")
+    updates = [
+        Update.de_json(
+            make_command_update(update_id, rng.randint(1, args.users), rng.choice(commands)),
+            application.bot,
+        )
+        for update_id in range(1, args.requests + 1)
+    ]
+
+    latencies = []
+    offered = asyncio.Semaphore(args.concurrency)
+
+    async def submit(update: Update) -> None:
+        async with offered:
+            started = time.perf_counter()
+            await processor.process_update(update, application.process_update(update))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(submit(update) for update in updates))
+    elapsed = time.perf_counter() - started
+
+    await close_http_session()
+    await application.shutdown()
+    await close_redis_clients()
+    if args.database:
+        await dispose_engine()
+    await telegram.stop()
+    await gismeteo.stop()
+    if redis is not None:
+        await redis.stop()
+
+    latencies.sort()
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "users": args.users,
+        "commands": commands,
+        "gismeteo_latency_ms": args.latency,
+        "gismeteo_error_rate": args.error_rate,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(args.requests / elapsed, 1),
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies) * 1000, 2),
+            "p50": round(percentile(latencies, 0.5) * 1000, 2),
+            "p90": round(percentile(latencies, 0.9) * 1000, 2),
+            "p99": round(percentile(latencies, 0.99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2),
+        },
+        "upstream_calls": dict(gismeteo.calls),
+        "upstream_errors": dict(gismeteo.errors),
+        "messages_sent": len(telegram.sent),
+        "handler_errors": len(handler_errors),
+        "dropped_updates": processor.dropped,
+        "cache": get_cache_stats(),
+        "redis_commands": redis.commands if redis is not None else None,
+    }
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    result = json.dumps(asyncio.run(run(arguments)), ensure_ascii=False, indent=2)
+    if arguments.output:
+        with open(arguments.output, "w") as output:
+            output.write(result)
+    print(result)
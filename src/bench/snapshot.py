@@ -0,0 +1,94 @@
+"""
+Замер снимка прогнозов на диске и проверка ответов при недоступном Redis.
+
+Redis указывает на закрытый порт, снимок пишется во временный каталог:
+
+python -m bench.snapshot --entries 20000
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import tempfile
+import time
+
+
+def closed_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+async def measure(entries: int, directory: str) -> dict:
+    from api.samples import forecast_response
+    from cache.codec import decode_forecast, encode_forecast
+    from cache.memory_cache import memory_cache
+    from cache.redis_cache import (get_cached_forecast, get_stale_forecast,
+                                   set_cached_forecast)
+    from cache.snapshot import ForecastSnapshot, forecast_snapshot
+
+    result = {}
+    data = encode_forecast(forecast_response(16))
+    path = os.path.join(directory, "bench.sqlite3")
+
+    snapshot = ForecastSnapshot(path, flush_interval=3600, max_entries=entries // 2)
+    await snapshot.start()
+    timings = []
+    for index in range(entries):
+        started = time.perf_counter()
+        snapshot.put(f"forecast:cell{index}", "forecast", data)
+        timings.append(time.perf_counter() - started)
+    result["put_us"] = round(statistics.median(timings) * 1e6, 2)
+
+    started = time.perf_counter()
+    await snapshot.flush()
+    result["flush_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    result["entries_bound"] = snapshot.max_entries
+    result["kept_after_trim"] = len(await snapshot.load())
+
+    started = time.perf_counter()
+    for index in range(entries // 2, entries // 2 + 1000):
+        await snapshot.get(f"forecast:cell{index}")
+    result["get_us"] = round((time.perf_counter() - started) / 1000 * 1e6, 1)
+    await snapshot.stop()
+
+    # Перезапуск: новый объект читает тот же файл
+    snapshot = ForecastSnapshot(path, max_entries=entries // 2)
+    await snapshot.start()
+    started = time.perf_counter()
+    loaded = await snapshot.load()
+    result["reload_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    result["reloaded"] = len(loaded)
+    await snapshot.stop()
+
+    # Redis недоступен: запись не падает, чтение отвечает из снимка
+    await forecast_snapshot.start()
+    response = forecast_response(8)
+    await set_cached_forecast("forecast", 55.75, 37.62, response)
+    # Кодек хранит только поля, нужные для ответа
+    response = decode_forecast(encode_forecast(response))
+    memory_cache.clear()
+    result["redis_down_cached"] = await get_cached_forecast("forecast", 55.75, 37.62) == response
+    await forecast_snapshot.flush()
+    result["redis_down_stale"] = await get_stale_forecast("forecast", 55.75, 37.62) == response
+    result["redis_down_unknown_cell"] = await get_cached_forecast("forecast", 43.12, 131.89)
+    await forecast_snapshot.stop()
+    result["snapshot_metrics"] = dict(forecast_snapshot.metrics)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Forecast snapshot benchmark")
+    parser.add_argument("--entries", type=int, default=20000)
+    arguments = parser.parse_args()
+
+    for name, value in (("API_KEY", "stub"), ("TELEGRAM_TOKEN", "stub"), ("PGHOST", "localhost"),
+                        ("POSTGRES_DB", "weather"), ("POSTGRES_USER", "weather"), ("POSTGRES_PASSWORD", "weather")):
+        os.environ.setdefault(name, value)
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["REDIS_HOST"] = "127.0.0.1"
+        os.environ["REDIS_PORT"] = str(closed_port())
+        os.environ["FORECAST_SNAPSHOT_PATH"] = os.path.join(directory, "forecast_snapshot.sqlite3")
+        print(json.dumps(asyncio.run(measure(arguments.entries, directory)), ensure_ascii=False, indent=2))
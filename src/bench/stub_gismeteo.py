@@ -0,0 +1,77 @@
+"""
+Заглушка API Gismeteo с настраиваемой задержкой и долей ошибок.
+"""
+import asyncio
+import json
+import random
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from aiohttp import web
+
+from api.samples import current_response, envelope, forecast_response
+
+INTERVALS_PER_DAY = 8
+
+
+class StubGismeteo:
+    """
+    Отдает записанные ответы current, forecast и forecast/aggregate.
+
+    :param latency: Средняя задержка ответа в секундах
+    :param jitter: Разброс задержки в секундах
+    :param error_rate: Доля ответов 500
+    """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.01, error_rate: float = 0.0, seed: int = 1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls = Counter()
+        self.errors = Counter()
+        self._random = random.Random(seed)
+        # Образцы заданы по московскому времени и начинаются с текущих суток
+        today = datetime.now(timezone(timedelta(hours=3))).date()
+        self._current = json.dumps(envelope(current_response(today))).encode()
+        self._forecasts = {
+            days: json.dumps(envelope(forecast_response(days * INTERVALS_PER_DAY, today))).encode()
+            for days in (1, 2, 3)
+        }
+        self.runner: web.AppRunner = None
+        self.port: int = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def _respond(self, endpoint: str, body: bytes) -> web.Response:
+        self.calls[endpoint] += 1
+        await asyncio.sleep(max(0.0, self._random.gauss(self.latency, self.jitter)))
+        if self._random.random() < self.error_rate:
+            self.errors[endpoint] += 1
+            return web.Response(status=500, text="Internal Server Error")
+        return web.Response(body=body, content_type="application/json")
+
+    async def current(self, request: web.Request) -> web.Response:
+        return await self._respond("current", self._current)
+
+    async def forecast(self, request: web.Request) -> web.Response:
+        days = request.query.get("days", "1")
+        return await self._respond("forecast", self._forecasts.get(int(days) if days.isdigit() else 1, self._forecasts[1]))
+
+    async def aggregate(self, request: web.Request) -> web.Response:
+        return await self._respond("aggregate", self._forecasts[2])
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/v2/weather/current/", self.current)
+        app.router.add_get("/v2/weather/forecast/", self.forecast)
+        app.router.add_get("/v2/weather/forecast/aggregate/", self.aggregate)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        await self.runner.cleanup()
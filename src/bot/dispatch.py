@@ -0,0 +1,211 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict
+
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import BaseUpdateProcessor, filters
+
+from config import (UPDATE_CONCURRENCY, UPDATE_MAX_IN_FLIGHT,
+                    UPDATE_MAX_PENDING_PER_CHAT)
+from logs.pipeline import log_context
+
+TOO_MANY_UPDATES = "Слишком много запросов. Дождитесь ответа на предыдущие и повторите команду."
+
+
+class ChatQueue:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = 0
+        # Пользователю уже сообщили, что команды отброшены
+        self.notified = False
+
+
+def update_context(update: object) -> dict:
+    """
+    Поля корреляции обновления: update_id, chat_id и команда.
+
+    :param update: Объект Update
+    :return: Dict с полями
+    """
+    if not isinstance(update, Update):
+        return {}
+    context = {"update_id": update.update_id}
+    if update.effective_chat:
+        context["chat_id"] = update.effective_chat.id
+    message = update.effective_message
+    if message is not None:
+        if message.text and message.text.startswith("/"):
+            context["command"] = message.text.split(maxsplit=1)[0]
+        elif message.location:
+            context["command"] = "location"
+    return context
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обрабатывает обновления разных чатов параллельно, а одного чата — по порядку.
+
+    max_in_flight ограничивает число принятых обновлений (выполняемых и ожидающих),
+    max_concurrent — число одновременно выполняемых, max_pending_per_chat — очередь
+    одного чата: лишние команды чата отбрасываются, а пользователь получает ответ
+    об этом. Геопозиция не отбрасывается никогда, иначе следующий прогноз
+    был бы построен по старым координатам.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = UPDATE_CONCURRENCY,
+        max_in_flight: int = UPDATE_MAX_IN_FLIGHT,
+        max_pending_per_chat: int = UPDATE_MAX_PENDING_PER_CHAT,
+    ):
+        super().__init__(max_in_flight)
+        self.max_pending_per_chat = max_pending_per_chat
+        self._running = asyncio.Semaphore(max_concurrent)
+        self._chats: Dict[int, ChatQueue] = {}
+        self.dropped = 0
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        # Поля корреляции для всех записей лога, сделанных при обработке обновления
+        token = log_context.set(update_context(update))
+        try:
+            await self._process(update, coroutine)
+        finally:
+            log_context.reset(token)
+
+    async def _process(self, update: object, coroutine: Awaitable[Any]) -> None:
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            async with self._running:
+                await coroutine
+            return
+
+        queue = self._chats.get(chat.id)
+        if queue is None:
+            queue = self._chats[chat.id] = ChatQueue()
+        if queue.pending >= self.max_pending_per_chat and not filters.LOCATION.check_update(update):
+            self.dropped += 1
+            logging.warning("Too many pending updates for chat_id: %s, update %s was dropped", chat.id, update.update_id)
+            coroutine.close()
+            if not queue.notified:
+                queue.notified = True
+                try:
+                    await chat.send_message(TOO_MANY_UPDATES)
+                except TelegramError as e:
+                    logging.warning("Too many updates notice was not sent to chat_id: %s: %s", chat.id, e)
+            return
+
+        queue.pending += 1
+        try:
+            # asyncio.Lock будит ожидающих по очереди, поэтому порядок обновлений чата сохраняется
+            async with queue.lock:
+                async with self._running:
+                    await coroutine
+        finally:
+            queue.pending -= 1
+            if not queue.pending:
+                del self._chats[chat.id]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+if __name__ == "__main__":
+    import statistics
+    import time
+
+    from telegram.ext import ApplicationBuilder, MessageHandler, filters
+
+    from bot.fake_telegram import (FAKE_TOKEN, FakeBotApi, make_command_update,
+                                   make_location_update)
+
+    UPDATES = 400
+    SLOW_CHATS = 10
+    CHATS = 100
+
+    async def run(processor) -> dict:
+        latencies = []
+        order: Dict[int, list] = {}
+        received = {}
+
+        async def handler(update, context):
+            chat_id = update.effective_chat.id
+            # Медленный ответ Gismeteo у части пользователей
+            await asyncio.sleep(0.2 if chat_id < SLOW_CHATS else 0.01)
+            order.setdefault(chat_id, []).append(update.update_id)
+            if chat_id >= SLOW_CHATS:
+                latencies.append(time.perf_counter() - received[update.update_id])
+
+        api = FakeBotApi()
+        await api.start()
+        builder = ApplicationBuilder().token(FAKE_TOKEN).base_url(api.base_url).updater(None)
+        builder = builder.concurrent_updates(processor) if processor else builder
+        application = builder.build()
+        application.add_handler(MessageHandler(filters.ALL, handler))
+        await application.initialize()
+
+        started = time.perf_counter()
+        tasks = []
+        for update_id in range(1, UPDATES + 1):
+            update = Update.de_json(make_command_update(update_id, update_id % CHATS, "/current_weather"), application.bot)
+            received[update_id] = time.perf_counter()
+            tasks.append(
+                asyncio.create_task(
+                    application.update_processor.process_update(update, application.process_update(update))
+                )
+            )
+            await asyncio.sleep(0.001)
+        await asyncio.gather(*tasks)
+        await application.shutdown()
+        await api.stop()
+        assert all(ids == sorted(ids) for ids in order.values())
+        latencies.sort()
+        return {
+            "seconds": round(time.perf_counter() - started, 2),
+            "p50_ms": round(statistics.median(latencies) * 1000, 1),
+            "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 1),
+        }
+
+    async def flood() -> dict:
+        """
+        Один чат присылает команды быстрее, чем они выполняются, а в конце — геопозицию.
+        """
+        handled = []
+
+        async def handler(update, context):
+            await asyncio.sleep(0.05)
+            handled.append("location" if update.effective_message.location else "command")
+
+        api = FakeBotApi()
+        await api.start()
+        processor = ChatOrderedUpdateProcessor(max_pending_per_chat=3)
+        application = (
+            ApplicationBuilder().token(FAKE_TOKEN).base_url(api.base_url).updater(None)
+            .concurrent_updates(processor).build()
+        )
+        application.add_handler(MessageHandler(filters.ALL, handler))
+        await application.initialize()
+        updates = [make_command_update(update_id, 1, "/current_weather") for update_id in range(1, 21)]
+        updates.append(make_location_update(21, 1, 55.75, 37.62))
+        tasks = []
+        for data in updates:
+            update = Update.de_json(data, application.bot)
+            tasks.append(asyncio.create_task(processor.process_update(update, application.process_update(update))))
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        await application.shutdown()
+        await api.stop()
+        notices = [message for message in api.sent if message.get("text") == TOO_MANY_UPDATES]
+        assert handled[-1] == "location", handled
+        assert processor.dropped == 20 - handled.count("command") and len(notices) == 1
+        return {"handled": len(handled), "dropped": processor.dropped, "notices": len(notices)}
+
+    async def main():
+        print("sequential:", await run(None))
+        print("chat-ordered concurrent:", await run(ChatOrderedUpdateProcessor()))
+        print("flooded chat:", await flood())
+
+    asyncio.run(main())
@@ -0,0 +1,222 @@
+"""
+Локальная заглушка Telegram Bot API и генератор синтетических обновлений.
+
+Используется для нагрузочных замеров без обращения к Telegram:
+python -m bot.fake_telegram --mode webhook --updates 2000
+"""
+import asyncio
+import itertools
+import json
+import time
+from typing import List
+
+import aiohttp
+from aiohttp import web
+
+FAKE_TOKEN = "123456:FAKE-TOKEN"
+
+
+def make_command_update(update_id: int, chat_id: int, command: str) -> dict:
+    """
+    Синтетическое обновление с командой от пользователя.
+
+    :param update_id: ID обновления
+    :param chat_id: ID чата
+    :param command: Команда, например /start
+    :return: Dict в формате Bot API
+    """
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "User", "username": f"user{chat_id}"},
+            "text": command,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+        },
+    }
+
+
+def make_location_update(update_id: int, chat_id: int, latitude: float, longitude: float) -> dict:
+    """
+    Синтетическое обновление с геопозицией пользователя.
+
+    :param update_id: ID обновления
+    :param chat_id: ID чата
+    :param latitude: широта
+    :param longitude: долгота
+    :return: Dict в формате Bot API
+    """
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "User", "username": f"user{chat_id}"},
+            "location": {"latitude": latitude, "longitude": longitude},
+        },
+    }
+
+
+class FakeBotApi:
+    """
+    Заглушка Bot API: отдает обновления через getUpdates и принимает sendMessage.
+    """
+
+    def __init__(self):
+        self.updates: List[dict] = []
+        self.sent: List[dict] = []
+        self.calls = 0
+        self._new_updates = asyncio.Event()
+        self._sent_changed = asyncio.Event()
+        self._message_ids = itertools.count(1)
+        self.runner: web.AppRunner = None
+        self.port: int = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    def push(self, updates: List[dict]) -> None:
+        self.updates.extend(updates)
+        self._new_updates.set()
+
+    async def wait_sent(self, count: int) -> None:
+        while len(self.sent) < count:
+            self._sent_changed.clear()
+            await self._sent_changed.wait()
+
+    @staticmethod
+    async def _params(request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        params = {}
+        for key, value in (await request.post()).items():
+            try:
+                params[key] = json.loads(value)
+            except (TypeError, ValueError):
+                params[key] = value
+        return params
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.calls += 1
+        method = request.match_info["method"]
+        params = await self._params(request)
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        elif method == "getUpdates":
+            result = await self._get_updates(int(params.get("offset") or 0), float(params.get("timeout") or 0))
+        elif method == "sendMessage":
+            result = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(params["chat_id"]), "type": "private"},
+                "text": params.get("text", ""),
+            }
+            self.sent.append(result)
+            self._sent_changed.set()
+        elif method in ("setWebhook", "deleteWebhook", "setMyCommands"):
+            result = True
+        else:
+            return web.json_response({"ok": False, "error_code": 404, "description": "Not Found"}, status=404)
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, offset: int, timeout: float) -> List[dict]:
+        self.updates = [update for update in self.updates if update["update_id"] >= offset]
+        if not self.updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:100]
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        await self.runner.cleanup()
+
+
+async def post_updates(url: str, updates: List[dict], secret: str = None, concurrency: int = 50) -> List[int]:
+    """
+    Отправляет обновления на webhook, как это делает Telegram.
+
+    :param url: URL webhook
+    :param updates: Список обновлений
+    :param secret: Секретный токен webhook
+    :param concurrency: Число одновременных запросов
+    :return: Коды ответов
+    """
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with aiohttp.ClientSession() as session:
+        async def post(update: dict) -> int:
+            async with semaphore:
+                while True:
+                    async with session.post(url, json=update, headers=headers) as response:
+                        if response.status != 429:
+                            return response.status
+                    await asyncio.sleep(0.01)
+
+        return await asyncio.gather(*(post(update) for update in updates))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from telegram.ext import ApplicationBuilder, CommandHandler
+
+    from bot.webhook import create_webhook_app
+    from main import start
+
+    parser = argparse.ArgumentParser(description="Updates/sec for polling vs webhook")
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="webhook")
+    parser.add_argument("--updates", type=int, default=2000)
+    args = parser.parse_args()
+
+    async def main():
+        api = FakeBotApi()
+        await api.start()
+        builder = ApplicationBuilder().token(FAKE_TOKEN).base_url(api.base_url).concurrent_updates(64)
+        if args.mode == "webhook":
+            builder = builder.updater(None)
+        application = builder.build()
+        application.add_handler(CommandHandler("start", start))
+        await application.initialize()
+        await application.start()
+
+        updates = [make_command_update(index, 1000 + index % 500, "/start") for index in range(1, args.updates + 1)]
+        started = time.perf_counter()
+        if args.mode == "webhook":
+            runner = web.AppRunner(create_webhook_app(application, secret="secret"))
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            await post_updates(f"http://127.0.0.1:{port}/telegram", updates, secret="secret")
+            await api.wait_sent(len(updates))
+            elapsed = time.perf_counter() - started
+            await runner.cleanup()
+        else:
+            await application.updater.start_polling(poll_interval=0, timeout=1)
+            api.push(updates)
+            await api.wait_sent(len(updates))
+            elapsed = time.perf_counter() - started
+            await application.updater.stop()
+
+        await application.stop()
+        await application.shutdown()
+        await api.stop()
+        print(json.dumps({"mode": args.mode, "updates": len(updates), "seconds": round(elapsed, 3), "updates_per_second": round(len(updates) / elapsed, 1)}))
+
+    asyncio.run(main())
@@ -0,0 +1,375 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import (Awaitable, Callable, Dict, Iterable, List, NamedTuple,
+                    Optional, Tuple)
+from zoneinfo import ZoneInfo
+
+from telegram import Bot
+from telegram.error import Forbidden, RetryAfter, TelegramError
+from telegram.ext import Application, ContextTypes
+
+from api.parser import parse_forecast
+from api.resilience import TokenBucket
+from api.views import KIND as UNIFIED_KIND
+from api.views import select_view
+from cache.geo import Bucket, quantize
+from cache.redis_cache import get_cached_forecasts, get_stale_forecast
+from config import (FORECAST_SOURCE, SUBSCRIPTION_CLAIM_BATCH,
+                    SUBSCRIPTION_CLAIM_LEASE, SUBSCRIPTION_FETCH_CONCURRENCY,
+                    SUBSCRIPTION_INTERVAL, SUBSCRIPTION_PER_CHAT_INTERVAL,
+                    SUBSCRIPTION_SEND_RATE, SUBSCRIPTION_SEND_WORKERS,
+                    SUBSCRIPTION_TIMEZONE)
+from db.query.orm import claim_due_subscribers, mark_delivered, unsubscribe
+from render.renderer import render_forecast
+
+KIND = "today"
+# Тип кэша, из которого берется прогноз подписчикам
+CACHE_KIND = UNIFIED_KIND if FORECAST_SOURCE == "unified" else KIND
+
+timezone = ZoneInfo(SUBSCRIPTION_TIMEZONE)
+# Сколько доставленных чатов отмечать в базе одним запросом
+MARK_BATCH = 100
+
+
+class Delivery(NamedTuple):
+    chat_id: int
+    messages: List[str]
+
+
+def parse_delivery_time(value: str) -> int:
+    """
+    Переводит время вида ЧЧ:ММ в минуту суток.
+
+    :param value: Время рассылки, например 07:30
+    :return: Минута суток
+    :raise ValueError: Если время указано неверно
+    """
+    hours, _, minutes = value.strip().partition(":")
+    hours, minutes = int(hours), int(minutes or 0)
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(f"Incorrect delivery time: {value}")
+    return hours * 60 + minutes
+
+
+def minute_of_day(moment: datetime) -> int:
+    return moment.hour * 60 + moment.minute
+
+
+def today_view(forecast: Optional[List[dict]]) -> Optional[List[dict]]:
+    """
+    Прогноз на сегодня из кэшированного ответа: единый прогноз обрезается до текущего дня.
+
+    :param forecast: Ответ API из кэша или None
+    :return: Интервалы на сегодня или None
+    """
+    if CACHE_KIND == KIND or forecast is None:
+        return forecast
+    return select_view(KIND, forecast)
+
+
+def group_by_bucket(subscribers: Iterable[Tuple[int, float, float]]) -> Dict[str, Tuple[Bucket, List[int]]]:
+    """
+    Группирует подписчиков по ячейкам кэша прогноза.
+
+    :param subscribers: Строки (chat_id, latitude, longitude)
+    :return: Dict вида {ячейка: (Bucket, [chat_id, ...])}
+    """
+    groups = {}
+    for chat_id, latitude, longitude in subscribers:
+        bucket = quantize(CACHE_KIND, latitude, longitude)
+        group = groups.get(bucket.cell)
+        if group is None:
+            group = groups[bucket.cell] = (bucket, [])
+        group[1].append(chat_id)
+    return groups
+
+
+class DeliveryEngine:
+    """
+    Рассылает ежедневный прогноз подписчикам.
+
+    Подписчики одной ячейки кэша получают один и тот же прогноз: он
+    запрашивается и форматируется один раз, а отправка сообщений идет
+    в пределах лимитов Telegram на бота и на чат.
+    """
+
+    def __init__(
+        self,
+        send_rate: float = SUBSCRIPTION_SEND_RATE,
+        per_chat_interval: float = SUBSCRIPTION_PER_CHAT_INTERVAL,
+        workers: int = SUBSCRIPTION_SEND_WORKERS,
+        fetch_concurrency: int = SUBSCRIPTION_FETCH_CONCURRENCY,
+        claim_batch: int = SUBSCRIPTION_CLAIM_BATCH,
+        claim_lease: float = SUBSCRIPTION_CLAIM_LEASE,
+    ):
+        self.send_rate = send_rate
+        self.per_chat_interval = per_chat_interval
+        self.workers = workers
+        self.fetch_concurrency = fetch_concurrency
+        self.claim_batch = claim_batch
+        self.claim_lease = claim_lease
+        self.fetch: Callable[[float, float], Awaitable[List[dict]]] = None
+        self.metrics = Counter()
+        self._bucket = TokenBucket(send_rate, max(1, int(send_rate)))
+        self._bot: Bot = None
+        self._task: asyncio.Task = None
+
+    async def _acquire(self) -> None:
+        while not self._bucket.try_acquire():
+            await asyncio.sleep(1 / self.send_rate)
+
+    async def render_buckets(self, groups: Dict[str, Tuple[Bucket, List[int]]]) -> Dict[str, List[str]]:
+        """
+        Готовит сообщения для каждой ячейки: берет прогнозы из кэша одним запросом,
+        недостающие запрашивает у API.
+
+        :param groups: Результат group_by_bucket
+        :return: Dict вида {ячейка: сообщения}
+        """
+        cells = list(groups)
+        points = [(CACHE_KIND, groups[cell][0].latitude, groups[cell][0].longitude) for cell in cells]
+        forecasts = dict(zip(cells, map(today_view, await get_cached_forecasts(points))))
+        semaphore = asyncio.Semaphore(self.fetch_concurrency)
+
+        async def load(cell: str) -> None:
+            bucket = groups[cell][0]
+            async with semaphore:
+                try:
+                    forecasts[cell] = today_view(await self.fetch(bucket.latitude, bucket.longitude))
+                    self.metrics["fetched"] += 1
+                except Exception as e:
+                    forecasts[cell] = today_view(
+                        await get_stale_forecast(CACHE_KIND, bucket.latitude, bucket.longitude)
+                    )
+                    logging.error(f"Forecast for subscribers of {cell} was not fetched: {e}")
+
+        await asyncio.gather(*(load(cell) for cell in cells if forecasts[cell] is None))
+
+        messages = {}
+        for cell, forecast in forecasts.items():
+            if forecast is None:
+                self.metrics["skipped"] += len(groups[cell][1])
+                continue
+            messages[cell] = render_forecast(KIND, parse_forecast(forecast, False))
+        return messages
+
+    async def _send(self, bot: Bot, delivery: Delivery) -> bool:
+        """
+        Отправляет сообщения одному чату.
+
+        :param bot: Объект Bot
+        :param delivery: Сообщения для чата
+        :return: True, если отправлены все сообщения
+        """
+        for index, message in enumerate(delivery.messages):
+            if index:
+                await asyncio.sleep(self.per_chat_interval)
+            while True:
+                await self._acquire()
+                try:
+                    await bot.send_message(chat_id=delivery.chat_id, text=message)
+                    self.metrics["sent"] += 1
+                    break
+                except RetryAfter as e:
+                    self.metrics["retried"] += 1
+                    retry_after = e.retry_after
+                    if isinstance(retry_after, timedelta):
+                        retry_after = retry_after.total_seconds()
+                    await asyncio.sleep(retry_after)
+                except Forbidden:
+                    # Пользователь заблокировал бота
+                    self.metrics["blocked"] += 1
+                    try:
+                        await unsubscribe(delivery.chat_id)
+                    except Exception as e:
+                        # Отписка повторится при следующей рассылке этому чату
+                        self.metrics["unsubscribe_failed"] += 1
+                        logging.error(f"Blocked chat_id: {delivery.chat_id} was not unsubscribed: {e}")
+                    return False
+                except TelegramError as e:
+                    self.metrics["failed"] += 1
+                    logging.error(f"Forecast was not sent to chat_id: {delivery.chat_id}: {e}")
+                    return False
+        return True
+
+    async def _mark(self, chat_ids: List[int], today: date) -> None:
+        try:
+            await mark_delivered(chat_ids, today)
+        except Exception as e:
+            # Эти чаты получат прогноз повторно после окончания claim_lease
+            self.metrics["mark_failed"] += len(chat_ids)
+            logging.error(f"Delivery of {len(chat_ids)} forecasts was not recorded: {e}")
+
+    async def fan_out(self, bot: Bot, deliveries: List[Delivery], today: date = None) -> None:
+        """
+        Отправляет сообщения с ограничением частоты и числа одновременных запросов.
+
+        :param bot: Объект Bot
+        :param deliveries: Сообщения для чатов
+        :param today: Дата рассылки: чаты, получившие прогноз, отмечаются в базе пачками
+        :return: None
+        """
+        queue = iter(deliveries)
+        delivered = []
+
+        async def worker() -> None:
+            for delivery in queue:
+                # Ошибка одной доставки не останавливает рассылку остальным чатам
+                try:
+                    sent = await self._send(bot, delivery)
+                except Exception as e:
+                    self.metrics["failed"] += 1
+                    logging.error(f"Forecast was not sent to chat_id: {delivery.chat_id}: {e}")
+                    continue
+                if sent and today is not None:
+                    delivered.append(delivery.chat_id)
+                    if len(delivered) >= MARK_BATCH:
+                        batch = delivered[:]
+                        delivered.clear()
+                        await self._mark(batch, today)
+
+        await asyncio.gather(*(worker() for _ in range(min(self.workers, len(deliveries)))))
+        if delivered:
+            await self._mark(delivered, today)
+
+    async def run_once(self, bot: Bot, now: datetime = None) -> None:
+        """
+        Рассылает прогноз всем подписчикам, время которых наступило.
+
+        :param bot: Объект Bot
+        :param now: Текущее время (для тестов)
+        :return: None
+        """
+        now = now or datetime.now(timezone)
+        self.metrics["runs"] += 1
+        while True:
+            subscribers = await claim_due_subscribers(
+                minute_of_day(now), now.date(), self.claim_batch, self.claim_lease
+            )
+            if not subscribers:
+                return
+            started = time.monotonic()
+            await self.deliver(bot, subscribers, now.date())
+            logging.info(
+                f"Daily forecast was delivered to {len(subscribers)} subscribers "
+                f"in {time.monotonic() - started:.1f} s"
+            )
+            if len(subscribers) < self.claim_batch:
+                return
+
+    async def deliver(
+        self, bot: Bot, subscribers: Iterable[Tuple[int, float, float]], today: date = None
+    ) -> None:
+        """
+        Готовит прогноз для каждой ячейки один раз и рассылает его подписчикам.
+        Подписчики, которым прогноз не отправлен, получат его после окончания claim_lease.
+
+        :param bot: Объект Bot
+        :param subscribers: Строки (chat_id, latitude, longitude)
+        :param today: Дата рассылки, None — не отмечать доставку в базе
+        :return: None
+        """
+        groups = group_by_bucket(subscribers)
+        self.metrics["buckets"] += len(groups)
+        messages = await self.render_buckets(groups)
+        await self.fan_out(
+            bot,
+            [
+                Delivery(chat_id, messages[cell])
+                for cell, (_, chat_ids) in groups.items()
+                if cell in messages
+                for chat_id in chat_ids
+            ],
+            today,
+        )
+
+    async def job(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        await self.run_once(context.bot)
+
+    async def _loop(self) -> None:
+        while True:
+            # Проверка в начале каждой минуты
+            await asyncio.sleep(SUBSCRIPTION_INTERVAL - time.time() % SUBSCRIPTION_INTERVAL)
+            try:
+                await self.run_once(self._bot)
+            except Exception as e:
+                logging.error(f"Daily forecast delivery failed: {e}")
+
+    def start(self, application: Application) -> None:
+        """
+        Запускает рассылку в JobQueue приложения, а без нее — отдельной задачей.
+
+        :param application: Объект Application
+        :return: None
+        """
+        if application.job_queue is not None:
+            application.job_queue.run_repeating(
+                self.job,
+                interval=SUBSCRIPTION_INTERVAL,
+                first=SUBSCRIPTION_INTERVAL - time.time() % SUBSCRIPTION_INTERVAL,
+                name="subscriptions",
+            )
+        elif self._task is None:
+            self._bot = application.bot
+            self._task = asyncio.create_task(self._loop())
+        logging.info("Daily forecast delivery was started")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+delivery_engine = DeliveryEngine()
+
+
+if __name__ == "__main__":
+    import random
+
+    from telegram.ext import ApplicationBuilder
+
+    from api.samples import forecast_response
+    from bot.fake_telegram import FAKE_TOKEN, FakeBotApi
+
+    SUBSCRIBERS = 5000
+    CITIES = [(55.75, 37.62), (59.94, 30.31), (56.84, 60.6), (55.03, 82.92), (43.12, 131.89)]
+
+    async def main():
+        api = FakeBotApi()
+        await api.start()
+        application = ApplicationBuilder().token(FAKE_TOKEN).base_url(api.base_url).updater(None).build()
+        await application.initialize()
+
+        fetches = Counter()
+
+        async def fetch(latitude: float, longitude: float) -> List[dict]:
+            fetches[(latitude, longitude)] += 1
+            await asyncio.sleep(0.05)
+            return forecast_response(16, datetime.now(timezone).date())
+
+        random.seed(1)
+        subscribers = [
+            (chat_id, latitude + random.uniform(-0.3, 0.3), longitude + random.uniform(-0.3, 0.3))
+            for chat_id, (latitude, longitude) in enumerate(random.choices(CITIES, k=SUBSCRIBERS), 1)
+        ]
+        # Без ограничения частоты, чтобы измерить собственные затраты рассылки
+        engine = DeliveryEngine(send_rate=100000, workers=64)
+        engine.fetch = fetch
+        started = time.perf_counter()
+        await engine.deliver(application.bot, subscribers)
+        elapsed = time.perf_counter() - started
+        await application.shutdown()
+        await api.stop()
+        print(
+            f"{SUBSCRIBERS} subscribers, {len(fetches)} API requests, "
+            f"{engine.metrics['sent']} messages in {elapsed:.1f} s"
+        )
+
+    asyncio.run(main())
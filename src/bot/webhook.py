@@ -0,0 +1,159 @@
+import asyncio
+import hmac
+import logging
+import signal
+from json.decoder import JSONDecodeError
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+from config import (UPDATE_CONCURRENCY, WEBHOOK_HOST, WEBHOOK_MAX_PENDING,
+                    WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_URL)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class UpdateDispatcher:
+    """
+    Передает обновления из webhook в Application с ограничением очереди.
+
+    Если в обработке уже WEBHOOK_MAX_PENDING обновлений, новые отклоняются,
+    и Telegram доставит их повторно позже. Параллельность обработки
+    ограничивает обработчик обновлений Application.
+    """
+
+    def __init__(self, application: Application, max_pending: int):
+        self.application = application
+        self.max_pending = max_pending
+        self._tasks = set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    def submit(self, update: Update) -> bool:
+        """
+        Ставит обновление в обработку.
+
+        :param update: Объект Update
+        :return: False, если очередь переполнена
+        """
+        if len(self._tasks) >= self.max_pending:
+            return False
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _process(self, update: Update) -> None:
+        try:
+            # Как и при polling, обновление проходит через update_processor Application
+            await self.application.update_processor.process_update(
+                update, self.application.process_update(update)
+            )
+        except Exception as e:
+            logging.error(f"Update {update.update_id} was not processed: {e}")
+
+    async def drain(self) -> None:
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+def create_webhook_app(
+    application: Application,
+    secret: str = WEBHOOK_SECRET,
+    path: str = WEBHOOK_PATH,
+    max_pending: int = WEBHOOK_MAX_PENDING,
+) -> web.Application:
+    """
+    Создает HTTP-приложение, принимающее обновления Telegram.
+
+    :param application: Объект Application с зарегистрированными обработчиками
+    :param secret: Секретный токен, переданный в setWebhook
+    :param path: Путь эндпоинта
+    :param max_pending: Максимум принятых, но еще не обработанных обновлений
+    :return: Объект aiohttp.web.Application
+    :raise ValueError: Если секретный токен не задан
+    """
+    if not secret:
+        raise ValueError("WEBHOOK_SECRET is required in webhook mode")
+    dispatcher = UpdateDispatcher(application, max_pending)
+
+    async def receive_update(request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+            logging.warning("Webhook request with invalid secret token was rejected")
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except (JSONDecodeError, ValueError):
+            return web.Response(status=400)
+        update = Update.de_json(data, application.bot)
+        if not dispatcher.submit(update):
+            logging.warning(f"Webhook queue is full, update {update.update_id} was deferred")
+            return web.Response(status=429, headers={"Retry-After": "1"})
+        return web.Response()
+
+    async def drain(app: web.Application) -> None:
+        await dispatcher.drain()
+
+    app = web.Application()
+    app["dispatcher"] = dispatcher
+    app.router.add_post(path, receive_update)
+    app.on_shutdown.append(drain)
+    return app
+
+
+async def serve_webhook(
+    application: Application, stop: asyncio.Event, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT
+) -> None:
+    """
+    Запускает бота в режиме webhook и работает до установки события stop.
+
+    :param application: Объект Application, собранный с updater(None)
+    :param stop: Событие остановки
+    :param host: Адрес HTTP-сервера
+    :param port: Порт HTTP-сервера
+    :return: None
+    """
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+
+    runner = web.AppRunner(create_webhook_app(application))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    if WEBHOOK_URL:
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=min(UPDATE_CONCURRENCY, 100),
+        )
+    logging.info(f"Webhook server is listening on {host}:{port}{WEBHOOK_PATH}")
+
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def run_webhook(application: Application) -> None:
+    """
+    Запускает бота в режиме webhook до получения SIGINT/SIGTERM.
+
+    :param application: Объект Application, собранный с updater(None)
+    :return: None
+    """
+    async def run() -> None:
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await serve_webhook(application, stop)
+
+    asyncio.run(run())
@@ -0,0 +1,246 @@
+import json
+import struct
+import zlib
+from typing import List, Union
+
+from api.parser import project
+from config import CACHE_CODEC, CACHE_COMPRESSION_MIN_BYTES
+from exceptions import UnsupportedCacheFormat
+
+MAGIC = b"WF"
+VERSION = 2
+HEADER = struct.Struct("<2sBBH")
+
+FLAG_COMPRESSED = 1
+FLAG_SINGLE = 2
+
+MISSING_INT = -32768
+MISSING_DIRECTION = -128
+SCALE = 10
+
+Forecast = Union[dict, List[dict]]
+
+
+class JsonCodec:
+    """
+    Хранит проекцию прогноза в виде JSON-текста (прежний формат).
+    """
+
+    def encode(self, forecast: Forecast) -> bytes:
+        if isinstance(forecast, dict):
+            return json.dumps(project(forecast), ensure_ascii=False).encode()
+        return json.dumps([project(interval) for interval in forecast], ensure_ascii=False).encode()
+
+    def decode(self, data: bytes) -> Forecast:
+        return json.loads(data)
+
+
+class BinaryCodec:
+    """
+    Хранит проекцию прогноза в колоночном бинарном формате с версией.
+
+    Заголовок: сигнатура WF, версия, флаги, количество интервалов.
+    Далее колонки: даты и описания (строки с длиной), смещение часового пояса
+    в минутах, влажность, давление, температура и скорость ветра (int16, две
+    последние с точностью 0.1), направление ветра (int8). Тело сжимается zlib, если оно длиннее
+    CACHE_COMPRESSION_MIN_BYTES.
+    """
+
+    def __init__(self, compression_min_bytes: int = CACHE_COMPRESSION_MIN_BYTES):
+        self.compression_min_bytes = compression_min_bytes
+
+    def encode(self, forecast: Forecast) -> bytes:
+        single = isinstance(forecast, dict)
+        intervals = [forecast] if single else forecast
+        count = len(intervals)
+        dates, descriptions, offsets = [], [], []
+        humidity, pressure, temperature, wind_speed, wind_direction = [], [], [], [], []
+
+        for interval in intervals:
+            dates.append(interval.get("date", {}).get("local", "").encode())
+            offsets.append(self._int(interval.get("date", {}).get("time_zone_offset")))
+            descriptions.append(interval.get("description", {}).get("full", "").encode())
+            humidity.append(self._int(interval.get("humidity", {}).get("percent")))
+            pressure.append(self._int(interval.get("pressure", {}).get("mm_hg_atm")))
+            temperature.append(self._fixed(interval.get("temperature", {}).get("air", {}).get("C")))
+            wind = interval.get("wind", {})
+            wind_speed.append(self._fixed(wind.get("speed", {}).get("m_s")))
+            direction = wind.get("direction", {}).get("scale_8")
+            wind_direction.append(MISSING_DIRECTION if direction is None else direction)
+
+        body = b"".join(
+            [
+                b"".join(struct.pack("<B", len(date)) + date for date in dates),
+                b"".join(struct.pack("<H", len(text)) + text for text in descriptions),
+                struct.pack(f"<{count}h", *offsets),
+                struct.pack(f"<{count}h", *humidity),
+                struct.pack(f"<{count}h", *pressure),
+                struct.pack(f"<{count}h", *temperature),
+                struct.pack(f"<{count}h", *wind_speed),
+                struct.pack(f"<{count}b", *wind_direction),
+            ]
+        )
+        flags = FLAG_SINGLE if single else 0
+        if len(body) >= self.compression_min_bytes:
+            body = zlib.compress(body)
+            flags |= FLAG_COMPRESSED
+        return HEADER.pack(MAGIC, VERSION, flags, count) + body
+
+    def decode(self, data: bytes) -> Forecast:
+        magic, version, flags, count = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise UnsupportedCacheFormat(f"Unsupported cache format version: {version}")
+        body = memoryview(data)[HEADER.size:]
+        if flags & FLAG_COMPRESSED:
+            body = memoryview(zlib.decompress(body))
+
+        offset = 0
+        dates = []
+        for _ in range(count):
+            length = body[offset]
+            dates.append(bytes(body[offset + 1:offset + 1 + length]).decode())
+            offset += 1 + length
+        descriptions = []
+        for _ in range(count):
+            (length,) = struct.unpack_from("<H", body, offset)
+            descriptions.append(bytes(body[offset + 2:offset + 2 + length]).decode())
+            offset += 2 + length
+        columns = []
+        for _ in range(5):
+            columns.append(struct.unpack_from(f"<{count}h", body, offset))
+            offset += 2 * count
+        offsets, humidity, pressure, temperature, wind_speed = columns
+        wind_direction = struct.unpack_from(f"<{count}b", body, offset)
+
+        intervals = []
+        for index in range(count):
+            direction = wind_direction[index]
+            date = {"local": dates[index]}
+            if offsets[index] != MISSING_INT:
+                # Нужен, чтобы выбирать интервалы единого прогноза по местному времени
+                date["time_zone_offset"] = offsets[index]
+            intervals.append(
+                {
+                    "date": date,
+                    "description": {"full": descriptions[index]},
+                    "humidity": {"percent": self._from_int(humidity[index])},
+                    "pressure": {"mm_hg_atm": self._from_int(pressure[index])},
+                    "temperature": {"air": {"C": self._from_fixed(temperature[index])}},
+                    "wind": {
+                        "speed": {"m_s": self._from_fixed(wind_speed[index])},
+                        "direction": {"scale_8": None if direction == MISSING_DIRECTION else direction},
+                    },
+                }
+            )
+        return intervals[0] if flags & FLAG_SINGLE else intervals
+
+    @staticmethod
+    def _int(value) -> int:
+        if value is None:
+            return MISSING_INT
+        if not isinstance(value, int):
+            raise TypeError(f"Integer expected, got {value!r}")
+        return value
+
+    @staticmethod
+    def _fixed(value) -> int:
+        if value is None:
+            return MISSING_INT
+        if not isinstance(value, (int, float)):
+            raise TypeError(f"Number expected, got {value!r}")
+        return round(value * SCALE)
+
+    @staticmethod
+    def _from_int(value: int):
+        return None if value == MISSING_INT else value
+
+    @staticmethod
+    def _from_fixed(value: int):
+        if value == MISSING_INT:
+            return None
+        if value % SCALE == 0:
+            return value // SCALE
+        return value / SCALE
+
+
+json_codec = JsonCodec()
+binary_codec = BinaryCodec()
+
+
+def encode_forecast(forecast: Forecast) -> bytes:
+    """
+    Кодирует прогноз для хранения в кэше выбранным в CACHE_CODEC форматом.
+
+    Если данные не укладываются в бинарный формат, используется JSON.
+
+    :param forecast: Ответ API Gismeteo
+    :return: Закодированные данные
+    """
+    if CACHE_CODEC == "binary":
+        try:
+            return binary_codec.encode(forecast)
+        except (TypeError, AttributeError, struct.error):
+            pass
+    return json_codec.encode(forecast)
+
+
+def decode_forecast(data: bytes) -> Forecast:
+    """
+    Декодирует прогноз из кэша, определяя формат по сигнатуре.
+
+    :param data: Данные из Redis
+    :return: Прогноз в виде словаря или списка словарей
+    :raise UnsupportedCacheFormat: Если формат данных неизвестен
+    """
+    if data[:2] == MAGIC:
+        return binary_codec.decode(data)
+    try:
+        return json_codec.decode(data)
+    except ValueError as e:
+        raise UnsupportedCacheFormat(f"Cannot decode cached forecast: {e}") from e
+
+
+if __name__ == "__main__":
+    import time
+    from datetime import datetime, timezone
+
+    from api.samples import forecast_response
+    from api.views import select_view
+
+    ROUNDS = 20000
+
+    for size in (1, 8, 16):
+        payload = forecast_response(size)
+        raw = json.dumps(payload).encode()
+        encoded = encode_forecast(payload)
+        assert decode_forecast(encoded) == [project(item) for item in payload]
+        assert decode_forecast(json_codec.encode(payload)) == [project(item) for item in payload]
+
+        started = time.perf_counter()
+        for _ in range(ROUNDS):
+            json.loads(json.dumps(payload))
+        json_time = (time.perf_counter() - started) / ROUNDS * 1e6
+
+        started = time.perf_counter()
+        for _ in range(ROUNDS):
+            decode_forecast(encode_forecast(payload))
+        binary_time = (time.perf_counter() - started) / ROUNDS * 1e6
+
+        print(
+            f"{size:>2} intervals: json {len(raw)} B, {json_time:.1f} us | "
+            f"binary {len(encoded)} B, {binary_time:.1f} us"
+        )
+
+    # Местное время без смещения в строке: срезы выбираются по time_zone_offset
+    payload = forecast_response(16)
+    for interval in payload:
+        interval["date"]["local"] = interval["date"]["local"][:19]
+        interval["date"]["time_zone_offset"] = 600
+    # 01:30 UTC — 11:30 по местному времени при смещении +10:00
+    moment = datetime(2026, 3, 9, 1, 30, tzinfo=timezone.utc)
+    for codec in (binary_codec, json_codec):
+        cached = codec.decode(codec.encode(payload))
+        for kind in ("now", "today", "tomorrow"):
+            assert select_view(kind, cached, moment) == select_view(kind, [project(item) for item in payload], moment), kind
+    assert select_view("now", binary_codec.decode(binary_codec.encode(payload)), moment)["date"]["local"].endswith("T09:00:00")
+    print("views match after encoding")
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import uuid
+from typing import Optional, Tuple
+
+from redis import RedisError
+
+from cache.memory_cache import MemoryCache
+from cache.redis_cache import get_pubsub_client, get_redis_client
+from config import (COORDINATES_CACHE_MAX_ENTRIES, COORDINATES_CACHE_REDIS,
+                    COORDINATES_CACHE_TTL, COORDINATES_INVALIDATION_CHANNEL)
+
+# Идентификатор реплики, чтобы не обрабатывать собственные сообщения об инвалидации
+replica_id = uuid.uuid4().hex
+
+# Каждая запись занимает одну условную единицу объема, ограничение задается числом записей
+coordinates_cache = MemoryCache(COORDINATES_CACHE_MAX_ENTRIES, COORDINATES_CACHE_MAX_ENTRIES)
+
+_listener: asyncio.Task = None
+
+
+def make_key(chat_id: int) -> str:
+    return f"coords:{chat_id}"
+
+
+async def get_cached_coordinates(chat_id: int) -> Optional[Tuple[float, float]]:
+    """
+    Возвращает координаты пользователя из памяти процесса или из Redis.
+
+    :param chat_id: ID чата Telegram
+    :return: кортеж (широта, долгота) или None
+    """
+    coordinates = coordinates_cache.get(chat_id)
+    if coordinates is not None or not COORDINATES_CACHE_REDIS:
+        return coordinates
+    try:
+        data = await get_redis_client().get(make_key(chat_id))
+    except RedisError as e:
+        logging.error(f"Error getting cached coordinates: {e}")
+        return None
+    if data is None:
+        return None
+    latitude, longitude = data.split(b",")
+    coordinates = (float(latitude), float(longitude))
+    coordinates_cache.set(chat_id, coordinates, COORDINATES_CACHE_TTL, 1)
+    return coordinates
+
+
+async def set_cached_coordinates(
+    chat_id: int, latitude: float, longitude: float, publish: bool = False
+) -> None:
+    """
+    Сохраняет координаты пользователя в памяти процесса и в Redis.
+
+    :param chat_id: ID чата Telegram
+    :param latitude: широта
+    :param longitude: долгота
+    :param publish: Оповестить другие реплики об изменении координат
+    :return: None
+    """
+    coordinates_cache.set(chat_id, (latitude, longitude), COORDINATES_CACHE_TTL, 1)
+    if not COORDINATES_CACHE_REDIS:
+        return
+    try:
+        async with get_redis_client().pipeline(transaction=True) as pipe:
+            pipe.setex(make_key(chat_id), COORDINATES_CACHE_TTL, f"{latitude},{longitude}")
+            if publish:
+                pipe.publish(COORDINATES_INVALIDATION_CHANNEL, f"{replica_id}:{chat_id}")
+            await pipe.execute()
+    except RedisError as e:
+        # Запись в Redis не удалась: удаляем ключ, чтобы реплики не читали старые координаты
+        logging.error(f"Error caching coordinates for chat_id {chat_id}: {e}")
+        try:
+            await get_redis_client().delete(make_key(chat_id))
+        except RedisError:
+            pass
+
+
+async def listen_invalidations() -> None:
+    """
+    Удаляет из памяти процесса координаты, измененные другими репликами.
+
+    :return: None
+    """
+    reconnecting = False
+    while True:
+        try:
+            async with get_pubsub_client().pubsub() as pubsub:
+                await pubsub.subscribe(COORDINATES_INVALIDATION_CHANNEL)
+                if reconnecting:
+                    # Пока подписки не было, сообщения могли потеряться
+                    coordinates_cache.clear()
+                    logging.info("Coordinates invalidation listener reconnected")
+                    reconnecting = False
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    sender, _, chat_id = message["data"].decode().partition(":")
+                    if sender != replica_id:
+                        coordinates_cache.delete(int(chat_id))
+        except RedisError as e:
+            logging.error(f"Coordinates invalidation listener failed: {e}")
+            reconnecting = True
+            await asyncio.sleep(1)
+
+
+async def start_invalidation_listener() -> None:
+    global _listener
+    if COORDINATES_CACHE_REDIS and _listener is None:
+        _listener = asyncio.create_task(listen_invalidations())
+
+
+async def stop_invalidation_listener() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.cancel()
+        try:
+            await _listener
+        except asyncio.CancelledError:
+            pass
+        _listener = None
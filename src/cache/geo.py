@@ -0,0 +1,122 @@
+import math
+from functools import lru_cache
+from typing import NamedTuple, Tuple
+
+from config import GEO_BUCKET_DEFAULT, GEO_BUCKETS
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+BASE32_INDEX = {char: index for index, char in enumerate(BASE32)}
+
+
+class Bucket(NamedTuple):
+    cell: str
+    latitude: float
+    longitude: float
+
+
+def geohash_encode(latitude: float, longitude: float, precision: int) -> str:
+    """
+    Кодирует координаты в geohash заданной длины.
+
+    :param latitude: широта
+    :param longitude: долгота
+    :param precision: количество символов geohash
+    :return: строка geohash
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        current_range, value = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (current_range[0] + current_range[1]) / 2
+        if value >= middle:
+            bits = (bits << 1) | 1
+            current_range[0] = middle
+        else:
+            bits <<= 1
+            current_range[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def geohash_centroid(cell: str) -> Tuple[float, float]:
+    """
+    Возвращает центр ячейки geohash.
+
+    :param cell: строка geohash
+    :return: кортеж (широта, долгота)
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in cell:
+        bits = BASE32_INDEX[char]
+        for shift in range(4, -1, -1):
+            current_range = lon_range if even else lat_range
+            middle = (current_range[0] + current_range[1]) / 2
+            if (bits >> shift) & 1:
+                current_range[0] = middle
+            else:
+                current_range[1] = middle
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+
+def grid_bucket(latitude: float, longitude: float, step: float) -> Bucket:
+    """
+    Относит координаты к ячейке регулярной сетки с шагом step градусов.
+
+    :param latitude: широта
+    :param longitude: долгота
+    :param step: шаг сетки в градусах
+    :return: Bucket с идентификатором ячейки и ее центром
+    """
+    row = math.floor(latitude / step)
+    column = math.floor(longitude / step)
+    return Bucket(
+        f"g{step}:{row}:{column}",
+        round((row + 0.5) * step, 6),
+        round((column + 0.5) * step, 6),
+    )
+
+
+@lru_cache(maxsize=None)
+def parse_scheme(scheme: str) -> Tuple[str, float]:
+    """
+    Разбирает описание схемы квантования вида "geohash:6" или "grid:0.05".
+
+    :param scheme: строка со схемой
+    :return: кортеж (название схемы, точность)
+    :raise ValueError: Если схема неизвестна
+    """
+    name, _, precision = scheme.partition(":")
+    if name == "geohash":
+        return name, int(precision)
+    if name == "grid":
+        return name, float(precision)
+    raise ValueError(f"Unknown geo bucket scheme: {scheme}")
+
+
+def quantize(kind: str, latitude: float, longitude: float) -> Bucket:
+    """
+    Квантует координаты по схеме, заданной для типа прогноза.
+
+    :param kind: Тип прогноза: now, today, tomorrow
+    :param latitude: широта полученная от пользователя
+    :param longitude: долгота полученная от пользователя
+    :return: Bucket с идентификатором ячейки и координатами ее центра
+    """
+    name, precision = parse_scheme(GEO_BUCKETS.get(kind, GEO_BUCKET_DEFAULT))
+    if name == "grid":
+        return grid_bucket(latitude, longitude, precision)
+    cell = geohash_encode(latitude, longitude, precision)
+    centroid_latitude, centroid_longitude = geohash_centroid(cell)
+    return Bucket(cell, round(centroid_latitude, 6), round(centroid_longitude, 6))
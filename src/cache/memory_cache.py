@@ -0,0 +1,136 @@
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, NamedTuple
+
+from config import L1_CACHE_MAX_BYTES, L1_CACHE_MAX_ENTRIES
+
+
+class Entry(NamedTuple):
+    value: Any
+    expires_at: float
+    size: int
+
+
+def estimate_size(value: Any) -> int:
+    """
+    Оценка памяти, занятой декодированным значением.
+
+    Элементы списка считаются по первому: интервалы прогноза устроены одинаково.
+
+    :param value: Словарь, список или скаляр
+    :return: Объем в байтах
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += sys.getsizeof(key) + estimate_size(item)
+    elif isinstance(value, (list, tuple)) and value:
+        size += estimate_size(value[0]) * len(value)
+    return size
+
+
+class MemoryCache:
+    """
+    LRU-кэш в памяти процесса с ограничением по числу записей, объему и TTL.
+
+    Хранит уже декодированные значения, поэтому их нельзя изменять после чтения.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._entries: "OrderedDict[str, Entry]" = OrderedDict()
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Any:
+        """
+        Возвращает значение по ключу, если оно есть и не истекло.
+
+        :param key: Ключ кэша
+        :return: Значение или None
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires_at <= self._clock():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def set(self, key: str, value: Any, ttl: float, size: int) -> None:
+        """
+        Сохраняет значение на ttl секунд.
+
+        :param key: Ключ кэша
+        :param value: Декодированное значение
+        :param ttl: Время жизни в секундах, как у setex в Redis
+        :param size: Оценка объема значения в байтах
+        :return: None
+        """
+        if key in self._entries:
+            self._remove(key)
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        self._entries[key] = Entry(value, self._clock() + ttl, size)
+        self.bytes_used += size
+        self._evict()
+
+    def delete(self, key: str) -> None:
+        if key in self._entries:
+            self._remove(key)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.bytes_used = 0
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self.bytes_used -= entry.size
+
+    def _evict(self) -> None:
+        # Вытесняем только с начала LRU: истекшие записи в середине находит get()
+        now = None
+        while self.bytes_used > self.max_bytes or len(self._entries) > self.max_entries:
+            key = next(iter(self._entries))
+            if now is None:
+                now = self._clock()
+            if self._entries[key].expires_at <= now:
+                self.expirations += 1
+            else:
+                self.evictions += 1
+            self._remove(key)
+
+    def stats(self) -> dict:
+        """
+        Возвращает счетчики кэша.
+
+        :return: Dict с попаданиями, промахами, долей попаданий и занятой памятью
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+            "bytes_used": self.bytes_used,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+memory_cache = MemoryCache(L1_CACHE_MAX_ENTRIES, L1_CACHE_MAX_BYTES)
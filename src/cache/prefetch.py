@@ -0,0 +1,257 @@
+import asyncio
+import logging
+import time
+from array import array
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Tuple
+
+from redis import RedisError
+from telegram.ext import Application, ContextTypes
+
+from cache.redis_cache import get_redis_client, soft_ttl_left
+from config import (PREFETCH_BUDGET_PER_MINUTE, PREFETCH_DECAY_INTERVAL,
+                    PREFETCH_ENABLED, PREFETCH_INTERVAL, PREFETCH_LEAD_TIME,
+                    PREFETCH_SKETCH_DEPTH, PREFETCH_SKETCH_WIDTH,
+                    PREFETCH_TOP_N)
+
+
+class PrefetchRequest(NamedTuple):
+    kind: str
+    url: str
+    days: int
+    latitude: float
+    longitude: float
+
+
+class CountMinSketch:
+    """
+    Приближенный счетчик частот с фиксированным объемом памяти.
+    """
+
+    def __init__(self, width: int, depth: int):
+        self.width = width
+        self.depth = depth
+        self.rows = [array("I", [0]) * width for _ in range(depth)]
+
+    def add(self, key: str, count: int = 1) -> int:
+        """
+        Увеличивает счетчик ключа и возвращает его оценку.
+
+        :param key: Ключ
+        :param count: На сколько увеличить счетчик
+        :return: Оценка частоты ключа
+        """
+        estimate = None
+        for depth, row in enumerate(self.rows):
+            index = hash((depth, key)) % self.width
+            row[index] += count
+            if estimate is None or row[index] < estimate:
+                estimate = row[index]
+        return estimate
+
+    def decay(self) -> None:
+        for row in self.rows:
+            for index, value in enumerate(row):
+                if value:
+                    row[index] = value >> 1
+
+
+class HotKeys:
+    """
+    Затухающий top-K самых запрашиваемых ключей кэша.
+    """
+
+    def __init__(self, size: int, width: int, depth: int):
+        self.size = size
+        self.sketch = CountMinSketch(width, depth)
+        self.top: Dict[str, Tuple[int, PrefetchRequest]] = {}
+
+    def record(self, key: str, request: PrefetchRequest, count: int = 1) -> None:
+        estimate = self.sketch.add(key, count)
+        if key in self.top or len(self.top) < self.size:
+            self.top[key] = (estimate, request)
+            return
+        coldest = min(self.top, key=lambda item: self.top[item][0])
+        if estimate > self.top[coldest][0]:
+            del self.top[coldest]
+            self.top[key] = (estimate, request)
+
+    def decay(self) -> None:
+        self.sketch.decay()
+        self.top = {
+            key: (estimate >> 1, request)
+            for key, (estimate, request) in self.top.items()
+            if estimate >> 1
+        }
+
+    def hottest(self) -> List[Tuple[str, PrefetchRequest]]:
+        ordered = sorted(self.top.items(), key=lambda item: item[1][0], reverse=True)
+        return [(key, request) for key, (_, request) in ordered]
+
+
+class Prefetcher:
+    """
+    Заранее обновляет прогнозы для популярных ключей, срок жизни которых скоро истечет.
+    """
+
+    def __init__(
+        self,
+        top_n: int = PREFETCH_TOP_N,
+        lead_time: float = PREFETCH_LEAD_TIME,
+        budget_per_minute: int = PREFETCH_BUDGET_PER_MINUTE,
+        decay_interval: float = PREFETCH_DECAY_INTERVAL,
+    ):
+        self.hot_keys = HotKeys(top_n, PREFETCH_SKETCH_WIDTH, PREFETCH_SKETCH_DEPTH)
+        self.lead_time = lead_time
+        self.budget_per_minute = budget_per_minute
+        self.decay_interval = decay_interval
+        self.fetch: Callable[[str, PrefetchRequest], Awaitable[None]] = None
+        self.metrics = Counter()
+        self._tokens = float(budget_per_minute)
+        self._refilled_at = time.monotonic()
+        self._decayed_at = time.monotonic()
+        self._task: asyncio.Task = None
+
+    def record(self, key: str, request: PrefetchRequest) -> None:
+        """
+        Учитывает обращение пользователя к ключу кэша.
+
+        :param key: Ключ кэша прогноза
+        :param request: Параметры запроса к API для обновления ключа
+        :return: None
+        """
+        self.metrics["recorded"] += 1
+        self.hot_keys.record(key, request)
+
+    def _take_token(self) -> bool:
+        now = time.monotonic()
+        self._tokens = min(
+            float(self.budget_per_minute),
+            self._tokens + (now - self._refilled_at) * self.budget_per_minute / 60,
+        )
+        self._refilled_at = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    async def run_once(self) -> None:
+        """
+        Один проход планировщика: выбирает горячие ключи и обновляет истекающие.
+
+        :return: None
+        """
+        self.metrics["runs"] += 1
+        if time.monotonic() - self._decayed_at >= self.decay_interval:
+            self.hot_keys.decay()
+            self._decayed_at = time.monotonic()
+            self.metrics["decays"] += 1
+
+        candidates = self.hot_keys.hottest()
+        if not candidates or self.fetch is None:
+            return
+        try:
+            async with get_redis_client().pipeline(transaction=False) as pipe:
+                for key, _ in candidates:
+                    pipe.pttl(key)
+                ttls = await pipe.execute()
+        except RedisError as e:
+            self.metrics["errors"] += 1
+            logging.error(f"Prefetch cannot read TTL from redis: {e}")
+            return
+
+        for (key, request), pttl in zip(candidates, ttls):
+            self.metrics["candidates"] += 1
+            # pttl == -2: ключа нет, его заберет первый пользователь
+            if pttl == -2 or soft_ttl_left(request.kind, pttl) > self.lead_time:
+                self.metrics["skipped_fresh"] += 1
+                continue
+            if not self._take_token():
+                self.metrics["skipped_budget"] += 1
+                break
+            try:
+                await self.fetch(key, request)
+                self.metrics["refreshed"] += 1
+            except Exception as e:
+                self.metrics["errors"] += 1
+                logging.error(f"Prefetch of {key} failed: {e}")
+
+    async def warm(self, seeds: List[Tuple[str, PrefetchRequest, int]]) -> int:
+        """
+        Прогревает кэш для известных заранее популярных ключей, например самых
+        населенных ячеек после перезапуска, когда счетчики обращений пусты.
+        Отсутствующие в кэше ключи запрашиваются в пределах бюджета, а все
+        ключи попадают в горячие и дальше обновляются планировщиком.
+
+        :param seeds: Кортежи (ключ, запрос к API, вес ключа)
+        :return: Число запрошенных ключей
+        """
+        if not seeds or self.fetch is None:
+            return 0
+        for key, request, weight in seeds:
+            self.hot_keys.record(key, request, weight)
+        try:
+            async with get_redis_client().pipeline(transaction=False) as pipe:
+                for key, _, _ in seeds:
+                    pipe.exists(key)
+                present = await pipe.execute()
+        except RedisError as e:
+            self.metrics["errors"] += 1
+            logging.error(f"Prefetch cannot check cached keys in redis: {e}")
+            return 0
+
+        warmed = 0
+        for (key, request, _), exists in zip(seeds, present):
+            if exists:
+                continue
+            if not self._take_token():
+                self.metrics["skipped_budget"] += 1
+                break
+            try:
+                await self.fetch(key, request)
+                warmed += 1
+            except Exception as e:
+                self.metrics["errors"] += 1
+                logging.error(f"Warming of {key} failed: {e}")
+        self.metrics["warmed"] += warmed
+        return warmed
+
+    async def job(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        await self.run_once()
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(PREFETCH_INTERVAL)
+            await self.run_once()
+
+    def start(self, application: Application) -> None:
+        """
+        Запускает планировщик в JobQueue приложения, а без нее — отдельной задачей.
+
+        :param application: Объект Application
+        :return: None
+        """
+        if not PREFETCH_ENABLED:
+            return
+        if application.job_queue is not None:
+            application.job_queue.run_repeating(
+                self.job, interval=PREFETCH_INTERVAL, name="prefetch"
+            )
+        elif self._task is None:
+            self._task = asyncio.create_task(self._loop())
+        logging.info("Prefetch scheduler was started")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {**self.metrics, "tracked_keys": len(self.hot_keys.top), "tokens": self._tokens}
+
+
+prefetcher = Prefetcher()
@@ -1,55 +1,436 @@
 import asyncio
-import json
 import logging
 import os
+from collections import Counter
+from typing import (Awaitable, Callable, Dict, Iterable, List, Optional,
+                    Sequence, Tuple)
 
 from redis import RedisError
-from redis.asyncio import Redis
+from redis.asyncio import BlockingConnectionPool, Redis
 
-from config import REDIS_TTL
+from cache.codec import decode_forecast, encode_forecast
+from cache.geo import quantize
+from cache.memory_cache import estimate_size, memory_cache
+from cache.snapshot import SnapshotEntry, forecast_snapshot
+from config import (CACHE_REVALIDATE_LEASE, CACHE_TTL_DEFAULT, CACHE_TTLS,
+                    REDIS_HEALTH_CHECK_INTERVAL, REDIS_MAX_CONNECTIONS,
+                    REDIS_POOL_TIMEOUT, REDIS_SOCKET_CONNECT_TIMEOUT,
+                    REDIS_SOCKET_TIMEOUT, REDIS_TTL, STALE_TTL)
+from exceptions import UnsupportedCacheFormat
+from logs.pipeline import bind
+from metrics.registry import REDIS_LATENCY
 
 redis_host = os.getenv('REDIS_HOST', 'localhost')
 port = int(os.getenv('REDIS_PORT', 6379))
 ttl = REDIS_TTL
 password = os.getenv('REDIS_PASSWORD', None)
 
-redis_client = Redis(host=redis_host, port=port, db=0, password=password)
+_redis_client: Optional[Redis] = None
+_pubsub_client: Optional[Redis] = None
+
+
+def get_redis_client() -> Redis:
+    """
+    Возвращает клиент Redis с общим пулом соединений. Пул и клиент создаются
+    при первом обращении, а не при импорте, как движок базы в get_engine.
+
+    :return: Redis
+    """
+    global _redis_client
+    if _redis_client is None:
+        # При исчерпании пула запрос ждет свободное соединение до REDIS_POOL_TIMEOUT секунд
+        _redis_client = Redis.from_pool(BlockingConnectionPool(
+            host=redis_host,
+            port=port,
+            db=0,
+            password=password,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            timeout=REDIS_POOL_TIMEOUT,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT,
+            socket_keepalive=True,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        ))
+    return _redis_client
+
+
+def get_pubsub_client() -> Redis:
+    """
+    Возвращает клиент Redis для подписок. Подписки держат соединение без ответов
+    сколько угодно долго, поэтому у клиента нет socket_timeout: иначе listen()
+    падает по таймауту на тихом канале.
+
+    :return: Redis
+    """
+    global _pubsub_client
+    if _pubsub_client is None:
+        _pubsub_client = Redis(
+            host=redis_host,
+            port=port,
+            db=0,
+            password=password,
+            socket_timeout=None,
+            socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT,
+            socket_keepalive=True,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        )
+    return _pubsub_client
+
+
+async def close_redis_clients() -> None:
+    global _redis_client, _pubsub_client
+    for client in (_redis_client, _pubsub_client):
+        if client is not None:
+            await client.aclose()
+    _redis_client = _pubsub_client = None
+
+cache_stats = Counter()
+
+revalidations: Dict[str, asyncio.Task] = {}
+
+
+def make_key(kind: str, latitude: float, longitude: float) -> str:
+    """
+    Формирует ключ кэша по типу прогноза и ячейке, в которую попадают координаты.
+    :param kind: Тип прогноза: now, today, tomorrow
+    :param latitude: широта полученная от пользователя
+    :param longitude: долгота полученная от пользователя
+    :return: ключ Redis
+    """
+    return f'{kind}:{quantize(kind, latitude, longitude).cell}'
+
+
+def get_ttl(kind: str) -> Tuple[int, int]:
+    """
+    Мягкий и жесткий срок жизни прогноза в кэше.
+    :param kind: Тип прогноза: now, today, tomorrow
+    :return: (soft, hard) в секундах
+    """
+    return CACHE_TTLS.get(kind, CACHE_TTL_DEFAULT)
+
+
+def soft_ttl_left(kind: str, pttl: int) -> float:
+    """
+    Сколько секунд прогноз еще считается свежим, по оставшемуся времени жизни ключа в Redis.
+    :param kind: Тип прогноза: now, today, tomorrow
+    :param pttl: Результат PTTL для ключа прогноза
+    :return: Секунды до мягкого срока, отрицательное значение — прогноз устарел
+    """
+    soft, hard = get_ttl(kind)
+    return pttl / 1000 - (hard - soft)
+
+
+def get_cache_stats() -> dict:
+    """
+    Возвращает количество свежих и устаревших попаданий и промахов кэша в разрезе типов прогноза.
+    :return: Dict вида {kind: {"fresh": int, "stale": int, "miss": int, "revalidated": int, "hit_ratio": float}}
+    """
+    stats = {}
+    for (kind, outcome), count in cache_stats.items():
+        stats.setdefault(kind, {"fresh": 0, "stale": 0, "miss": 0, "revalidated": 0})[outcome] = count
+    for counters in stats.values():
+        hits = counters["fresh"] + counters["stale"]
+        total = hits + counters["miss"]
+        counters["hit_ratio"] = hits / total if total else 0.0
+    return stats
+
+
+def _queue_set(pipe, kind: str, latitude: float, longitude: float, api_response: dict) -> Tuple[str, int, bytes]:
+    key = make_key(kind, latitude, longitude)
+    soft, hard = get_ttl(kind)
+    data = encode_forecast(api_response)
+    # Мягкий срок не хранится отдельно: его вычисляет get_cached_forecast по PTTL ключа
+    pipe.setex(key, hard, data)
+    # Копия на случай недоступности Gismeteo живет дольше основного ключа
+    pipe.setex(f'stale:{key}', STALE_TTL, data)
+    return key, soft, data
 
 
 async def set_cached_forecast(kind: str, latitude: float, longitude: float, api_response: dict) -> None:
     """
     Устанаввливает ключ для доступа к прогнозу по типу прогноза и координатам.
+    Если Redis недоступен, прогноз остается в кэше процесса и в снимке на диске.
     :param kind: Тип прогноза: now, today, tomorrow
     :param latitude: широта полученная от пользователя
     :param longitude: долгота полученная от пользователя
     :param api_response: ответ от сервиса прогноза погоды
     :return: None
     """
-    key = f'{kind}:{latitude}:{longitude}'
-    data = json.dumps(api_response)
-    await redis_client.setex(key, ttl, data)
+    async with get_redis_client().pipeline(transaction=False) as pipe:
+        key, soft, data = _queue_set(pipe, kind, latitude, longitude, api_response)
+        try:
+            with REDIS_LATENCY.time("set"):
+                await pipe.execute()
+        except RedisError as e:
+            logging.error(f"Error setting cached forecast: {e}")
+    memory_cache.set(key, api_response, soft, estimate_size(api_response))
+    forecast_snapshot.put(key, kind, data)
+
+
+async def set_cached_forecasts(entries: Iterable[Tuple[str, float, float, dict]]) -> None:
+    """
+    Сохраняет несколько прогнозов за один запрос к Redis.
+    :param entries: Кортежи (kind, latitude, longitude, api_response)
+    :return: None
+    """
+    written = []
+    async with get_redis_client().pipeline(transaction=False) as pipe:
+        for kind, latitude, longitude, api_response in entries:
+            written.append((kind, api_response, *_queue_set(pipe, kind, latitude, longitude, api_response)))
+        if written:
+            try:
+                with REDIS_LATENCY.time("mset"):
+                    await pipe.execute()
+            except RedisError as e:
+                logging.error(f"Error setting cached forecasts: {e}")
+    for kind, api_response, key, soft, data in written:
+        memory_cache.set(key, api_response, soft, estimate_size(api_response))
+        forecast_snapshot.put(key, kind, data)
+
+
+def _load(
+    kind: str, key: str, data: bytes, pttl: int, revalidate: Callable[[], Awaitable] = None
+) -> Optional[dict]:
+    """
+    Разбирает прогноз, прочитанный из Redis, и учитывает его в статистике.
+    :param kind: Тип прогноза: now, today, tomorrow
+    :param key: Ключ прогноза
+    :param data: Значение ключа или None
+    :param pttl: Результат PTTL для ключа
+    :param revalidate: Корутинная функция без аргументов, обновляющая прогноз в кэше
+    :return: Dict или None
+    """
+    if data is None:
+        cache_stats[(kind, "miss")] += 1
+        bind(cache="miss")
+        return None
+    try:
+        forecast = decode_forecast(data)
+    except UnsupportedCacheFormat as e:
+        logging.warning(f"Cached forecast {key} was skipped: {e}")
+        cache_stats[(kind, "miss")] += 1
+        bind(cache="miss")
+        return None
+    fresh_for = soft_ttl_left(kind, pttl) if pttl > 0 else 0
+    if fresh_for > 0 or pttl == -1:
+        cache_stats[(kind, "fresh")] += 1
+        bind(cache="fresh")
+        if fresh_for > 0:
+            memory_cache.set(key, forecast, fresh_for, estimate_size(forecast))
+    else:
+        cache_stats[(kind, "stale")] += 1
+        bind(cache="stale")
+        if revalidate is not None:
+            revalidate_in_background(key, revalidate)
+    return forecast
+
+
+def _load_snapshot(kind: str, entry: SnapshotEntry, revalidate: Callable[[], Awaitable] = None) -> Optional[dict]:
+    """
+    Разбирает прогноз из снимка на диске, когда Redis недоступен. Сроки жизни
+    те же, что в Redis: после жесткого срока прогноз считается промахом.
+    :param kind: Тип прогноза: now, today, tomorrow
+    :param entry: Прогноз из снимка или None
+    :param revalidate: Корутинная функция без аргументов, обновляющая прогноз в кэше
+    :return: Dict или None
+    """
+    soft, hard = get_ttl(kind)
+    age = forecast_snapshot.age(entry) if entry is not None else hard
+    if age >= hard:
+        cache_stats[(kind, "miss")] += 1
+        bind(cache="miss")
+        return None
+    try:
+        forecast = decode_forecast(entry.data)
+    except UnsupportedCacheFormat as e:
+        logging.warning(f"Snapshot forecast {entry.key} was skipped: {e}")
+        cache_stats[(kind, "miss")] += 1
+        bind(cache="miss")
+        return None
+    if age < soft:
+        cache_stats[(kind, "fresh")] += 1
+        bind(cache="fresh_snapshot")
+        memory_cache.set(entry.key, forecast, soft - age, estimate_size(forecast))
+    else:
+        cache_stats[(kind, "stale")] += 1
+        bind(cache="stale_snapshot")
+        if revalidate is not None:
+            revalidate_in_background(entry.key, revalidate)
+    return forecast
 
 
-async def get_cached_forecast(kind: str, latitude: float, longitude: float) -> dict:
+async def get_cached_forecast(
+    kind: str,
+    latitude: float,
+    longitude: float,
+    revalidate: Callable[[], Awaitable] = None,
+) -> dict:
     """
-    Ответ пользователю из кэша Redis прогноз погоды по полученым координатам.
+    Ответ пользователю из кэша прогноз погоды по полученым координатам.
+    Сначала проверяется кэш в памяти процесса (L1), затем Redis (L2),
+    а если Redis недоступен — снимок на диске.
+    Прогноз с истекшим мягким сроком возвращается сразу, а revalidate
+    запускается в фоне, одна на ключ.
     :param kind: Тип прогноза: now, today, tomorrow
     :param latitude: широта полученная от пользователя
     :param longitude: долгота полученная от пользователя
-    :return: Dict
+    :param revalidate: Корутинная функция без аргументов, обновляющая прогноз в кэше
+    :return: Dict или None, если прогноза нет
     """
-    key = f'{kind}:{latitude}:{longitude}'
+    key = make_key(kind, latitude, longitude)
+    forecast = memory_cache.get(key)
+    if forecast is not None:
+        # В L1 прогноз живет только до мягкого срока
+        cache_stats[(kind, "fresh")] += 1
+        bind(cache="fresh_l1")
+        return forecast
     try:
-        data = await redis_client.get(key)
-        if data is None:
-            return None
-        return json.loads(data)
+        with REDIS_LATENCY.time("get"):
+            async with get_redis_client().pipeline(transaction=False) as pipe:
+                data, pttl = await pipe.get(key).pttl(key).execute()
+        return _load(kind, key, data, pttl, revalidate)
     except RedisError as e:
+        cache_stats[(kind, "error")] += 1
         logging.error(f"Error getting cached forecast: {e}")
-        raise e
+    return _load_snapshot(kind, await forecast_snapshot.get(key), revalidate)
+
+
+async def get_cached_forecasts(requests: Sequence[Tuple[str, float, float]]) -> List[Optional[dict]]:
+    """
+    Прогнозы для нескольких (kind, latitude, longitude) за один запрос к Redis.
+    Ключи, найденные в L1, в Redis не запрашиваются, а если Redis недоступен,
+    читаются из снимка на диске. Устаревшие прогнозы возвращаются без фонового
+    обновления: его выполняет вызывающий код.
+    :param requests: Кортежи (kind, latitude, longitude)
+    :return: Список прогнозов в порядке requests, None для промахов
+    """
+    keys = [make_key(kind, latitude, longitude) for kind, latitude, longitude in requests]
+    forecasts = [memory_cache.get(key) for key in keys]
+    missing = [index for index, forecast in enumerate(forecasts) if forecast is None]
+    for index, forecast in enumerate(forecasts):
+        if forecast is not None:
+            cache_stats[(requests[index][0], "fresh")] += 1
+    if not missing:
+        return forecasts
+    try:
+        # Повторяющиеся ключи запрашиваются один раз
+        unique = list(dict.fromkeys(keys[index] for index in missing))
+        async with get_redis_client().pipeline(transaction=False) as pipe:
+            pipe.mget(unique)
+            for key in unique:
+                pipe.pttl(key)
+            with REDIS_LATENCY.time("mget"):
+                values, *ttls = await pipe.execute()
+    except RedisError as e:
+        for index in missing:
+            cache_stats[(requests[index][0], "error")] += 1
+        logging.error(f"Error getting cached forecasts: {e}")
+        entries = await forecast_snapshot.get_many(keys[index] for index in missing)
+        for index in missing:
+            forecasts[index] = _load_snapshot(requests[index][0], entries.get(keys[index]))
+        return forecasts
+    found = dict(zip(unique, zip(values, ttls)))
+    for index in missing:
+        data, pttl = found[keys[index]]
+        forecasts[index] = _load(requests[index][0], keys[index], data, pttl)
+    return forecasts
+
+
+def revalidate_in_background(key: str, revalidate: Callable[[], Awaitable]) -> None:
+    """
+    Запускает фоновое обновление ключа, если оно еще не выполняется в этом процессе.
+    :param key: Ключ прогноза
+    :param revalidate: Корутинная функция без аргументов, обновляющая прогноз в кэше
+    :return: None
+    """
+    if key in revalidations:
+        return
+    task = asyncio.create_task(_revalidate(key, revalidate))
+    revalidations[key] = task
+    task.add_done_callback(lambda _: revalidations.pop(key, None))
+
+
+async def _revalidate(key: str, revalidate: Callable[[], Awaitable]) -> None:
+    try:
+        # Право на обновление берет одна реплика, остальные продолжают отдавать старый прогноз
+        if not await get_redis_client().set(f'revalidate:{key}', 1, nx=True, ex=CACHE_REVALIDATE_LEASE):
+            return
+    except RedisError as e:
+        logging.warning(f"Revalidation lease for {key} was not taken: {e}")
+    try:
+        await revalidate()
+        cache_stats[(key.split(':', 1)[0], "revalidated")] += 1
+    except Exception as e:
+        logging.error(f"Background refresh of {key} failed: {e}")
+
+
+async def get_stale_forecast(kind: str, latitude: float, longitude: float) -> dict:
+    """
+    Последний известный прогноз по координатам, даже если срок основного ключа истек.
+    Если его нет в Redis или Redis недоступен, берется прогноз из снимка на диске
+    не старше FORECAST_SNAPSHOT_MAX_AGE.
+    :param kind: Тип прогноза: now, today, tomorrow
+    :param latitude: широта полученная от пользователя
+    :param longitude: долгота полученная от пользователя
+    :return: Dict или None
+    """
+    key = make_key(kind, latitude, longitude)
+    try:
+        data = await get_redis_client().get(f'stale:{key}')
+        if data is not None:
+            return decode_forecast(data)
+    except (RedisError, UnsupportedCacheFormat) as e:
+        logging.error(f"Error getting stale forecast: {e}")
+    entry = await forecast_snapshot.get(key)
+    if entry is None:
+        return None
+    try:
+        return decode_forecast(entry.data)
+    except UnsupportedCacheFormat as e:
+        logging.error(f"Error getting snapshot forecast: {e}")
+        return None
+
+
+async def restore_cached_forecasts(entries: Iterable[SnapshotEntry]) -> int:
+    """
+    Прогревает кэши прогнозами из снимка после перезапуска: свежие попадают в L1,
+    а в Redis записываются только отсутствующие ключи с оставшимся сроком жизни,
+    чтобы не затереть более новые прогнозы других реплик.
+    :param entries: Прогнозы из снимка
+    :return: Число прогнозов, восстановленных хотя бы в одном кэше
+    """
+    restored = 0
+    async with get_redis_client().pipeline(transaction=False) as pipe:
+        for entry in entries:
+            age = forecast_snapshot.age(entry)
+            soft, hard = get_ttl(entry.kind)
+            if age >= max(hard, STALE_TTL):
+                continue
+            if age < soft and memory_cache.get(entry.key) is None:
+                try:
+                    forecast = decode_forecast(entry.data)
+                except UnsupportedCacheFormat:
+                    continue
+                memory_cache.set(entry.key, forecast, soft - age, estimate_size(forecast))
+            if age < hard:
+                pipe.set(entry.key, entry.data, px=int((hard - age) * 1000), nx=True)
+            if age < STALE_TTL:
+                pipe.set(f'stale:{entry.key}', entry.data, px=int((STALE_TTL - age) * 1000), nx=True)
+            restored += 1
+        try:
+            with REDIS_LATENCY.time("restore"):
+                await pipe.execute()
+        except RedisError as e:
+            logging.error(f"Forecasts from snapshot were not restored to redis: {e}")
+    return restored
 
 
 if __name__ == "__main__":
+    import time
+
+    ROUNDS = 2000
+    BATCH = 50
+
     async def main():
         api_response = {
             "date": {"local": "2026-03-09T12:34:56+03:00"},
@@ -62,4 +443,36 @@ if __name__ == "__main__":
         await set_cached_forecast("current", 59.75, 27.61, api_response)
         data = await get_cached_forecast("current", 59.75, 27.61)
         print(data)
+        print(get_cache_stats())
+        print(memory_cache.stats())
+
+        points = [("now", 55 + index * 0.05, 37 + index * 0.05) for index in range(ROUNDS)]
+
+        async def single_set():
+            for kind, latitude, longitude in points:
+                await set_cached_forecast(kind, latitude, longitude, api_response)
+
+        async def batched_set():
+            for start in range(0, ROUNDS, BATCH):
+                await set_cached_forecasts((*point, api_response) for point in points[start:start + BATCH])
+
+        async def single_get():
+            for point in points:
+                await get_cached_forecast(*point)
+
+        async def batched_get():
+            for start in range(0, ROUNDS, BATCH):
+                await get_cached_forecasts(points[start:start + BATCH])
+
+        for name, func in (
+            ("set", single_set), (f"set x{BATCH}", batched_set),
+            ("get", single_get), (f"get x{BATCH}", batched_get),
+        ):
+            # Замеряем Redis, а не кэш в памяти процесса
+            memory_cache.clear()
+            started = time.perf_counter()
+            await func()
+            print(f"{name:>8}: {ROUNDS / (time.perf_counter() - started):,.0f} ops/sec")
+        await close_redis_clients()
+
     asyncio.run(main())
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict
+
+from redis import RedisError
+from redis.exceptions import LockError
+
+from cache.redis_cache import get_redis_client
+from config import (SINGLE_FLIGHT_LOCK_TIMEOUT, SINGLE_FLIGHT_LOCK_WAIT,
+                    SINGLE_FLIGHT_REDIS_LOCK)
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные вызовы с одинаковым ключом в один.
+
+    Функция выполняется отдельной задачей, которую все вызовы ждут через
+    asyncio.shield: отмена любого из них, в том числе первого, не отменяет
+    запрос и не задевает остальных.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._calls
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Помечаем исключение полученным, если все ожидавшие вызовы были отменены
+            task.exception()
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполняет func один раз для всех одновременных вызовов с ключом key.
+
+        :param key: Ключ объединения вызовов
+        :param func: Корутинная функция без аргументов
+        :return: Результат func
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.create_task(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task)
+
+
+@asynccontextmanager
+async def distributed_lock(key: str):
+    """
+    Блокировка в Redis, чтобы несколько реплик бота не запрашивали один ключ одновременно.
+
+    Если блокировка отключена, Redis недоступен или ее не удалось получить
+    за SINGLE_FLIGHT_LOCK_WAIT секунд, код выполняется без блокировки.
+
+    :param key: Ключ кэша прогноза
+    :return: True, если блокировка получена
+    """
+    if not SINGLE_FLIGHT_REDIS_LOCK:
+        yield False
+        return
+
+    lock = get_redis_client().lock(
+        f"lock:{key}",
+        timeout=SINGLE_FLIGHT_LOCK_TIMEOUT,
+        blocking_timeout=SINGLE_FLIGHT_LOCK_WAIT,
+    )
+    try:
+        acquired = await lock.acquire()
+    except RedisError as e:
+        logging.error(f"Cannot acquire redis lock for key {key}: {e}")
+        acquired = False
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            try:
+                await lock.release()
+            except (LockError, RedisError) as e:
+                logging.warning(f"Cannot release redis lock for key {key}: {e}")
+
+
+single_flight = SingleFlight()
+
+
+if __name__ == "__main__":
+    async def main():
+        calls = 0
+
+        async def fake_upstream():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.1)
+            return {"temperature": {"air": {"C": 3.2}}}
+
+        async def failing_upstream():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.1)
+            raise ConnectionError("upstream is down")
+
+        group = SingleFlight()
+        results = await asyncio.gather(
+            *(group.do("now:udeeum", fake_upstream) for _ in range(100))
+        )
+        assert calls == 1, calls
+        assert all(result is results[0] for result in results)
+        assert not group.in_flight("now:udeeum")
+        print(f"callers: {len(results)}, upstream calls: {calls}")
+
+        # Отмена первого вызова не отменяет остальных
+        calls = 0
+        leader = asyncio.create_task(group.do("today:udeeum", fake_upstream))
+        await asyncio.sleep(0)
+        followers = [asyncio.create_task(group.do("today:udeeum", fake_upstream)) for _ in range(10)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        results = await asyncio.gather(*followers)
+        assert leader.cancelled() and calls == 1
+        assert all(result["temperature"]["air"]["C"] == 3.2 for result in results)
+        print(f"leader cancelled, followers served: {len(results)}, upstream calls: {calls}")
+
+        # Ошибка запроса получают все ожидающие вызовы
+        calls = 0
+        outcomes = await asyncio.gather(
+            *(group.do("tomorrow:udeeum", failing_upstream) for _ in range(10)), return_exceptions=True
+        )
+        assert calls == 1 and all(isinstance(outcome, ConnectionError) for outcome in outcomes)
+        print(f"errors propagated: {len(outcomes)}, upstream calls: {calls}")
+
+    asyncio.run(main())
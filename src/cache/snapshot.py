@@ -0,0 +1,267 @@
+"""
+Снимок полученных прогнозов на диске в SQLite.
+
+Прогнозы записываются в том же формате, что и в Redis, пачками в отдельном
+потоке, поэтому запись не задерживает ответы пользователям. Снимок отвечает,
+когда Redis или Gismeteo недоступны, и прогревает кэши после перезапуска.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from config import (FORECAST_SNAPSHOT_ENABLED,
+                    FORECAST_SNAPSHOT_FLUSH_INTERVAL,
+                    FORECAST_SNAPSHOT_MAX_AGE, FORECAST_SNAPSHOT_MAX_BYTES,
+                    FORECAST_SNAPSHOT_MAX_ENTRIES, FORECAST_SNAPSHOT_PATH)
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS forecasts ("
+    "key TEXT PRIMARY KEY, kind TEXT NOT NULL, data BLOB NOT NULL, "
+    "fetched_at REAL NOT NULL, size INTEGER NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_forecasts_fetched_at ON forecasts (fetched_at)",
+)
+
+
+class SnapshotEntry(NamedTuple):
+    key: str
+    kind: str
+    data: bytes
+    # Время получения прогноза по часам системы: переживает перезапуск процесса
+    fetched_at: float
+
+
+class ForecastSnapshot:
+    """
+    Ограниченное по числу записей, объему и возрасту хранилище прогнозов.
+
+    Все обращения к SQLite выполняются в одном отдельном потоке.
+
+    :param path: Путь к файлу SQLite
+    :param flush_interval: Период записи накопленных прогнозов в секундах
+    :param max_entries: Максимальное число прогнозов в снимке
+    :param max_bytes: Максимальный объем прогнозов в снимке
+    :param max_age: Возраст, после которого прогноз не отдается и удаляется
+    """
+
+    def __init__(
+        self,
+        path: str = FORECAST_SNAPSHOT_PATH,
+        flush_interval: float = FORECAST_SNAPSHOT_FLUSH_INTERVAL,
+        max_entries: int = FORECAST_SNAPSHOT_MAX_ENTRIES,
+        max_bytes: int = FORECAST_SNAPSHOT_MAX_BYTES,
+        max_age: float = FORECAST_SNAPSHOT_MAX_AGE,
+        clock=time.time,
+    ):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._clock = clock
+        self.pending: Dict[str, SnapshotEntry] = {}
+        self.metrics = Counter()
+        self._connection: sqlite3.Connection = None
+        self._executor: ThreadPoolExecutor = None
+        self._task: asyncio.Task = None
+
+    @property
+    def running(self) -> bool:
+        return self._connection is not None
+
+    def age(self, entry: SnapshotEntry) -> float:
+        return self._clock() - entry.fetched_at
+
+    def put(self, key: str, kind: str, data: bytes) -> None:
+        """
+        Запоминает прогноз до следующей записи на диск. Повторные прогнозы
+        одного ключа до записи заменяют друг друга.
+
+        :param key: Ключ кэша прогноза
+        :param kind: Тип прогноза
+        :param data: Прогноз в формате кэша
+        :return: None
+        """
+        if self.running:
+            self.pending[key] = SnapshotEntry(key, kind, data, self._clock())
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def _open(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            connection.execute(statement)
+        connection.commit()
+        return connection
+
+    def _write(self, entries: List[SnapshotEntry]) -> int:
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO forecasts (key, kind, data, fetched_at, size) VALUES (?, ?, ?, ?, ?)",
+                [(entry.key, entry.kind, entry.data, entry.fetched_at, len(entry.data)) for entry in entries],
+            )
+            return self._trim()
+
+    def _trim(self) -> int:
+        """
+        Удаляет устаревшие прогнозы, затем самые старые, пока снимок не уложится в ограничения.
+
+        :return: Число удаленных прогнозов
+        """
+        removed = self._connection.execute(
+            "DELETE FROM forecasts WHERE fetched_at < ?", (self._clock() - self.max_age,)
+        ).rowcount
+        entries, size = self._connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM forecasts"
+        ).fetchone()
+        if entries <= self.max_entries and size <= self.max_bytes:
+            return removed
+        expired = []
+        for key, entry_size in self._connection.execute("SELECT key, size FROM forecasts ORDER BY fetched_at"):
+            if entries - len(expired) <= self.max_entries and size <= self.max_bytes:
+                break
+            expired.append((key,))
+            size -= entry_size
+        self._connection.executemany("DELETE FROM forecasts WHERE key = ?", expired)
+        return removed + len(expired)
+
+    def _read(self, keys: List[str], since: float) -> List[SnapshotEntry]:
+        placeholders = ", ".join("?" * len(keys))
+        rows = self._connection.execute(
+            f"SELECT key, kind, data, fetched_at FROM forecasts WHERE key IN ({placeholders}) AND fetched_at >= ?",
+            (*keys, since),
+        )
+        return [SnapshotEntry(*row) for row in rows]
+
+    def _latest(self, since: float, limit: int) -> List[SnapshotEntry]:
+        rows = self._connection.execute(
+            "SELECT key, kind, data, fetched_at FROM forecasts WHERE fetched_at >= ? ORDER BY fetched_at DESC LIMIT ?",
+            (since, limit),
+        )
+        return [SnapshotEntry(*row) for row in rows]
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, SnapshotEntry]:
+        """
+        Прогнозы из снимка не старше max_age.
+
+        :param keys: Ключи кэша прогноза
+        :return: Dict вида {ключ: SnapshotEntry} для найденных ключей
+        """
+        if not self.running:
+            return {}
+        found = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            entry = self.pending.get(key)
+            if entry is not None:
+                found[key] = entry
+            else:
+                missing.append(key)
+        if missing:
+            try:
+                for entry in await self._run(self._read, missing, self._clock() - self.max_age):
+                    found[entry.key] = entry
+            except sqlite3.Error as e:
+                self.metrics["errors"] += 1
+                logging.error(f"Forecast snapshot was not read: {e}")
+        self.metrics["lookups"] += 1
+        self.metrics["hits"] += len(found)
+        return found
+
+    async def get(self, key: str) -> Optional[SnapshotEntry]:
+        return (await self.get_many([key])).get(key)
+
+    async def load(self, limit: int = None) -> List[SnapshotEntry]:
+        """
+        Самые свежие прогнозы снимка для прогрева кэшей после запуска.
+
+        :param limit: Максимальное число прогнозов
+        :return: Список SnapshotEntry, сначала самые свежие
+        """
+        if not self.running:
+            return []
+        try:
+            return await self._run(self._latest, self._clock() - self.max_age, limit or self.max_entries)
+        except sqlite3.Error as e:
+            self.metrics["errors"] += 1
+            logging.error(f"Forecast snapshot was not loaded: {e}")
+            return []
+
+    async def flush(self) -> int:
+        """
+        Записывает накопленные прогнозы на диск. Если запись не удалась,
+        прогнозы остаются в очереди, если их еще не заменили более новые.
+
+        :return: Число записанных прогнозов
+        """
+        if not self.pending or not self.running:
+            return 0
+        batch, self.pending = self.pending, {}
+        try:
+            removed = await self._run(self._write, list(batch.values()))
+        except sqlite3.Error as e:
+            self.metrics["errors"] += 1
+            logging.error(f"Forecast snapshot was not written: {e}")
+            self.pending = {**batch, **self.pending}
+            return 0
+        self.metrics["flushes"] += 1
+        self.metrics["written"] += len(batch)
+        self.metrics["removed"] += removed
+        return len(batch)
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def start(self) -> None:
+        """
+        Открывает снимок и запускает периодическую запись. Если файл недоступен,
+        бот работает без снимка.
+
+        :return: None
+        """
+        if not FORECAST_SNAPSHOT_ENABLED or self.running:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="forecast-snapshot")
+        try:
+            self._connection = await self._run(self._open)
+        except (OSError, sqlite3.Error) as e:
+            logging.error(f"Forecast snapshot {self.path} is disabled: {e}")
+            self._executor.shutdown(wait=False)
+            self._executor = None
+            return
+        self._task = asyncio.create_task(self._loop())
+        logging.info(f"Forecast snapshot was opened: {self.path}")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if not self.running:
+            return
+        await self.flush()
+        await self._run(self._connection.close)
+        self._connection = None
+        self._executor.shutdown()
+        self._executor = None
+
+    def stats(self) -> dict:
+        return {**self.metrics, "pending": len(self.pending)}
+
+
+forecast_snapshot = ForecastSnapshot()
@@ -7,14 +7,85 @@ load_dotenv()
 GISMETEO_TOKEN = os.getenv("API_KEY")
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 
+# База данных. DATABASE_URL позволяет подменить Postgres, например на sqlite+aiosqlite:///weather.db
+PGHOST = os.getenv("PGHOST")
+PGPORT = int(os.getenv("PGPORT", 5432))
+POSTGRES_DB = os.getenv("POSTGRES_DB")
+POSTGRES_USER = os.getenv("POSTGRES_USER")
+POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD")
+DATABASE_URL = (
+    os.getenv("DATABASE_URL")
+    or f"postgresql+psycopg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{PGHOST}:{PGPORT}/{POSTGRES_DB}"
+)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 5))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 5))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", 5))
+# Создавать схему при запуске бота (в фоне, не задерживая начало работы).
+# При false схема создается отдельной командой: python -m db.migrate
+DB_SCHEMA_ON_STARTUP = os.getenv("DB_SCHEMA_ON_STARTUP", "true").lower() == "true"
+
+# Без этих переменных бот не запускается
+REQUIRED_SETTINGS = ("API_KEY", "TELEGRAM_TOKEN")
+POSTGRES_SETTINGS = ("PGHOST", "POSTGRES_DB", "POSTGRES_USER", "POSTGRES_PASSWORD")
+# Без секрета любой, кто узнал адрес webhook, может присылать боту обновления
+WEBHOOK_SETTINGS = ("WEBHOOK_URL", "WEBHOOK_SECRET")
+
 REDIS_TTL = 600
 
-FORCAST_ENDPOINT = "https://api.gismeteo.net/v2/weather/forecast/?"
-CURRENT_ENDPOINT = "https://api.gismeteo.net/v2/weather/current/?"
+# Время жизни прогноза в кэше по типу: (soft, hard) в секундах. До soft прогноз
+# свежий, между soft и hard отдается сразу и обновляется в фоне
+CACHE_TTLS = {
+    "now": (int(os.getenv("CACHE_SOFT_TTL_NOW", REDIS_TTL)), int(os.getenv("CACHE_HARD_TTL_NOW", 30 * 60))),
+    "today": (int(os.getenv("CACHE_SOFT_TTL_TODAY", 30 * 60)), int(os.getenv("CACHE_HARD_TTL_TODAY", 3 * 60 * 60))),
+    "tomorrow": (int(os.getenv("CACHE_SOFT_TTL_TOMORROW", 3 * 60 * 60)), int(os.getenv("CACHE_HARD_TTL_TOMORROW", 12 * 60 * 60))),
+    "forecast": (int(os.getenv("CACHE_SOFT_TTL_FORECAST", 30 * 60)), int(os.getenv("CACHE_HARD_TTL_FORECAST", 3 * 60 * 60))),
+}
+CACHE_TTL_DEFAULT = (REDIS_TTL, 3 * REDIS_TTL)
+# Сколько секунд реплика держит право на фоновое обновление ключа
+CACHE_REVALIDATE_LEASE = int(os.getenv("CACHE_REVALIDATE_LEASE", 30))
+
+# Пул соединений с Redis
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 5))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", 5))
+REDIS_SOCKET_CONNECT_TIMEOUT = float(os.getenv("REDIS_SOCKET_CONNECT_TIMEOUT", 2))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30))
+
+# Схема квантования координат для ключей кэша: "geohash:<символов>" или "grid:<шаг в градусах>"
+GEO_BUCKETS = {
+    "now": os.getenv("GEO_BUCKET_NOW", "geohash:6"),
+    "today": os.getenv("GEO_BUCKET_TODAY", "geohash:5"),
+    "tomorrow": os.getenv("GEO_BUCKET_TOMORROW", "geohash:5"),
+    "forecast": os.getenv("GEO_BUCKET_FORECAST", "geohash:5"),
+}
+GEO_BUCKET_DEFAULT = os.getenv("GEO_BUCKET_DEFAULT", "geohash:6")
+
+# Формат хранения прогнозов в Redis: binary или json
+CACHE_CODEC = os.getenv("CACHE_CODEC", "binary")
+CACHE_COMPRESSION_MIN_BYTES = int(os.getenv("CACHE_COMPRESSION_MIN_BYTES", 512))
+
+L1_CACHE_MAX_ENTRIES = int(os.getenv("L1_CACHE_MAX_ENTRIES", 10000))
+L1_CACHE_MAX_BYTES = int(os.getenv("L1_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+COORDINATES_CACHE_TTL = int(os.getenv("COORDINATES_CACHE_TTL", 24 * 60 * 60))
+COORDINATES_CACHE_MAX_ENTRIES = int(os.getenv("COORDINATES_CACHE_MAX_ENTRIES", 100000))
+COORDINATES_CACHE_REDIS = os.getenv("COORDINATES_CACHE_REDIS", "true").lower() == "true"
+COORDINATES_INVALIDATION_CHANNEL = "coordinates:invalidate"
+
+# Переопределяется для запуска на локальной заглушке API
+GISMETEO_BASE_URL = os.getenv("GISMETEO_BASE_URL", "https://api.gismeteo.net")
+FORCAST_ENDPOINT = f"{GISMETEO_BASE_URL}/v2/weather/forecast/?"
+CURRENT_ENDPOINT = f"{GISMETEO_BASE_URL}/v2/weather/current/?"
 TOMORROW = "aggregate/?"
 HEADERS = {"X-Gismeteo-Token": GISMETEO_TOKEN}
 ONE_DAY = 1
 TWO_DAYS = 2
+# unified — один многодневный прогноз на ячейку, из которого вырезаются текущий интервал,
+# сегодня и завтра; endpoints — отдельные запросы current, forecast и aggregate
+FORECAST_SOURCE = os.getenv("FORECAST_SOURCE", "unified")
+UNIFIED_FORECAST_DAYS = int(os.getenv("UNIFIED_FORECAST_DAYS", TWO_DAYS))
 
 OFFSET = 8
 OFFSET_TIME = 11
@@ -41,3 +112,132 @@ WIND_DIRECTION = {
     7: "Западный",
     8: "Северо-западный",
 }
+
+HTTP_CONNECTION_LIMIT = int(os.getenv("HTTP_CONNECTION_LIMIT", 100))
+HTTP_CONNECTION_LIMIT_PER_HOST = int(os.getenv("HTTP_CONNECTION_LIMIT_PER_HOST", 30))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 30))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", 300))
+HTTP_REQUEST_TIMEOUT = float(os.getenv("HTTP_REQUEST_TIMEOUT", 10))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 3))
+
+SINGLE_FLIGHT_REDIS_LOCK = os.getenv("SINGLE_FLIGHT_REDIS_LOCK", "false").lower() == "true"
+SINGLE_FLIGHT_LOCK_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_LOCK_TIMEOUT", 15))
+SINGLE_FLIGHT_LOCK_WAIT = float(os.getenv("SINGLE_FLIGHT_LOCK_WAIT", 10))
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() == "true"
+PREFETCH_INTERVAL = float(os.getenv("PREFETCH_INTERVAL", 30))
+PREFETCH_LEAD_TIME = float(os.getenv("PREFETCH_LEAD_TIME", 60))
+PREFETCH_TOP_N = int(os.getenv("PREFETCH_TOP_N", 50))
+PREFETCH_BUDGET_PER_MINUTE = int(os.getenv("PREFETCH_BUDGET_PER_MINUTE", 30))
+PREFETCH_DECAY_INTERVAL = float(os.getenv("PREFETCH_DECAY_INTERVAL", 600))
+PREFETCH_SKETCH_WIDTH = int(os.getenv("PREFETCH_SKETCH_WIDTH", 2048))
+PREFETCH_SKETCH_DEPTH = int(os.getenv("PREFETCH_SKETCH_DEPTH", 4))
+# Сколько самых населенных ячеек прогревать после запуска
+PREFETCH_WARM_CELLS = int(os.getenv("PREFETCH_WARM_CELLS", 20))
+
+# Разбирать ответ API потоково, не собирая весь JSON-документ в памяти
+STREAMING_PARSER = os.getenv("STREAMING_PARSER", "false").lower() == "true"
+
+LOCALE = os.getenv("LOCALE", "ru")
+TELEGRAM_MESSAGE_LIMIT = 4096
+RENDER_CACHE_MAX_ENTRIES = int(os.getenv("RENDER_CACHE_MAX_ENTRIES", 5000))
+RENDER_CACHE_MAX_BYTES = int(os.getenv("RENDER_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+
+# Режим получения обновлений: polling или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", 1000))
+
+# Параллельная обработка обновлений с сохранением порядка внутри чата
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", 64))
+UPDATE_MAX_IN_FLIGHT = int(os.getenv("UPDATE_MAX_IN_FLIGHT", 1000))
+UPDATE_MAX_PENDING_PER_CHAT = int(os.getenv("UPDATE_MAX_PENDING_PER_CHAT", 10))
+
+# Ограничение частоты запросов к Gismeteo (общее для реплик через Redis)
+GISMETEO_RATE_LIMIT = float(os.getenv("GISMETEO_RATE_LIMIT", 10))
+GISMETEO_BURST = int(os.getenv("GISMETEO_BURST", 20))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", 30))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv("BREAKER_HALF_OPEN_PROBES", 1))
+# Сколько хранится последний известный прогноз для ответа при недоступности Gismeteo
+STALE_TTL = int(os.getenv("STALE_TTL", 24 * 60 * 60))
+# Копия полученных прогнозов на диске: ответ при недоступности Redis или Gismeteo и прогрев после перезапуска
+FORECAST_SNAPSHOT_ENABLED = os.getenv("FORECAST_SNAPSHOT_ENABLED", "true").lower() == "true"
+FORECAST_SNAPSHOT_PATH = os.getenv("FORECAST_SNAPSHOT_PATH", "data/forecast_snapshot.sqlite3")
+FORECAST_SNAPSHOT_FLUSH_INTERVAL = float(os.getenv("FORECAST_SNAPSHOT_FLUSH_INTERVAL", 5))
+FORECAST_SNAPSHOT_MAX_ENTRIES = int(os.getenv("FORECAST_SNAPSHOT_MAX_ENTRIES", 20000))
+FORECAST_SNAPSHOT_MAX_BYTES = int(os.getenv("FORECAST_SNAPSHOT_MAX_BYTES", 128 * 1024 * 1024))
+# Прогноз старше этого срока не отдается даже как устаревший и удаляется из снимка
+FORECAST_SNAPSHOT_MAX_AGE = int(os.getenv("FORECAST_SNAPSHOT_MAX_AGE", STALE_TTL))
+
+# Ежедневная рассылка прогноза подписчикам
+SUBSCRIPTION_TIMEZONE = os.getenv("SUBSCRIPTION_TIMEZONE", "Europe/Moscow")
+SUBSCRIPTION_INTERVAL = int(os.getenv("SUBSCRIPTION_INTERVAL", 60))
+# Лимиты Telegram: около 30 сообщений в секунду на бота и 1 в секунду в один чат
+SUBSCRIPTION_SEND_RATE = float(os.getenv("SUBSCRIPTION_SEND_RATE", 25))
+SUBSCRIPTION_PER_CHAT_INTERVAL = float(os.getenv("SUBSCRIPTION_PER_CHAT_INTERVAL", 1))
+SUBSCRIPTION_SEND_WORKERS = int(os.getenv("SUBSCRIPTION_SEND_WORKERS", 32))
+SUBSCRIPTION_FETCH_CONCURRENCY = int(os.getenv("SUBSCRIPTION_FETCH_CONCURRENCY", 8))
+SUBSCRIPTION_CLAIM_BATCH = int(os.getenv("SUBSCRIPTION_CLAIM_BATCH", 5000))
+# Через сколько секунд неотправленный прогноз забирается для рассылки повторно
+SUBSCRIPTION_CLAIM_LEASE = int(os.getenv("SUBSCRIPTION_CLAIM_LEASE", 15 * 60))
+
+# История координат: помесячные партиции в Postgres и срок хранения
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", 180))
+HISTORY_PARTITIONS_AHEAD = int(os.getenv("HISTORY_PARTITIONS_AHEAD", 2))
+HISTORY_MAINTENANCE_INTERVAL = float(os.getenv("HISTORY_MAINTENANCE_INTERVAL", 6 * 60 * 60))
+# Буфер записи координат: сброс в базу каждые N мс или при N накопленных обновлениях
+COORDINATES_BUFFER_ENABLED = os.getenv("COORDINATES_BUFFER_ENABLED", "true").lower() == "true"
+COORDINATES_FLUSH_INTERVAL_MS = int(os.getenv("COORDINATES_FLUSH_INTERVAL_MS", 500))
+COORDINATES_FLUSH_ROWS = int(os.getenv("COORDINATES_FLUSH_ROWS", 500))
+# Сколько строк истории держать, пока база недоступна; последние координаты не теряются
+COORDINATES_BUFFER_MAX_PENDING = int(os.getenv("COORDINATES_BUFFER_MAX_PENDING", 50000))
+# Максимальная пауза между повторами сброса, пока база недоступна, в секундах
+COORDINATES_FLUSH_BACKOFF_MAX = float(os.getenv("COORDINATES_FLUSH_BACKOFF_MAX", 30))
+# Geohash координат чата: 9 символов — около 5 м, ячейка любой меньшей точности ищется по префиксу
+COORDINATES_GEOHASH_PRECISION = int(os.getenv("COORDINATES_GEOHASH_PRECISION", 9))
+# Точность ячеек для группировки чатов, должна совпадать с GEO_BUCKET_FORECAST
+LOCATION_CELL_PRECISION = int(os.getenv("LOCATION_CELL_PRECISION", 5))
+LOCATION_CELL_PAGE_SIZE = int(os.getenv("LOCATION_CELL_PAGE_SIZE", 1000))
+GEOHASH_BACKFILL_BATCH = int(os.getenv("GEOHASH_BACKFILL_BATCH", 5000))
+
+# Проверки для оркестратора: /health/live и /health/ready на отдельном HTTP-порту
+HEALTH_ENABLED = os.getenv("HEALTH_ENABLED", "true").lower() == "true"
+HEALTH_HOST = os.getenv("HEALTH_HOST", "0.0.0.0")
+HEALTH_PORT = int(os.getenv("HEALTH_PORT", 8081))
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", 2))
+# Как долго результат проверок переиспользуется между запросами /health/ready
+HEALTH_CHECK_CACHE_SECONDS = float(os.getenv("HEALTH_CHECK_CACHE_SECONDS", 5))
+# Зависимости, без которых реплика не считается готовой
+READINESS_REQUIRED = tuple(
+    name for name in os.getenv("READINESS_REQUIRED", "postgres,redis").split(",") if name
+)
+
+# Метрики в формате Prometheus на отдельном HTTP-порту
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))
+
+# Логирование: text или json, запись через очередь в отдельном потоке
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s - %(name)s"
+LOG_QUEUE = os.getenv("LOG_QUEUE", "true").lower() == "true"
+# Доля записей INFO, попадающих в лог; предупреждения и ошибки пишутся всегда
+LOG_INFO_SAMPLE_RATE = float(os.getenv("LOG_INFO_SAMPLE_RATE", 1))
+
+
+def missing_settings() -> list:
+    """
+    Возвращает имена обязательных переменных окружения, которые не заданы.
+
+    :return: Список имен переменных
+    """
+    required = REQUIRED_SETTINGS if os.getenv("DATABASE_URL") else REQUIRED_SETTINGS + POSTGRES_SETTINGS
+    if BOT_MODE == "webhook":
+        required += WEBHOOK_SETTINGS
+    return [name for name in required if not os.getenv(name)]
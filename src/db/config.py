@@ -1,27 +0,0 @@
-from pathlib import Path
-
-from pydantic_settings import BaseSettings, SettingsConfigDict
-
-BASE_DIR = Path(__file__).resolve().parent.parent.parent
-
-
-class Settings(BaseSettings):
-    model_config = SettingsConfigDict(
-        env_file=BASE_DIR / ".env", env_file_encoding="utf-8"
-    )
-
-    PGHOST: str
-    PGPORT: int
-    POSTGRES_DB: str
-    POSTGRES_USER: str
-    POSTGRES_PASSWORD: str
-
-    API_KEY: str
-    TELEGRAM_TOKEN: str
-
-    @property
-    def database_url(self) -> str:
-        return f"postgresql+psycopg://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.PGHOST}:{self.PGPORT}/{self.POSTGRES_DB}"
-
-
-settings = Settings()
@@ -1,9 +1,76 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import (AsyncEngine, AsyncSession,
+                                    async_sessionmaker, create_async_engine)
 
-from db.config import settings
+from config import (DATABASE_URL, DB_CONNECT_TIMEOUT, DB_MAX_OVERFLOW,
+                    DB_POOL_RECYCLE, DB_POOL_SIZE, DB_POOL_TIMEOUT)
 
-SQLALCHEMY_DATABASE_URL = settings.database_url
+SQLALCHEMY_DATABASE_URL = DATABASE_URL
 
-engine = create_engine(url=SQLALCHEMY_DATABASE_URL)
-session_factory = sessionmaker(bind=engine)
+_engine: AsyncEngine = None
+_session_factory: async_sessionmaker = None
+
+
+def engine_options(url: str) -> dict:
+    """
+    Параметры пула соединений. SQLite (например, sqlite+aiosqlite) пул не настраивает.
+
+    :param url: URL базы данных
+    :return: Dict с параметрами create_async_engine
+    """
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        # Без таймаута подключение к недоступному по сети серверу ждет ответа бесконечно
+        "connect_args": {"connect_timeout": DB_CONNECT_TIMEOUT},
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+
+def get_engine() -> AsyncEngine:
+    """
+    Возвращает движок SQLAlchemy. Движок и драйвер базы создаются при первом обращении,
+    а не при импорте, чтобы не задерживать запуск бота.
+
+    :return: AsyncEngine
+    """
+    global _engine
+    if _engine is None:
+        _engine = create_async_engine(
+            url=SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL)
+        )
+    return _engine
+
+
+def create_session() -> AsyncSession:
+    global _session_factory
+    if _session_factory is None:
+        _session_factory = async_sessionmaker(bind=get_engine(), expire_on_commit=False)
+    return _session_factory()
+
+
+async def dispose_engine() -> None:
+    global _engine, _session_factory
+    if _engine is not None:
+        await _engine.dispose()
+        _engine = None
+        _session_factory = None
+
+
+def database_dialect() -> str:
+    """
+    Имя диалекта по URL базы, без создания движка.
+
+    :return: postgresql, sqlite и т. д.
+    """
+    return SQLALCHEMY_DATABASE_URL.partition(":")[0].partition("+")[0]
+
+
+def insert_for(dialect_name: str):
+    if dialect_name == "sqlite":
+        return sqlite.insert
+    return postgresql.insert
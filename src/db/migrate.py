@@ -0,0 +1,39 @@
+"""
+Создание и обновление схемы базы данных отдельно от запуска бота:
+
+python -m db.migrate
+"""
+import asyncio
+import logging
+
+from db.database import dispose_engine
+from db.query.history import ensure_history_partitions
+from db.query.locations import backfill_geohash, rebuild_location_cells
+from db.query.orm import create_data_base_and_tables
+
+
+async def migrate() -> None:
+    """
+    Создает таблицы, индексы и партиции истории координат, заполняет geohash
+    у старых координат и пересчитывает население ячеек.
+
+    :return: None
+    """
+    await create_data_base_and_tables()
+    filled = await backfill_geohash()
+    if filled:
+        cells = await rebuild_location_cells()
+        logging.info(f"Location cells were rebuilt: {cells}")
+    partitions = await ensure_history_partitions()
+    logging.info(f"Database schema is up to date, history partitions: {len(partitions)}")
+
+
+if __name__ == "__main__":
+    async def run() -> None:
+        try:
+            await migrate()
+        finally:
+            await dispose_engine()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run())
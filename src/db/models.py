@@ -1,8 +1,12 @@
-from datetime import datetime
+from datetime import date, datetime
+from typing import Optional
 
-from sqlalchemy import DateTime, Index, Integer
+from sqlalchemy import Date, DateTime, Index, Integer, String
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
+# Побайтовое сравнение строк: поиск по префиксу geohash идет по обычному B-tree индексу
+GEOHASH = String(12).with_variant(String(12, collation="C"), "postgresql")
+
 
 class Base(DeclarativeBase):
     pass
@@ -17,6 +21,8 @@ class Coordinates(Base):
     chat_id: Mapped[int]
     latitude: Mapped[float]
     longitude: Mapped[float]
+    # Заполняется при записи координат, у старых строк — командой python -m db.migrate
+    geohash: Mapped[Optional[str]] = mapped_column(GEOHASH, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
     updated_at: Mapped[datetime] = mapped_column(
         DateTime, default=datetime.now, onupdate=datetime.now
@@ -24,4 +30,56 @@ class Coordinates(Base):
 
     __table_args__ = (
         Index("ix_coordinates_username_chat_id", "username", "chat_id", unique=True),
+        Index("ix_coordinates_chat_id", "chat_id", unique=True),
+        # Чаты ячейки читаются из индекса без обращения к таблице
+        Index("ix_coordinates_geohash_chat_id", "geohash", "chat_id"),
     )
+
+
+class Subscription(Base):
+    __tablename__ = "subscriptions"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    chat_id: Mapped[int]
+    # Минута суток в часовом поясе SUBSCRIPTION_TIMEZONE
+    delivery_minute: Mapped[int]
+    last_delivered_on: Mapped[Optional[date]] = mapped_column(Date, nullable=True)
+    # Время, когда реплика забрала подписку для рассылки; None — не забрана
+    claimed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        Index("ix_subscriptions_chat_id", "chat_id", unique=True),
+        Index("ix_subscriptions_due", "delivery_minute", "last_delivered_on"),
+    )
+
+
+class CoordinatesHistory(Base):
+    """
+    Все присланные пользователями координаты. В Postgres таблица разбита на помесячные
+    партиции по recorded_at, поэтому recorded_at входит в первичный ключ.
+    """
+
+    __tablename__ = "coordinates_history"
+
+    chat_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    recorded_at: Mapped[datetime] = mapped_column(DateTime, primary_key=True, default=datetime.now)
+    latitude: Mapped[float]
+    longitude: Mapped[float]
+
+    __table_args__ = ({"postgresql_partition_by": "RANGE (recorded_at)"},)
+
+
+class LocationCell(Base):
+    """
+    Число чатов в каждой ячейке geohash точности LOCATION_CELL_PRECISION.
+    Обновляется вместе с координатами чатов, чтобы самые населенные ячейки
+    читались по индексу, без группировки всей таблицы coordinates.
+    """
+
+    __tablename__ = "location_cells"
+
+    cell: Mapped[str] = mapped_column(GEOHASH, primary_key=True)
+    chats: Mapped[int] = mapped_column(Integer, default=0)
+
+    __table_args__ = (Index("ix_location_cells_chats", "chats"),)
@@ -0,0 +1,261 @@
+"""
+Запись координат пачками, история координат и ее помесячные партиции.
+"""
+import asyncio
+import logging
+import re
+from datetime import date, datetime, timedelta
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy import Row, delete, func, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from telegram.ext import Application, ContextTypes
+
+from config import (HISTORY_MAINTENANCE_INTERVAL, HISTORY_PARTITIONS_AHEAD,
+                    HISTORY_RETENTION_DAYS)
+from db.database import database_dialect, get_engine, insert_for
+from db.models import Coordinates, CoordinatesHistory
+from db.query.locations import coordinates_geohash, update_location_cells
+
+HISTORY_TABLE = CoordinatesHistory.__tablename__
+PARTITION_NAME = re.compile(rf"^{HISTORY_TABLE}_(\d{{4}})_(\d{{2}})$")
+
+
+class CoordinateUpdate(NamedTuple):
+    username: Optional[str]
+    first_name: Optional[str]
+    chat_id: int
+    latitude: float
+    longitude: float
+    recorded_at: datetime
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def next_month(day: date) -> date:
+    return (month_start(day) + timedelta(days=32)).replace(day=1)
+
+
+def partition_name(month: date) -> str:
+    return f"{HISTORY_TABLE}_{month:%Y_%m}"
+
+
+async def copy_history(connection: AsyncConnection, updates: List[CoordinateUpdate]) -> None:
+    """
+    Записывает строки истории через COPY в текущей транзакции соединения.
+
+    :param connection: Соединение SQLAlchemy с драйвером psycopg
+    :param updates: Обновления координат
+    :return: None
+    """
+    raw = await connection.get_raw_connection()
+    async with raw.driver_connection.cursor() as cursor:
+        async with cursor.copy(
+            f"COPY {HISTORY_TABLE} (chat_id, recorded_at, latitude, longitude) FROM STDIN"
+        ) as copy:
+            for update in updates:
+                await copy.write_row(
+                    (update.chat_id, update.recorded_at, update.latitude, update.longitude)
+                )
+
+
+async def write_coordinates(latest: List[CoordinateUpdate], history: List[CoordinateUpdate]) -> None:
+    """
+    Одной транзакцией обновляет текущие координаты чатов, население ячеек
+    и дописывает историю.
+
+    :param latest: Последнее обновление каждого чата, chat_id не повторяются
+    :param history: Все обновления по порядку поступления
+    :return: None
+    """
+    async with get_engine().begin() as connection:
+        insert = insert_for(database_dialect())
+        if latest:
+            await update_location_cells(connection, latest)
+            statement = insert(Coordinates)
+            statement = statement.on_conflict_do_update(
+                index_elements=[Coordinates.chat_id],
+                set_={
+                    "latitude": statement.excluded.latitude,
+                    "longitude": statement.excluded.longitude,
+                    "geohash": statement.excluded.geohash,
+                    "updated_at": statement.excluded.updated_at,
+                },
+            )
+            await connection.execute(
+                statement,
+                [
+                    {
+                        "username": update.username,
+                        "first_name": update.first_name,
+                        "chat_id": update.chat_id,
+                        "latitude": update.latitude,
+                        "longitude": update.longitude,
+                        "geohash": coordinates_geohash(update.latitude, update.longitude),
+                        "created_at": update.recorded_at,
+                        "updated_at": update.recorded_at,
+                    }
+                    for update in latest
+                ],
+            )
+        if not history:
+            return
+        if database_dialect() == "postgresql":
+            await copy_history(connection, history)
+        else:
+            await connection.execute(
+                insert(CoordinatesHistory),
+                [
+                    {
+                        "chat_id": update.chat_id,
+                        "recorded_at": update.recorded_at,
+                        "latitude": update.latitude,
+                        "longitude": update.longitude,
+                    }
+                    for update in history
+                ],
+            )
+
+
+async def ensure_history_partitions(today: date = None, ahead: int = HISTORY_PARTITIONS_AHEAD) -> List[str]:
+    """
+    Создает партиции истории на текущий и ahead следующих месяцев и партицию по умолчанию.
+
+    :param today: Текущая дата
+    :param ahead: Сколько месяцев вперед подготовить
+    :return: Имена партиций, которые должны существовать
+    """
+    if database_dialect() != "postgresql":
+        return []
+    month = month_start(today or date.today())
+    names = []
+    async with get_engine().begin() as connection:
+        for _ in range(ahead + 1):
+            name = partition_name(month)
+            await connection.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {HISTORY_TABLE} "
+                f"FOR VALUES FROM ('{month}') TO ('{next_month(month)}')"
+            ))
+            names.append(name)
+            month = next_month(month)
+        # Строки вне подготовленных месяцев не должны ломать запись истории
+        await connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {HISTORY_TABLE}_default PARTITION OF {HISTORY_TABLE} DEFAULT"
+        ))
+    return names
+
+
+async def drop_expired_history(today: date = None, retention_days: int = HISTORY_RETENTION_DAYS) -> int:
+    """
+    Удаляет историю старше retention_days. В Postgres целиком удаляются месячные партиции,
+    все строки которых старше срока, поэтому история хранится до месяца дольше срока.
+
+    :param today: Текущая дата
+    :param retention_days: Срок хранения в днях
+    :return: Число удаленных партиций в Postgres или строк в остальных базах
+    """
+    cutoff = (today or date.today()) - timedelta(days=retention_days)
+    async with get_engine().begin() as connection:
+        if database_dialect() != "postgresql":
+            result = await connection.execute(
+                delete(CoordinatesHistory).where(CoordinatesHistory.recorded_at < cutoff)
+            )
+            return result.rowcount
+        result = await connection.execute(text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "WHERE parent.relname = :table"
+        ), {"table": HISTORY_TABLE})
+        dropped = 0
+        for name in result.scalars().all():
+            match = PARTITION_NAME.match(name)
+            if match is None:
+                continue
+            month = date(int(match.group(1)), int(match.group(2)), 1)
+            if next_month(month) <= cutoff:
+                await connection.execute(text(f"DROP TABLE IF EXISTS {name}"))
+                logging.info(f"Coordinates history partition {name} was dropped")
+                dropped += 1
+        return dropped
+
+
+async def get_popular_locations(since: datetime, limit: int, precision: int = 2) -> List[Row]:
+    """
+    Самые частые места из истории координат с округлением до precision знаков
+    (2 знака — около километра). Подходит для выбора координат для предзагрузки.
+
+    :param since: Начало периода
+    :param limit: Максимальное число мест
+    :param precision: Число знаков после запятой при округлении координат
+    :return: Список строк (latitude, longitude, chats, updates)
+    """
+    latitude = func.round(CoordinatesHistory.latitude, precision).label("latitude")
+    longitude = func.round(CoordinatesHistory.longitude, precision).label("longitude")
+    async with get_engine().connect() as connection:
+        result = await connection.execute(
+            select(
+                latitude,
+                longitude,
+                func.count(func.distinct(CoordinatesHistory.chat_id)).label("chats"),
+                func.count().label("updates"),
+            )
+            .where(CoordinatesHistory.recorded_at >= since)
+            .group_by(latitude, longitude)
+            .order_by(func.count(func.distinct(CoordinatesHistory.chat_id)).desc())
+            .limit(limit)
+        )
+        return result.all()
+
+
+class HistoryMaintenance:
+    """
+    Заранее создает партиции истории и удаляет устаревшие.
+    """
+
+    def __init__(self, interval: float = HISTORY_MAINTENANCE_INTERVAL):
+        self.interval = interval
+        self._task: asyncio.Task = None
+
+    async def run_once(self) -> None:
+        try:
+            await ensure_history_partitions()
+            await drop_expired_history()
+        except Exception as e:
+            logging.error(f"Coordinates history maintenance failed: {e}")
+
+    async def job(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        await self.run_once()
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.run_once()
+
+    def start(self, application: Application) -> None:
+        """
+        Запускает обслуживание в JobQueue приложения, а без нее — отдельной задачей.
+
+        :param application: Объект Application
+        :return: None
+        """
+        if application.job_queue is not None:
+            application.job_queue.run_repeating(
+                self.job, interval=self.interval, name="history_maintenance"
+            )
+        elif self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+history_maintenance = HistoryMaintenance()
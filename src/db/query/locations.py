@@ -0,0 +1,166 @@
+"""
+Пространственная группировка чатов по ячейкам geohash.
+
+У каждой строки coordinates хранится geohash координат, поэтому чаты одной
+ячейки любой меньшей точности находятся диапазоном по индексу
+ix_coordinates_geohash_chat_id. Население ячеек точности LOCATION_CELL_PRECISION
+хранится в location_cells и обновляется при записи координат.
+"""
+import logging
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import (Delete, Insert, Select, bindparam, delete, func,
+                        select, tuple_, update)
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from cache.geo import geohash_encode
+from config import (COORDINATES_GEOHASH_PRECISION, GEOHASH_BACKFILL_BATCH,
+                    LOCATION_CELL_PAGE_SIZE, LOCATION_CELL_PRECISION)
+from db.database import database_dialect, get_engine, insert_for
+from db.models import Coordinates, LocationCell
+
+# Больше любого символа алфавита geohash: верхняя граница диапазона префикса
+PREFIX_END = "~"
+
+
+def coordinates_geohash(latitude: float, longitude: float) -> str:
+    return geohash_encode(latitude, longitude, COORDINATES_GEOHASH_PRECISION)
+
+
+def location_cell(latitude: float, longitude: float) -> str:
+    return geohash_encode(latitude, longitude, min(LOCATION_CELL_PRECISION, COORDINATES_GEOHASH_PRECISION))
+
+
+def chats_in_cell_query(cell: str, limit: int = LOCATION_CELL_PAGE_SIZE, after: Tuple[str, int] = None) -> Select:
+    """
+    Страница чатов, координаты которых попадают в ячейку geohash.
+
+    :param cell: Ячейка geohash любой точности не больше COORDINATES_GEOHASH_PRECISION
+    :param limit: Размер страницы
+    :param after: Последняя строка предыдущей страницы (geohash, chat_id)
+    :return: Select строк (geohash, chat_id) по возрастанию
+    """
+    statement = select(Coordinates.geohash, Coordinates.chat_id).where(
+        Coordinates.geohash >= cell, Coordinates.geohash < cell + PREFIX_END
+    )
+    if after is not None:
+        statement = statement.where(tuple_(Coordinates.geohash, Coordinates.chat_id) > tuple_(*after))
+    return statement.order_by(Coordinates.geohash, Coordinates.chat_id).limit(limit)
+
+
+def populated_cells_query(limit: int) -> Select:
+    return (
+        select(LocationCell.cell, LocationCell.chats)
+        .where(LocationCell.chats > 0)
+        .order_by(LocationCell.chats.desc())
+        .limit(limit)
+    )
+
+
+def previous_geohashes_query(chat_ids: Iterable[int]) -> Select:
+    statement = select(Coordinates.chat_id, Coordinates.geohash).where(Coordinates.chat_id.in_(chat_ids))
+    if database_dialect() == "postgresql":
+        # Одновременная запись координат того же чата другой репликой ждет этой транзакции
+        statement = statement.with_for_update()
+    return statement
+
+
+def cell_deltas(previous: Dict[int, Optional[str]], latest: Iterable) -> Dict[str, int]:
+    """
+    Изменение населения ячеек после записи новых координат.
+
+    :param previous: Dict вида {chat_id: geohash до записи}, None — geohash не заполнен
+    :param latest: Обновления координат, chat_id не повторяются
+    :return: Dict вида {ячейка: изменение числа чатов} без нулевых изменений
+    """
+    deltas = Counter()
+    for record in latest:
+        cell = location_cell(record.latitude, record.longitude)
+        old = previous.get(record.chat_id)
+        if old is not None:
+            old_cell = old[:len(cell)]
+            if old_cell == cell:
+                continue
+            deltas[old_cell] -= 1
+        deltas[cell] += 1
+    return {cell: delta for cell, delta in deltas.items() if delta}
+
+
+def cell_deltas_statement(deltas: Dict[str, int]) -> Insert:
+    statement = insert_for(database_dialect())(LocationCell).values(
+        # Одинаковый порядок строк в разных транзакциях исключает взаимные блокировки
+        [{"cell": cell, "chats": deltas[cell]} for cell in sorted(deltas)]
+    )
+    return statement.on_conflict_do_update(
+        index_elements=[LocationCell.cell],
+        set_={"chats": LocationCell.chats + statement.excluded.chats},
+    )
+
+
+def rebuild_statements() -> Tuple[Delete, Insert]:
+    cell = func.substr(Coordinates.geohash, 1, LOCATION_CELL_PRECISION)
+    return delete(LocationCell), insert_for(database_dialect())(LocationCell).from_select(
+        ["cell", "chats"],
+        select(cell, func.count()).where(Coordinates.geohash.is_not(None)).group_by(cell),
+    )
+
+
+async def update_location_cells(connection: AsyncConnection, latest: List) -> Dict[str, int]:
+    """
+    Переносит чаты между ячейками в location_cells. Вызывается в транзакции
+    записи координат до того, как они будут перезаписаны.
+
+    :param connection: Соединение с открытой транзакцией
+    :param latest: Последнее обновление каждого чата
+    :return: Примененные изменения населения ячеек
+    """
+    result = await connection.execute(previous_geohashes_query([record.chat_id for record in latest]))
+    deltas = cell_deltas(dict(result.all()), latest)
+    if deltas:
+        await connection.execute(cell_deltas_statement(deltas))
+    return deltas
+
+
+async def backfill_geohash(batch_size: int = GEOHASH_BACKFILL_BATCH) -> int:
+    """
+    Заполняет geohash у строк, записанных до появления столбца.
+
+    :param batch_size: Число строк в одной транзакции
+    :return: Число заполненных строк
+    """
+    filled = 0
+    while True:
+        async with get_engine().begin() as connection:
+            result = await connection.execute(
+                select(Coordinates.chat_id, Coordinates.latitude, Coordinates.longitude)
+                .where(Coordinates.geohash.is_(None))
+                .limit(batch_size)
+            )
+            rows = result.all()
+            if not rows:
+                return filled
+            await connection.execute(
+                update(Coordinates)
+                .where(Coordinates.chat_id == bindparam("key"))
+                .values(geohash=bindparam("value")),
+                [
+                    {"key": chat_id, "value": coordinates_geohash(latitude, longitude)}
+                    for chat_id, latitude, longitude in rows
+                ],
+            )
+        filled += len(rows)
+        logging.info(f"Geohash was filled for {filled} coordinates")
+
+
+async def rebuild_location_cells() -> int:
+    """
+    Пересчитывает население ячеек по таблице coordinates одной транзакцией.
+
+    :return: Число непустых ячеек
+    """
+    async with get_engine().begin() as connection:
+        for statement in rebuild_statements():
+            await connection.execute(statement)
+        result = await connection.execute(select(func.count()).select_from(LocationCell))
+        return result.scalar_one()
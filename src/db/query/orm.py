@@ -1,42 +1,74 @@
-from datetime import datetime
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
 
-from psycopg import OperationalError
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import (Connection, Row, delete, func, inspect, or_, select,
+                        text, update)
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
 
-from db.database import engine, session_factory
-from db.models import Base, Coordinates
+from cache.coordinates_cache import (get_cached_coordinates,
+                                     set_cached_coordinates)
+from db.database import (create_session, database_dialect, get_engine,
+                         insert_for)
+from db.models import Base, Coordinates, Subscription
+from db.query.history import CoordinateUpdate, write_coordinates
+from db.query.locations import chats_in_cell_query, populated_cells_query
+from db.write_buffer import coordinates_buffer
 from exceptions import DatabaseConnectionError, DatabaseError
+from metrics.registry import DB_LATENCY
 
 
-def create_data_base_and_tables():
-    Base.metadata.create_all(engine)
+def add_missing_columns(connection: Connection) -> None:
+    """
+    Добавляет в существующие таблицы новые столбцы, допускающие NULL.
 
+    :param connection: Синхронное соединение внутри run_sync
+    :return: None
+    """
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing and column.nullable:
+                column_type = column.type.compile(dialect=connection.dialect)
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
 
-def update_coordinates(
+
+async def create_data_base_and_tables() -> None:
+    async with get_engine().begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+        # create_all не добавляет столбцы в уже существующие таблицы
+        await connection.run_sync(add_missing_columns)
+        # create_all не добавляет индексы в уже существующие таблицы
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                await connection.run_sync(index.create, checkfirst=True)
+
+
+async def update_coordinates(
     username: str, first_name: str, chat_id: int, latitude: float, longitude: float
 ) -> None:
+    """
+    Сохраняет координаты чата и добавляет их в историю. Если запущен буфер записи,
+    координаты попадут в базу при следующем сбросе буфера.
+
+    :param username: Имя пользователя Telegram
+    :param first_name: Имя
+    :param chat_id: ID чата Telegram
+    :param latitude: широта
+    :param longitude: долгота
+    :return: None
+    """
+    record = CoordinateUpdate(username, first_name, chat_id, latitude, longitude, datetime.now())
+    if coordinates_buffer.running:
+        await coordinates_buffer.add(record)
+        return
 
     try:
-        with session_factory() as session:
-            coordinates = (
-                session.query(Coordinates)
-                .filter(Coordinates.chat_id == chat_id)
-                .first()
-            )
-            if coordinates:
-                coordinates.latitude = latitude
-                coordinates.longitude = longitude
-                coordinates.updated_at = datetime.now()
-            else:
-                coordinates = Coordinates(
-                    username=username,
-                    first_name=first_name,
-                    chat_id=chat_id,
-                    latitude=latitude,
-                    longitude=longitude,
-                )
-                session.add(coordinates)
-            session.commit()
+        with DB_LATENCY.time("update_coordinates"):
+            await write_coordinates([record], [record])
+        await set_cached_coordinates(chat_id, latitude, longitude, publish=True)
 
     except OperationalError as e:
         raise DatabaseConnectionError(f"Database connection error: {e}") from e
@@ -46,18 +78,208 @@ def update_coordinates(
         raise DatabaseError(f"Unexpected error: {e}") from e
 
 
-def get_coordinates(chat_id: int) -> tuple:
+async def get_coordinates(chat_id: int) -> tuple:
+    coordinates = coordinates_buffer.get(chat_id)
+    if coordinates is not None:
+        return coordinates
+    coordinates = await get_cached_coordinates(chat_id)
+    if coordinates is not None:
+        return coordinates
     try:
-        with session_factory() as session:
-            coordinates = (
-                session.query(Coordinates)
-                .filter(Coordinates.chat_id == chat_id)
-                .first()
-            )
+        async with create_session() as session:
+            with DB_LATENCY.time("get_coordinates"):
+                result = await session.execute(
+                    select(Coordinates.latitude, Coordinates.longitude).where(
+                        Coordinates.chat_id == chat_id
+                    )
+                )
+                coordinates = result.first()
             if coordinates:
+                await set_cached_coordinates(
+                    chat_id, coordinates.latitude, coordinates.longitude
+                )
                 return coordinates.latitude, coordinates.longitude
             return None, None
     except OperationalError as e:
         raise DatabaseConnectionError(f"Database connection error: {e}") from e
     except Exception as e:
         raise DatabaseError(f"Unexpected error: {e}") from e
+
+
+async def subscribe(chat_id: int, delivery_minute: int, delivered_on: Optional[date] = None) -> None:
+    """
+    Подписывает чат на ежедневный прогноз или меняет время рассылки.
+
+    :param chat_id: ID чата Telegram
+    :param delivery_minute: Минута суток, в которую отправляется прогноз
+    :param delivered_on: Дата, за которую прогноз уже не нужно отправлять
+    :return: None
+    """
+    try:
+        async with create_session() as session:
+            insert = insert_for(database_dialect())
+            statement = insert(Subscription).values(
+                chat_id=chat_id,
+                delivery_minute=delivery_minute,
+                last_delivered_on=delivered_on,
+            )
+            statement = statement.on_conflict_do_update(
+                index_elements=[Subscription.chat_id],
+                set_={
+                    "delivery_minute": statement.excluded.delivery_minute,
+                    # Смена времени не приводит к повторной рассылке за сегодня
+                    "last_delivered_on": func.coalesce(
+                        statement.excluded.last_delivered_on,
+                        Subscription.last_delivered_on,
+                    ),
+                },
+            )
+            await session.execute(statement)
+            await session.commit()
+    except OperationalError as e:
+        raise DatabaseConnectionError(f"Database connection error: {e}") from e
+    except SQLAlchemyError as e:
+        raise DatabaseError(f"Database error: {e}") from e
+
+
+async def unsubscribe(chat_id: int) -> bool:
+    """
+    Отменяет подписку чата.
+
+    :param chat_id: ID чата Telegram
+    :return: True, если подписка была
+    """
+    try:
+        async with create_session() as session:
+            result = await session.execute(
+                delete(Subscription).where(Subscription.chat_id == chat_id)
+            )
+            await session.commit()
+            return bool(result.rowcount)
+    except OperationalError as e:
+        raise DatabaseConnectionError(f"Database connection error: {e}") from e
+    except SQLAlchemyError as e:
+        raise DatabaseError(f"Database error: {e}") from e
+
+
+async def claim_due_subscribers(minute: int, today: date, limit: int, lease: float) -> List[Row]:
+    """
+    Забирает до limit подписчиков, которым пора отправить прогноз за today.
+
+    Подписки отмечаются забранными на lease секунд, поэтому несколько реплик
+    не получат один и тот же чат. Отправленными их отмечает mark_delivered;
+    если прогноз не был отправлен, подписка забирается снова после окончания
+    lease. Поиск идет по индексу ix_subscriptions_due, чаты без сохраненных
+    координат пропускаются.
+
+    :param minute: Текущая минута суток
+    :param today: Текущая дата
+    :param limit: Максимальное число подписчиков за вызов
+    :param lease: Срок, на который подписка забирается, в секундах
+    :return: Список строк (chat_id, latitude, longitude)
+    """
+    now = datetime.now()
+    # Порядок по geohash собирает подписчиков одной ячейки в одну пачку
+    due = (
+        select(Subscription.id)
+        .join(Coordinates, Coordinates.chat_id == Subscription.chat_id)
+        .where(
+            Subscription.delivery_minute <= minute,
+            or_(
+                Subscription.last_delivered_on.is_(None),
+                Subscription.last_delivered_on < today,
+            ),
+            or_(
+                Subscription.claimed_at.is_(None),
+                Subscription.claimed_at < now - timedelta(seconds=lease),
+            ),
+        )
+        .order_by(Coordinates.geohash)
+        .limit(limit)
+    )
+    if database_dialect() == "postgresql":
+        due = due.with_for_update(skip_locked=True, of=Subscription)
+    try:
+        async with create_session() as session:
+            claimed = await session.execute(
+                update(Subscription)
+                .where(Subscription.id.in_(due.scalar_subquery()))
+                .values(claimed_at=now)
+                .returning(Subscription.chat_id)
+            )
+            chat_ids = claimed.scalars().all()
+            if not chat_ids:
+                await session.commit()
+                return []
+            result = await session.execute(
+                select(Coordinates.chat_id, Coordinates.latitude, Coordinates.longitude).where(
+                    Coordinates.chat_id.in_(chat_ids)
+                )
+            )
+            subscribers = result.all()
+            await session.commit()
+            return subscribers
+    except OperationalError as e:
+        raise DatabaseConnectionError(f"Database connection error: {e}") from e
+    except SQLAlchemyError as e:
+        raise DatabaseError(f"Database error: {e}") from e
+
+
+async def mark_delivered(chat_ids: List[int], today: date) -> None:
+    """
+    Отмечает, что прогноз за today отправлен, и снимает отметку о том, что подписка забрана.
+
+    :param chat_ids: ID чатов, получивших прогноз
+    :param today: Дата рассылки
+    :return: None
+    """
+    try:
+        async with create_session() as session:
+            await session.execute(
+                update(Subscription)
+                .where(Subscription.chat_id.in_(chat_ids))
+                .values(last_delivered_on=today, claimed_at=None)
+            )
+            await session.commit()
+    except OperationalError as e:
+        raise DatabaseConnectionError(f"Database connection error: {e}") from e
+    except SQLAlchemyError as e:
+        raise DatabaseError(f"Database error: {e}") from e
+
+
+async def get_chats_in_cell(cell: str, after: Tuple[str, int] = None) -> List[Row]:
+    """
+    Страница чатов, координаты которых попадают в ячейку geohash. Чтение идет
+    по индексу ix_coordinates_geohash_chat_id и не зависит от размера таблицы.
+
+    :param cell: Ячейка geohash, например Bucket.cell для схемы geohash
+    :param after: Последняя строка предыдущей страницы
+    :return: Список строк (geohash, chat_id), пустой после последней страницы
+    """
+    try:
+        async with get_engine().connect() as connection:
+            with DB_LATENCY.time("get_chats_in_cell"):
+                result = await connection.execute(chats_in_cell_query(cell, after=after))
+                return result.all()
+    except OperationalError as e:
+        raise DatabaseConnectionError(f"Database connection error: {e}") from e
+    except SQLAlchemyError as e:
+        raise DatabaseError(f"Database error: {e}") from e
+
+
+async def get_populated_cells(limit: int) -> List[Row]:
+    """
+    Самые населенные ячейки точности LOCATION_CELL_PRECISION.
+
+    :param limit: Максимальное число ячеек
+    :return: Список строк (cell, chats) по убыванию числа чатов
+    """
+    try:
+        async with get_engine().connect() as connection:
+            with DB_LATENCY.time("get_populated_cells"):
+                result = await connection.execute(populated_cells_query(limit))
+                return result.all()
+    except OperationalError as e:
+        raise DatabaseConnectionError(f"Database connection error: {e}") from e
+    except SQLAlchemyError as e:
+        raise DatabaseError(f"Database error: {e}") from e
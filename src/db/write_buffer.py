@@ -0,0 +1,304 @@
+"""
+Буфер записи координат: обновления копятся в памяти и записываются в базу пачками.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy.exc import DataError, IntegrityError
+
+from cache.coordinates_cache import set_cached_coordinates
+from config import (COORDINATES_BUFFER_MAX_PENDING,
+                    COORDINATES_FLUSH_BACKOFF_MAX,
+                    COORDINATES_FLUSH_INTERVAL_MS, COORDINATES_FLUSH_ROWS)
+from db.query.history import CoordinateUpdate, write_coordinates
+from metrics.registry import DB_LATENCY
+
+
+def is_data_error(error: Exception) -> bool:
+    """
+    Ошибка из-за самих строк: повтор той же пачки снова завершится ею.
+    Остальные ошибки, например недоступность базы, считаются временными.
+    """
+    return isinstance(error, (DataError, IntegrityError))
+
+
+class CoordinatesWriteBuffer:
+    """
+    Копит обновления координат и сбрасывает их одной транзакцией каждые flush_interval
+    секунд или при flush_rows накопленных обновлениях.
+
+    Пока обновление не записано, последние координаты чата отдаются из буфера,
+    поэтому следующий запрос прогноза их не потеряет даже при вытеснении из кэша.
+
+    :param flush_rows: Размер пачки, при котором сброс начинается сразу
+    :param flush_interval: Максимальная задержка записи в секундах
+    :param max_pending: Сколько строк истории держать, пока база недоступна
+    :param backoff_max: Максимальная пауза между повторами сброса, пока база недоступна
+    """
+
+    def __init__(
+        self,
+        flush_rows: int = COORDINATES_FLUSH_ROWS,
+        flush_interval: float = COORDINATES_FLUSH_INTERVAL_MS / 1000,
+        max_pending: int = COORDINATES_BUFFER_MAX_PENDING,
+        backoff_max: float = COORDINATES_FLUSH_BACKOFF_MAX,
+    ):
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.backoff_max = backoff_max
+        self.updates: List[CoordinateUpdate] = []
+        # Последнее еще не записанное обновление каждого чата
+        self.latest: Dict[int, CoordinateUpdate] = {}
+        # Координаты, которые база отклонила: отдаются из буфера, но не записываются,
+        # пока чат не пришлет новые
+        self.held: Dict[int, CoordinateUpdate] = {}
+        self.metrics = Counter()
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        self._failures = 0
+        self._retry_at = 0.0
+        self._task: asyncio.Task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def get(self, chat_id: int) -> Optional[Tuple[float, float]]:
+        update = self.latest.get(chat_id)
+        if update is None:
+            return None
+        return update.latitude, update.longitude
+
+    async def add(self, update: CoordinateUpdate) -> None:
+        """
+        Принимает обновление координат. В базу оно попадет при следующем сбросе.
+
+        :param update: Обновление координат
+        :return: None
+        """
+        self.updates.append(update)
+        self.latest[update.chat_id] = update
+        self.held.pop(update.chat_id, None)
+        self.metrics["added"] += 1
+        if len(self.updates) > self.max_pending:
+            # База недоступна слишком долго: теряем самые старые строки истории,
+            # последние координаты каждого чата остаются в latest
+            overflow = len(self.updates) - self.max_pending
+            del self.updates[:overflow]
+            self.metrics["dropped"] += overflow
+        if len(self.updates) >= self.flush_rows:
+            self._wakeup.set()
+        await set_cached_coordinates(update.chat_id, update.latitude, update.longitude, publish=True)
+
+    async def _write(self, latest: List[CoordinateUpdate], history: List[CoordinateUpdate]) -> None:
+        with DB_LATENCY.time("flush_coordinates"):
+            await write_coordinates(latest, history)
+
+    async def _write_split(
+        self,
+        chats: List[int],
+        latest: Dict[int, CoordinateUpdate],
+        history: Dict[int, List[CoordinateUpdate]],
+        written: Set[int],
+        rejected: Set[int],
+    ) -> None:
+        """
+        Записывает строки чатов, деля их пополам при ошибке в данных. Строки истории
+        чата, которые не записываются и по одному, отбрасываются, а его последние
+        координаты записываются отдельно.
+
+        :param chats: ID чатов пачки
+        :param latest: Последнее обновление каждого чата
+        :param history: Строки истории каждого чата
+        :param written: Сюда добавляются чаты, координаты которых записаны
+        :param rejected: Сюда добавляются чаты, история которых отброшена
+        :return: None
+        :raise Exception: Если ошибка не в данных: запись прерывается
+        """
+        try:
+            await self._write(
+                [latest[chat_id] for chat_id in chats if chat_id in latest],
+                [update for chat_id in chats if chat_id not in rejected for update in history[chat_id]],
+            )
+        except Exception as e:
+            if not is_data_error(e):
+                raise
+            if len(chats) > 1:
+                middle = len(chats) // 2
+                await self._write_split(chats[:middle], latest, history, written, rejected)
+                await self._write_split(chats[middle:], latest, history, written, rejected)
+                return
+            chat_id = chats[0]
+            if chat_id in rejected:
+                # Не записываются сами последние координаты: держим их в буфере
+                self.held[chat_id] = latest[chat_id]
+                self.metrics["held"] += 1
+                logging.error(f"Coordinates of chat_id: {chat_id} were rejected by the database: {e}")
+                return
+            rejected.add(chat_id)
+            self.metrics["poisoned"] += len(history[chat_id])
+            logging.error(f"History of chat_id: {chat_id} was dropped after a failed write: {e}")
+            if chat_id in latest:
+                await self._write_split(chats, latest, history, written, rejected)
+            return
+        written.update(chats)
+
+    async def flush(self) -> int:
+        """
+        Записывает накопленные обновления. Если база недоступна, они остаются в буфере,
+        а следующий сброс откладывается. Если база отклоняет строки, пачка делится,
+        пока не найдутся строки истории, которые не записываются.
+
+        :return: Число записанных строк истории
+        """
+        async with self._lock:
+            latest = {chat_id: update for chat_id, update in self.latest.items() if self.held.get(chat_id) is not update}
+            if not self.updates and not latest:
+                return 0
+            updates, self.updates = self.updates, []
+            written, rejected = set(), set()
+            try:
+                try:
+                    await self._write(list(latest.values()), updates)
+                    written.update(latest)
+                    written.update(update.chat_id for update in updates)
+                except Exception as e:
+                    if not is_data_error(e):
+                        raise
+                    logging.warning(f"Coordinates flush of {len(updates)} rows was rejected, splitting: {e}")
+                    history = {chat_id: [] for chat_id in latest}
+                    for update in updates:
+                        history.setdefault(update.chat_id, []).append(update)
+                    await self._write_split(list(history), latest, history, written, rejected)
+            except Exception as e:
+                remaining = [
+                    update for update in updates if update.chat_id not in written and update.chat_id not in rejected
+                ]
+                self.updates[:0] = remaining[-self.max_pending:]
+                self._failures += 1
+                delay = min(self.backoff_max, self.flush_interval * 2 ** self._failures)
+                self._retry_at = time.monotonic() + delay
+                self.metrics["flush_errors"] += 1
+                logging.error(f"Coordinates flush of {len(remaining)} rows failed, retry in {delay:.1f} s: {e}")
+            else:
+                self._failures = 0
+                self._retry_at = 0.0
+                self.metrics["flushes"] += 1
+            for chat_id in written:
+                # Чат мог прислать новые координаты, пока шла запись
+                if chat_id in latest and self.latest.get(chat_id) is latest[chat_id]:
+                    del self.latest[chat_id]
+            rows = sum(1 for update in updates if update.chat_id in written and update.chat_id not in rejected)
+            self.metrics["rows"] += rows
+            return rows
+
+    async def _loop(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if time.monotonic() < self._retry_at:
+                continue
+            await self.flush()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._loop())
+            logging.info("Coordinates write buffer was started")
+
+    async def stop(self) -> None:
+        """
+        Останавливает фоновый сброс и записывает оставшиеся обновления.
+
+        :return: None
+        """
+        if self._task is not None:
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            **self.metrics,
+            "pending": len(self.updates),
+            "pending_chats": len(self.latest),
+            "held_chats": len(self.held),
+        }
+
+
+coordinates_buffer = CoordinatesWriteBuffer()
+
+
+if __name__ == "__main__":
+    import random
+    import time
+    from datetime import datetime
+
+    from sqlalchemy import delete
+
+    from db.database import dispose_engine, get_engine
+    from db.models import Coordinates, CoordinatesHistory
+    from db.query.history import ensure_history_partitions
+    from db.query.orm import create_data_base_and_tables, update_coordinates
+
+    # Бенчмарку нужна база из DATABASE_URL или PG*; чаты берутся вне диапазона реальных ID
+    UPDATES = 5000
+    CHATS = 1000
+    CONCURRENCY = 50
+    FIRST_CHAT_ID = 2_000_000_000
+
+    def make_updates() -> List[CoordinateUpdate]:
+        rng = random.Random(1)
+        return [
+            CoordinateUpdate(
+                "bench", "Bench", FIRST_CHAT_ID + rng.randrange(CHATS),
+                55.75 + rng.uniform(-0.2, 0.2), 37.62 + rng.uniform(-0.2, 0.2), datetime.now(),
+            )
+            for _ in range(UPDATES)
+        ]
+
+    async def cleanup() -> None:
+        async with get_engine().begin() as connection:
+            for model in (Coordinates, CoordinatesHistory):
+                await connection.execute(delete(model).where(model.chat_id >= FIRST_CHAT_ID))
+
+    async def measure(name: str, write, finish=None) -> None:
+        await cleanup()
+        semaphore = asyncio.Semaphore(CONCURRENCY)
+
+        async def send(update: CoordinateUpdate) -> None:
+            async with semaphore:
+                await write(update)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(send(update) for update in make_updates()))
+        if finish is not None:
+            await finish()
+        elapsed = time.perf_counter() - started
+        print(f"{name}: {UPDATES / elapsed:.0f} rows/sec ({elapsed:.2f} s for {UPDATES} updates)")
+
+    async def direct(update: CoordinateUpdate) -> None:
+        await update_coordinates(*update[:5])
+
+    async def run() -> None:
+        await create_data_base_and_tables()
+        await ensure_history_partitions()
+        await measure("commit per message", direct)
+        buffer.start()
+        await measure("buffered", buffer.add, buffer.stop)
+        print(f"buffer: {buffer.stats()}")
+        await cleanup()
+        await dispose_engine()
+
+    buffer = CoordinatesWriteBuffer()
+    asyncio.run(run())
@@ -20,3 +20,15 @@ class DatabaseConnectionError(DatabaseError):
 
 class DuplicateRecordError(DatabaseError):
     pass
+
+
+class UnsupportedCacheFormat(Exception):
+    pass
+
+
+class CircuitOpen(ConnectionFailed):
+    pass
+
+
+class RateLimited(ConnectionFailed):
+    pass
@@ -0,0 +1,110 @@
+"""
+Проверки зависимостей и состояние готовности реплики.
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+from cache.redis_cache import get_redis_client
+from config import (HEALTH_CHECK_CACHE_SECONDS, HEALTH_CHECK_TIMEOUT,
+                    READINESS_REQUIRED)
+from db.database import get_engine
+
+
+class CheckResult(NamedTuple):
+    ok: bool
+    seconds: float
+    error: Optional[str] = None
+
+
+async def check_postgres() -> None:
+    async with get_engine().connect() as connection:
+        await connection.execute(text("SELECT 1"))
+
+
+async def check_redis() -> None:
+    await get_redis_client().ping()
+
+
+CHECKS: Dict[str, Callable[[], Awaitable[None]]] = {
+    "postgres": check_postgres,
+    "redis": check_redis,
+}
+
+
+async def run_check(check: Callable[[], Awaitable[None]], timeout: float) -> CheckResult:
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(check(), timeout)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+        return CheckResult(False, time.perf_counter() - started, error)
+    return CheckResult(True, time.perf_counter() - started)
+
+
+async def run_checks(timeout: float = HEALTH_CHECK_TIMEOUT) -> Dict[str, CheckResult]:
+    """
+    Проверяет все зависимости одновременно: общее время равно самой долгой проверке.
+
+    :param timeout: Предельное время одной проверки в секундах
+    :return: Dict вида {зависимость: CheckResult}
+    """
+    results = await asyncio.gather(*(run_check(check, timeout) for check in CHECKS.values()))
+    return dict(zip(CHECKS, results))
+
+
+class Readiness:
+    """
+    Готовность реплики: этапы запуска завершены и обязательные зависимости доступны.
+
+    Результат проверок переиспользуется cache_for секунд, чтобы частые запросы
+    оркестратора не нагружали базу и Redis.
+
+    :param required: Зависимости, без которых реплика не готова
+    :param cache_for: Время жизни результата проверок в секундах
+    """
+
+    def __init__(self, required: Tuple[str, ...] = READINESS_REQUIRED, cache_for: float = HEALTH_CHECK_CACHE_SECONDS):
+        self.required = required
+        self.cache_for = cache_for
+        self.pending: Set[str] = set()
+        self.results: Dict[str, CheckResult] = {}
+        self.checked_at: float = None
+        self._lock = asyncio.Lock()
+
+    def begin(self, step: str) -> None:
+        self.pending.add(step)
+
+    def done(self, step: str) -> None:
+        self.pending.discard(step)
+
+    async def check(self, force: bool = False) -> Dict[str, CheckResult]:
+        async with self._lock:
+            if force or self.checked_at is None or time.monotonic() - self.checked_at >= self.cache_for:
+                self.results = await run_checks()
+                self.checked_at = time.monotonic()
+            return self.results
+
+    async def probe(self) -> Tuple[bool, dict]:
+        """
+        Проверяет готовность реплики.
+
+        :return: Кортеж: признак готовности и подробности для ответа /health/ready
+        """
+        results = await self.check()
+        ready = not self.pending and all(
+            name in results and results[name].ok for name in self.required
+        )
+        return ready, {
+            "ready": ready,
+            "pending": sorted(self.pending),
+            "checks": {
+                name: {"ok": result.ok, "ms": round(result.seconds * 1000, 1), "error": result.error}
+                for name, result in results.items()
+            },
+        }
+
+
+readiness = Readiness()
@@ -0,0 +1,48 @@
+import logging
+
+from aiohttp import web
+
+from config import HEALTH_ENABLED, HEALTH_HOST, HEALTH_PORT
+from health.checks import readiness
+
+runner: web.AppRunner = None
+
+
+async def handle_live(request: web.Request) -> web.Response:
+    return web.json_response({"alive": True})
+
+
+async def handle_ready(request: web.Request) -> web.Response:
+    ready, details = await readiness.probe()
+    return web.json_response(details, status=200 if ready else 503)
+
+
+def create_health_app() -> web.Application:
+    app = web.Application()
+    app.router.add_get("/health/live", handle_live)
+    app.router.add_get("/health/ready", handle_ready)
+    return app
+
+
+async def start_health_server(host: str = HEALTH_HOST, port: int = HEALTH_PORT) -> None:
+    """
+    Запускает HTTP-сервер с проверками /health/live и /health/ready, если они включены.
+
+    :param host: Адрес HTTP-сервера
+    :param port: Порт HTTP-сервера
+    :return: None
+    """
+    global runner
+    if not HEALTH_ENABLED or runner is not None:
+        return
+    runner = web.AppRunner(create_health_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Health checks are served on {host}:{port}/health")
+
+
+async def stop_health_server() -> None:
+    global runner
+    if runner is not None:
+        await runner.cleanup()
+        runner = None
@@ -0,0 +1,193 @@
+"""
+Логирование через очередь: вызывающий код только кладет запись в очередь,
+форматирование и запись в stdout выполняет поток QueueListener.
+"""
+import atexit
+import json
+import logging
+import random
+import sys
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+
+from config import (LOG_FORMAT, LOG_INFO_SAMPLE_RATE, LOG_LEVEL, LOG_QUEUE,
+                    LOG_TEXT_FORMAT)
+
+log_context: ContextVar[dict] = ContextVar("log_context", default={})
+
+listener: QueueListener = None
+
+# Поля LogRecord, которые не попадают в JSON как дополнительные
+RECORD_FIELDS = frozenset(
+    vars(logging.LogRecord("", 0, "", 0, "", None, None)).keys() | {"message", "asctime", "context"}
+)
+
+
+def bind(**fields) -> None:
+    """
+    Добавляет поля корреляции ко всем следующим записям лога текущего обновления.
+
+    :param fields: Поля, например chat_id, command, cache
+    :return: None
+    """
+    log_context.set({**log_context.get(), **fields})
+
+
+class ContextQueueHandler(QueueHandler):
+    """
+    Кладет в очередь саму запись: сообщение форматируется уже в потоке QueueListener.
+    Поля корреляции копируются в запись здесь, пока доступен контекст обновления.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.context = log_context.get()
+        if record.exc_info and not record.exc_text:
+            # traceback не переживет выход из обработчика исключения в вызывающем коде
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class ContextFilter(logging.Filter):
+    """
+    Добавляет поля корреляции к записи при синхронной записи лога.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "context"):
+            record.context = log_context.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает долю rate записей уровня INFO и ниже. Предупреждения и ошибки пишутся всегда.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.INFO or self.rate >= 1 or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Одна запись — одна строка JSON с полями корреляции.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "context", {}))
+        entry.update(
+            (key, value) for key, value in vars(record).items() if key not in RECORD_FIELDS
+        )
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """
+    Прежний текстовый формат, дополненный полями корреляции.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+        context = getattr(record, "context", None)
+        if context:
+            message += " - " + " ".join(f"{key}={value}" for key, value in context.items())
+        return message
+
+
+def setup_logging(
+    level: str = LOG_LEVEL,
+    log_format: str = LOG_FORMAT,
+    use_queue: bool = LOG_QUEUE,
+    sample_rate: float = LOG_INFO_SAMPLE_RATE,
+    stream=None,
+) -> QueueListener:
+    """
+    Настраивает корневой логгер.
+
+    :param level: Уровень логирования
+    :param log_format: json или text
+    :param use_queue: Писать лог из отдельного потока через очередь
+    :param sample_rate: Доля записей INFO, которые попадают в лог
+    :param stream: Поток вывода, по умолчанию stdout
+    :return: Запущенный QueueListener или None
+    """
+    global listener
+    stop_logging()
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter(LOG_TEXT_FORMAT))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.setLevel(level)
+
+    if use_queue:
+        handler = ContextQueueHandler(SimpleQueue())
+        listener = QueueListener(handler.queue, output, respect_handler_level=True)
+        listener.start()
+    else:
+        handler = output
+        handler.addFilter(ContextFilter())
+    handler.addFilter(SamplingFilter(sample_rate))
+    root.addHandler(handler)
+    return listener
+
+
+@atexit.register
+def stop_logging() -> None:
+    """
+    Дописывает записи из очереди и останавливает поток QueueListener.
+
+    :return: None
+    """
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+if __name__ == "__main__":
+    import io
+    import time
+
+    RECORDS = 5000
+
+    class SlowStream(io.StringIO):
+        """
+        stdout, который иногда блокируется: так ведет себя pipe в docker под нагрузкой.
+        """
+
+        def write(self, text: str) -> int:
+            time.sleep(0.0001)
+            return super().write(text)
+
+    def measure(use_queue: bool, log_format: str) -> float:
+        setup_logging("INFO", log_format, use_queue, 1.0, SlowStream())
+        bind(chat_id=1, command="/weather_today", cache="fresh")
+        started = time.perf_counter()
+        for index in range(RECORDS):
+            logging.info("Forecast was sent to chat_id: %s", index)
+        elapsed = time.perf_counter() - started
+        stop_logging()
+        return elapsed / RECORDS * 1e6
+
+    for log_format in ("text", "json"):
+        print(
+            f"{log_format}: sync {measure(False, log_format):.1f} us/record, "
+            f"queue {measure(True, log_format):.1f} us/record in caller"
+        )
@@ -1,25 +1,86 @@
+import asyncio
 import http
 import logging
-import sys
-from json.decoder import JSONDecodeError
-from typing import List
+import time
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Tuple, Union
 
 import aiohttp
 from telegram import Update
-from telegram.ext import (ApplicationBuilder, CommandHandler, ContextTypes,
-                          MessageHandler, filters)
+from telegram.ext import (Application, ApplicationBuilder, CommandHandler,
+                          ContextTypes, MessageHandler, filters)
 
 import exceptions
-from cache.redis_cache import get_cached_forecast, set_cached_forecast
-from config import (CURRENT_ENDPOINT, DATE, DESCRIPTION, ELEMENT,
-                    FORCAST_ENDPOINT, HEADERS, HUMIDITY, OFFSET, OFFSET_DATE,
-                    OFFSET_TIME, ONE_DAY, PRESSURE, TELEGRAM_TOKEN,
-                    TEMPERATURE, TOMORROW, TWO_DAYS, WIND_DIRECTION,
-                    WIND_ORIENTATION, WIND_SPEED)
-from db.query.orm import (create_data_base_and_tables, get_coordinates,
-                          update_coordinates)
+from api.http_client import (close_http_session, get_http_session,
+                             start_http_session)
+from api.parser import ForecastRecord, parse_forecast, read_response
+from api.resilience import breaker, rate_limiter
+from api.views import KIND as UNIFIED_KIND
+from api.views import is_outdated, select_view
+from bot.dispatch import ChatOrderedUpdateProcessor
+from bot.subscriptions import (delivery_engine, minute_of_day,
+                               parse_delivery_time)
+from bot.subscriptions import timezone as subscription_timezone
+from bot.webhook import run_webhook
+from cache.coordinates_cache import (start_invalidation_listener,
+                                     stop_invalidation_listener)
+from cache.geo import geohash_centroid, quantize
+from cache.memory_cache import MemoryCache
+from cache.prefetch import PrefetchRequest, prefetcher
+from cache.redis_cache import (close_redis_clients, get_cached_forecast,
+                               get_stale_forecast, get_ttl, make_key,
+                               restore_cached_forecasts, set_cached_forecast)
+from cache.single_flight import distributed_lock, single_flight
+from cache.snapshot import forecast_snapshot
+from config import (BOT_MODE, COORDINATES_BUFFER_ENABLED, CURRENT_ENDPOINT,
+                    DB_SCHEMA_ON_STARTUP, FORCAST_ENDPOINT, FORECAST_SOURCE,
+                    HEADERS, L1_CACHE_MAX_ENTRIES, OFFSET, ONE_DAY,
+                    PREFETCH_ENABLED, PREFETCH_WARM_CELLS, STREAMING_PARSER,
+                    TELEGRAM_TOKEN, TOMORROW, TWO_DAYS, UNIFIED_FORECAST_DAYS,
+                    missing_settings)
+from db.database import dispose_engine
+from db.migrate import migrate
+from db.query.history import history_maintenance
+from db.query.orm import (get_coordinates, get_populated_cells, subscribe,
+                          unsubscribe, update_coordinates)
+from db.write_buffer import coordinates_buffer
+from health.checks import readiness
+from health.server import start_health_server, stop_health_server
+from logs.pipeline import bind, setup_logging
+from metrics.registry import (GISMETEO_LATENCY, IN_FLIGHT, PARSE_LATENCY,
+                              RENDER_LATENCY, observe_handler)
+from metrics.server import start_metrics_server, stop_metrics_server
+from render.renderer import render_forecast
+
+# Отдельные эндпоинты для каждой команды: режим endpoints и запасной вариант для unified
+FORECAST_ENDPOINTS = {
+    "now": (CURRENT_ENDPOINT, None),
+    "today": (FORCAST_ENDPOINT, ONE_DAY),
+    "tomorrow": (FORCAST_ENDPOINT + TOMORROW, TWO_DAYS),
+}
+
+startup_task: asyncio.Task = None
+# Чаты, для которых в едином прогнозе нет нужного среза: пока прогноз свежий,
+# сразу используется отдельный эндпоинт
+missing_views = MemoryCache(L1_CACHE_MAX_ENTRIES, L1_CACHE_MAX_ENTRIES)
+
+
+class Upstream(NamedTuple):
+    """
+    Итог запроса к API Gismeteo для полей лога обновления.
+    """
+
+    status: str
+    ms: float
+
+
+STALE_NOTICE = (
+    "Сервис прогноза погоды временно недоступен. "
+    "Показываем последний полученный прогноз, он может быть устаревшим."
+)
 
 
+@observe_handler("unknown")
 async def special_cases(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Обрабатывает непредусмотренные команды от пользователя.
@@ -30,9 +91,8 @@ async def special_cases(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     chat_id = update.effective_chat.id
     logging.info(
-        f"User with username: {update.effective_user.username} "
-        f"and chat_id: {chat_id} "
-        f"sends unknown command: {update.effective_message.text}"
+        "User with username: %s and chat_id: %s sends unknown command: %s",
+        update.effective_user.username, chat_id, update.effective_message.text,
     )
     await context.bot.send_message(
         chat_id=chat_id,
@@ -40,6 +100,7 @@ async def special_cases(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+@observe_handler("start")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Обработчик команды /start, отправляющий приветственное сообщение пользователю.
@@ -49,11 +110,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     :return: None
     """
     chat_id = update.effective_chat.id
-    logging.info(
-        f"User with username: {update.effective_user.username}"
-        f"and chat_id: {chat_id}: "
-        f"starts the bot"
-    )
+    logging.info("User with username: %s and chat_id: %s starts the bot", update.effective_user.username, chat_id)
     await context.bot.send_message(
         chat_id=chat_id,
         text=(
@@ -64,11 +121,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "Доступные команды: \n"
             "`/current_weatrher` - прогноз погоды на текущее время \n"
             "`/forecast_today` - прогноз погоды на сегодня \n"
-            "`/forecast_tomorrow` - прогноз погоды на завтра"
+            "`/forecast_tomorrow` - прогноз погоды на завтра \n"
+            "`/subscribe 07:30` - присылать прогноз на день каждое утро в указанное время \n"
+            "`/unsubscribe` - отменить рассылку"
         ),
     )
 
 
+@observe_handler("location")
 async def get_coordinate(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Обрабатывает отправку геопозиции пользователем и сохраняет координаты в базу данных.
@@ -83,167 +143,322 @@ async def get_coordinate(update: Update, context: ContextTypes.DEFAULT_TYPE):
     latitude = update.effective_message.location.latitude
     longitude = update.effective_message.location.longitude
 
-    update_coordinates(username, first_name, chat_id, latitude, longitude)
-    logging.info(
-        f"User with username: {username}"
-        f"and chat_id: {chat_id} "
-        f"sends coordinates."
-    )
+    await update_coordinates(username, first_name, chat_id, latitude, longitude)
+    logging.info("User with username: %s and chat_id: %s sends coordinates", username, chat_id)
     await context.bot.send_message(
         chat_id=chat_id, text="Спасибо, Ваши координаты получены!"
     )
 
 
-async def get_api_answer(chat_id: int, url: str, kind: str, days: int = None) -> List[dict]:
+async def request_forecast(url: str, payload: dict, chat_id: int = None) -> Tuple[List[dict], Upstream]:
     """
     Отправляет GET-запрос к API Gismeteo и возвращает данные прогноза погоды.
 
+    :param url: URL-эндпоинт запроса
+    :param payload: Параметры запроса
+    :param chat_id: ID чата Telegram, для которого выполняется запрос
+    :return: Кортеж: список словарей с погодными данными и итог запроса к API
+    :raise exceptions.IncorrectStatusCode: Если статус ответа не 200 OK
+    :raise exceptions.ConnectionFailed: Если не удалось установить соединение
+    :raise exceptions.CannotDecodJson: Если не удалось декодировать JSON-ответ
+    :raise exceptions.RateLimited: Если исчерпан лимит запросов к API
+    :raise exceptions.CircuitOpen: Если API недоступен и запросы временно не отправляются
+    """
+    # Запросы при разомкнутом выключателе не расходуют лимит
+    if not breaker.allow():
+        raise exceptions.CircuitOpen("API Gismeteo is unavailable, circuit breaker is open")
+    try:
+        if not await rate_limiter.try_acquire():
+            logging.warning("Rate limit for API Gismeteo exceeded. User_id - %s", chat_id)
+            raise exceptions.RateLimited("Rate limit for API Gismeteo exceeded")
+        forecast, upstream = await send_request(url, payload, chat_id)
+    except (asyncio.CancelledError, exceptions.RateLimited):
+        # Запрос не был отправлен или отменен вызывающим: API здесь ни при чем
+        breaker.release()
+        raise
+    except Exception:
+        breaker.record_failure()
+        raise
+    breaker.record_success()
+    return forecast, upstream
+
+
+async def send_request(url: str, payload: dict, chat_id: int = None) -> Tuple[List[dict], Upstream]:
+    """
+    Выполняет GET-запрос к API Gismeteo.
+
+    Итог запроса возвращается, а не добавляется в лог здесь: запрос выполняется
+    задачей single_flight со своей копией контекста лога.
+
+    :param url: URL-эндпоинт запроса
+    :param payload: Параметры запроса
+    :param chat_id: ID чата Telegram, для которого выполняется запрос
+    :return: Кортеж: список словарей с погодными данными и итог запроса
+    """
+    started = time.perf_counter()
+    status = "error"
+    IN_FLIGHT.inc("gismeteo")
+    try:
+        session = get_http_session()
+        async with session.get(url, headers=HEADERS, params=payload) as response:
+            status = str(response.status)
+            if response.status != http.HTTPStatus.OK:
+                logging.error(
+                    "API Gismeteo returned incorrect status code. Status code - %s for user_id - %s",
+                    response.status, chat_id,
+                )
+                raise exceptions.IncorrectStatusCode(
+                    f"Status code was not 200: {response.status}"
+                )
+            try:
+                if STREAMING_PARSER:
+                    forecast = await read_response(response.content.iter_any())
+                else:
+                    forecast = (await response.json()).get("response")
+                logging.info("JSON successfully decoded to types python")
+            except (aiohttp.ContentTypeError, ValueError) as error:
+                logging.error("JSON was not decoded to types python: %s for user_id - %s", error, chat_id)
+                raise exceptions.CannotDecodJson(
+                    f"json was not decoded to types python: {error}"
+                )
+        logging.info("Request to API Gismeteo was successful for user_id - %s", chat_id)
+        return forecast, Upstream(status, round((time.perf_counter() - started) * 1000, 1))
+    except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+        logging.error("Cannot connect to API Gismeteo. User_id - %s", chat_id)
+        raise exceptions.ConnectionFailed(f"Connection failed - {error}")
+    finally:
+        elapsed = time.perf_counter() - started
+        IN_FLIGHT.dec("gismeteo")
+        GISMETEO_LATENCY.observe(elapsed, status)
+
+
+async def get_api_answer(
+    chat_id: int, url: str, kind: str, days: int = None, cached: bool = True
+) -> Tuple[List[dict], bool]:
+    """
+    Возвращает прогноз погоды из кэша или из API Gismeteo.
+
+    Одновременные промахи кэша по одному ключу объединяются в один запрос к API.
+    Если API недоступен, возвращается последний известный прогноз с пометкой stale.
+
     :param chat_id: ID чата Telegram, откуда извлекаются координаты
     :param url: URL-эндпоинт запроса
     :param kind: Тип прогноза погоды, требуется дл формирования ключа в Redis
     :param days: Количество дней прогноза (опционально)
-    :return: Список словарей с погодными данными
+    :param cached: Если False, прогноз запрашивается у API, минуя кэш
+    :return: Кортеж: список словарей с погодными данными и признак устаревших данных
     :raise exceptions.IncorrectStatusCode: Если статус ответа не 200 OK
     :raise exceptions.ConnectionFailed: Если не удалось установить соединение
     :raise exceptions.CannotDecodJson: Если не удалось декодировать JSON-ответ
     """
-    latitude, longitude = get_coordinates(chat_id)
+    latitude, longitude = await get_coordinates(chat_id)
+    bucket = quantize(kind, latitude, longitude)
     payload = {
-        "latitude": latitude,
-        "longitude": longitude,
+        "latitude": bucket.latitude,
+        "longitude": bucket.longitude,
     }
     if days:
         payload["days"] = days
 
-    cached_response = await get_cached_forecast(kind, latitude, longitude)
-    if cached_response:
-        return cached_response
+    key = make_key(kind, latitude, longitude)
+    prefetcher.record(
+        key, PrefetchRequest(kind, url, days, bucket.latitude, bucket.longitude)
+    )
+
+    if cached:
+        cached_response = await get_cached_forecast(
+            kind,
+            latitude,
+            longitude,
+            revalidate=lambda: single_flight.do(
+                key, lambda: fetch_and_cache(kind, url, payload, latitude, longitude, refresh=True)
+            ),
+        )
+        if cached_response:
+            return cached_response, False
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=HEADERS, params=payload) as response:
-                if response.status != http.HTTPStatus.OK:
-                    logging.error(
-                        f"API Gismeteo returned incorrect status code. Status code - {response.status} for user_id - {chat_id}"
-                    )
-                    raise exceptions.IncorrectStatusCode(
-                        f"Status code was not 200: {response.status}"
-                    )
-                try:
-                    json_response = await response.json()
-                    logging.info("JSON successfully decoded to types python")
-                except (aiohttp.ContentTypeError, JSONDecodeError) as error:
-                    logging.error(
-                        f"JSON was not decoded to types python: {error} for user_id - {chat_id}"
-                    )
-                    raise exceptions.CannotDecodJson(
-                        f"json was not decoded to types python: {error}"
-                    )
-            logging.info(
-                f"Request to API Gismeteo was successful for user_id - {chat_id}"
+        response, upstream = await single_flight.do(
+            key,
+            lambda: fetch_and_cache(kind, url, payload, latitude, longitude, chat_id, refresh=not cached),
+        )
+    except (exceptions.ConnectionFailed, exceptions.IncorrectStatusCode, exceptions.CannotDecodJson) as error:
+        stale_response = await get_stale_forecast(kind, latitude, longitude)
+        if stale_response is None:
+            raise
+        bind(cache="stale_fallback")
+        logging.warning("Stale forecast was served for user_id - %s: %s", chat_id, error)
+        return stale_response, True
+    if upstream is not None:
+        # Одновременные запросы того же ключа ждали этот же запрос к API
+        bind(upstream_status=upstream.status, upstream_ms=upstream.ms)
+    return response, False
+
+
+async def get_forecast(chat_id: int, kind: str) -> Tuple[Union[List[dict], dict], bool]:
+    """
+    Возвращает прогноз для команды. В режиме unified данные вырезаются из единого
+    многодневного прогноза ячейки, который кэшируется один раз для всех команд.
+
+    Если единый прогноз получен до местной полуночи, он запрашивается заново.
+    Если нужного среза в нем все равно нет, используется отдельный эндпоинт,
+    и до конца срока свежести единого прогноза запросы чата идут сразу туда.
+
+    :param chat_id: ID чата Telegram
+    :param kind: Тип прогноза: now, today, tomorrow
+    :return: Кортеж: данные прогноза и признак устаревших данных
+    :raise exceptions.IncorrectStatusCode: Если статус ответа не 200 OK
+    :raise exceptions.ConnectionFailed: Если не удалось установить соединение
+    :raise exceptions.CannotDecodJson: Если не удалось декодировать JSON-ответ
+    """
+    missing_key = f"{kind}:{chat_id}"
+    if FORECAST_SOURCE == "unified" and missing_views.get(missing_key) is None:
+        response, stale = await get_api_answer(chat_id, FORCAST_ENDPOINT, UNIFIED_KIND, UNIFIED_FORECAST_DAYS)
+        view = select_view(kind, response)
+        if view is None and not stale and is_outdated(response):
+            response, stale = await get_api_answer(
+                chat_id, FORCAST_ENDPOINT, UNIFIED_KIND, UNIFIED_FORECAST_DAYS, cached=False
             )
-            response = json_response.get("response")
-            await set_cached_forecast(kind, latitude, longitude, response)
-            return response
-    except aiohttp.ClientError as error:
-        logging.error("Cannot connect to API Gismeteo. User_id - {chat_id}")
-        raise exceptions.ConnectionFailed(f"Connection failed - {error}")
+            view = select_view(kind, response)
+        if view is not None:
+            return view, stale
+        missing_views.set(missing_key, True, get_ttl(UNIFIED_KIND)[0], 1)
+        logging.warning("Unified forecast has no %s interval for user_id - %s, endpoint is used", kind, chat_id)
+
+    url, days = FORECAST_ENDPOINTS[kind]
+    response, stale = await get_api_answer(chat_id, url, kind, days)
+    if kind == "tomorrow":
+        response = response[OFFSET:]
+    return response, stale
+
+
+async def fetch_and_cache(
+    kind: str,
+    url: str,
+    payload: dict,
+    latitude: float,
+    longitude: float,
+    chat_id: int = None,
+    refresh: bool = False,
+) -> Tuple[List[dict], Optional[Upstream]]:
+    """
+    Запрашивает прогноз у API Gismeteo и сохраняет его в кэш.
 
+    :param kind: Тип прогноза погоды
+    :param url: URL-эндпоинт запроса
+    :param payload: Параметры запроса
+    :param latitude: широта
+    :param longitude: долгота
+    :param chat_id: ID чата Telegram, для которого выполняется запрос (для логов)
+    :param refresh: Обновить прогноз, даже если он еще есть в кэше
+    :return: Кортеж: список словарей с погодными данными и итог запроса к API,
+        None — прогноз взят из кэша
+    """
+    async with distributed_lock(make_key(kind, latitude, longitude)) as locked:
+        if locked and not refresh:
+            # Пока ждали блокировку, другая реплика могла заполнить кэш
+            cached = await get_cached_forecast(kind, latitude, longitude)
+            if cached:
+                return cached, None
+        response, upstream = await request_forecast(url, payload, chat_id)
+        await set_cached_forecast(kind, latitude, longitude, response)
+        return response, upstream
+
+
+async def prefetch_forecast(key: str, request: PrefetchRequest) -> None:
+    """
+    Обновляет прогноз в кэше по заданию планировщика предзагрузки.
 
-def parse_weather_data(response: List[dict] or dict, offset: bool) -> List[tuple]:
+    :param key: Ключ кэша прогноза
+    :param request: Параметры запроса к API
+    :return: None
     """
-    Парсит погодные данные из ответа API.
+    payload = {"latitude": request.latitude, "longitude": request.longitude}
+    if request.days:
+        payload["days"] = request.days
+    await single_flight.do(
+        key,
+        lambda: fetch_and_cache(
+            request.kind, request.url, payload, request.latitude, request.longitude, refresh=True
+        ),
+    )
 
-    :param response: Ответ API Gismeteo
-    :param offset: Применять ли смещение для прогноза на завтра
-    :return: Список кортежей с погодными данными
-    """
-    data = {
-        "time": [],
-        "description": [],
-        "humidity": [],
-        "pressure": [],
-        "temperature": [],
-        "wind": [],
-        "wind_direction": [],
-    }
 
-    if isinstance(response, dict):
-        for key in response:
-            if key == "date":
-                data["time"].append(response[key]["local"])
-            if key == "description":
-                data["description"].append(response[key]["full"])
-            if key == "humidity":
-                data["humidity"].append(response[key]["percent"])
-            if key == "pressure":
-                data["pressure"].append(response[key]["mm_hg_atm"])
-            if key == "temperature":
-                data["temperature"].append(response[key]["air"]["C"])
-            if key == "wind":
-                data["wind"].append(response[key]["speed"]["m_s"])
-                data["wind_direction"].append(response[key]["direction"]["scale_8"])
+async def fetch_subscription_forecast(latitude: float, longitude: float) -> List[dict]:
+    """
+    Запрашивает прогноз для ячейки подписчиков: единый прогноз или прогноз на сегодня.
 
-    else:
-        if offset:
-            response = response[OFFSET:]
-
-        for gap in range(len(response)):
-            for key in response[gap]:
-                if key == "date":
-                    data["time"].append(response[gap][key]["local"])
-                if key == "description":
-                    data["description"].append(response[gap][key]["full"])
-                if key == "humidity":
-                    data["humidity"].append(response[gap][key]["percent"])
-                if key == "pressure":
-                    data["pressure"].append(response[gap][key]["mm_hg_atm"])
-                if key == "temperature":
-                    data["temperature"].append(response[gap][key]["air"]["C"])
-                if key == "wind":
-                    data["wind"].append(response[gap][key]["speed"]["m_s"])
-                    data["wind_direction"].append(
-                        response[gap][key]["direction"]["scale_8"]
-                    )
-
-    forecast_data = list(
-        zip(
-            data["time"],
-            data["description"],
-            data["humidity"],
-            data["pressure"],
-            data["temperature"],
-            data["wind"],
-            data["wind_direction"],
-        )
+    :param latitude: широта центра ячейки
+    :param longitude: долгота центра ячейки
+    :return: Список словарей с погодными данными
+    """
+    kind, days = (UNIFIED_KIND, UNIFIED_FORECAST_DAYS) if FORECAST_SOURCE == "unified" else ("today", ONE_DAY)
+    payload = {"latitude": latitude, "longitude": longitude, "days": days}
+    forecast, _ = await single_flight.do(
+        make_key(kind, latitude, longitude),
+        lambda: fetch_and_cache(kind, FORCAST_ENDPOINT, payload, latitude, longitude),
+    )
+    return forecast
+
+
+async def warm_populated_cells() -> None:
+    """
+    Прогревает кэш прогноза для самых населенных ячеек, пока горячие ключи
+    планировщика предзагрузки после запуска пусты.
+
+    :return: None
+    """
+    if not PREFETCH_ENABLED or PREFETCH_WARM_CELLS <= 0:
+        return
+    kind, url, days = (
+        (UNIFIED_KIND, FORCAST_ENDPOINT, UNIFIED_FORECAST_DAYS)
+        if FORECAST_SOURCE == "unified" else ("today", FORCAST_ENDPOINT, ONE_DAY)
     )
+    seeds = []
+    for cell, chats in await get_populated_cells(PREFETCH_WARM_CELLS):
+        latitude, longitude = geohash_centroid(cell)
+        bucket = quantize(kind, latitude, longitude)
+        seeds.append((
+            make_key(kind, latitude, longitude),
+            PrefetchRequest(kind, url, days, bucket.latitude, bucket.longitude),
+            chats,
+        ))
+    warmed = await prefetcher.warm(seeds)
+    logging.info(f"Forecast cache was warmed for {warmed} of {len(seeds)} populated cells")
+
+
+def parse_weather_data(response: List[dict] or dict, offset: bool) -> List[ForecastRecord]:
+    """
+    Парсит погодные данные из ответа API.
+
+    :param response: Ответ API Gismeteo
+    :param offset: Применять ли смещение для прогноза на завтра
+    :return: Список ForecastRecord с погодными данными
+    """
+    with PARSE_LATENCY.time(str(offset).lower()):
+        forecast_data = parse_forecast(response, offset)
     logging.info("Weather data was parsed successfully")
     return forecast_data
 
 
-def prepare_message(data: List[tuple]) -> str:
+def prepare_message(data: List[ForecastRecord], kind: str, stale: bool = False) -> List[str]:
     """
-    Формирует текстовое сообщение с прогнозом погоды.
+    Формирует текстовые сообщения с прогнозом погоды.
 
-    :param data: Список кортежей с погодными данными
-    :return: Форматированное сообщение для отправки пользователю
+    :param data: Список ForecastRecord с погодными данными
+    :param kind: Тип прогноза: now, today, tomorrow
+    :param stale: Прогноз взят из резервной копии кэша и может быть устаревшим
+    :return: Сообщения для отправки пользователю (с учетом лимита длины Telegram)
     """
-    forecast = f"Погода на {data[ELEMENT][DATE][:OFFSET_DATE]}:\n"
-
-    for row in data:
-        forecast += (
-            f"{row[DATE][OFFSET_TIME:]}: "
-            f"Температура воздуха составит: {row[TEMPERATURE]}° С. "
-            f"Влажность воздуха: {row[HUMIDITY]}%. "
-            f"Давление: {row[PRESSURE]} мм. рт. ст. "
-            f"Ветер: {WIND_DIRECTION[row[WIND_ORIENTATION]]}, "
-            f"{row[WIND_SPEED]} м/с, "
-            f"{row[DESCRIPTION]}.\n\n"
-        )
+    with RENDER_LATENCY.time(kind):
+        messages = render_forecast(kind, data)
+    if stale:
+        messages = [STALE_NOTICE, *messages]
     logging.info("Message was prepared successfully")
-    return forecast
+    return messages
 
 
+@observe_handler("current_weather")
 async def get_current_weather(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Получает и отправляет текущую погоду.
@@ -253,17 +468,19 @@ async def get_current_weather(update: Update, context: ContextTypes.DEFAULT_TYPE
     :return: None
     """
     chat_id = update.effective_chat.id
-    response = await get_api_answer(chat_id, CURRENT_ENDPOINT, "now")
+    response, stale = await get_forecast(chat_id, "now")
     data = parse_weather_data(response, False)
-    message = prepare_message(data)
+    messages = prepare_message(data, "now", stale)
     logging.info(
-        f"To user: {update.effective_user.username} "
-        f"sent current weather forecast. "
-        f"user_id: {chat_id}"
+        "To user: %s sent current weather forecast. user_id: %s",
+        update.effective_user.username,
+        chat_id,
     )
-    await context.bot.send_message(chat_id=chat_id, text=message)
+    for message in messages:
+        await context.bot.send_message(chat_id=chat_id, text=message)
 
 
+@observe_handler("weather_today")
 async def get_weather_forecast_today(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ):
@@ -275,17 +492,19 @@ async def get_weather_forecast_today(
     :return: None
     """
     chat_id = update.effective_chat.id
-    response = await get_api_answer(chat_id, FORCAST_ENDPOINT, "today", ONE_DAY)
+    response, stale = await get_forecast(chat_id, "today")
     data = parse_weather_data(response, False)
-    message = prepare_message(data)
+    messages = prepare_message(data, "today", stale)
     logging.info(
-        f"To user: {update.effective_user.username} "
-        f"sent weather forecast for today. "
-        f"user_id: {chat_id}"
+        "To user: %s sent weather forecast for today. user_id: %s",
+        update.effective_user.username,
+        chat_id,
     )
-    await context.bot.send_message(chat_id=chat_id, text=message)
+    for message in messages:
+        await context.bot.send_message(chat_id=chat_id, text=message)
 
 
+@observe_handler("weather_tomorrow")
 async def get_forecast_tomorrow(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Получает и отправляет прогноз погоды на завтра.
@@ -295,35 +514,172 @@ async def get_forecast_tomorrow(update: Update, context: ContextTypes.DEFAULT_TY
     :return: None
     """
     chat_id = update.effective_chat.id
-    response = await get_api_answer(chat_id, FORCAST_ENDPOINT + TOMORROW, "tomorrow", TWO_DAYS)
-    data = parse_weather_data(response, True)
-    message = prepare_message(data)
+    response, stale = await get_forecast(chat_id, "tomorrow")
+    data = parse_weather_data(response, False)
+    messages = prepare_message(data, "tomorrow", stale)
     logging.info(
-        f"To user: {update.effective_user.username} "
-        f"sent weather forecast for tomorrow. "
-        f"user_id: {chat_id}"
+        "To user: %s sent weather forecast for tomorrow. user_id: %s",
+        update.effective_user.username,
+        chat_id,
     )
-    await context.bot.send_message(chat_id=chat_id, text=message)
+    for message in messages:
+        await context.bot.send_message(chat_id=chat_id, text=message)
 
 
-def main():
+@observe_handler("subscribe")
+async def subscribe_forecast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
-    Основная функция запуска бота.
+    Подписывает пользователя на ежедневный прогноз на сегодня: /subscribe 07:30
 
+    :param update: Объект Update, содержащий информацию о событии Telegram
+    :param context: Контекст выполнения, предоставляет доступ к bot и другим полезным свойствам
     :return: None
     """
-    logging.basicConfig(
-        level=logging.INFO,
-        stream=sys.stdout,
-        format="%(asctime)s - %(levelname)s - %(message)s - %(name)s",
+    chat_id = update.effective_chat.id
+    try:
+        delivery_minute = parse_delivery_time(context.args[0] if context.args else "")
+    except ValueError:
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text="Укажите время рассылки в формате ЧЧ:ММ, например: /subscribe 07:30",
+        )
+        return
+    latitude, longitude = await get_coordinates(chat_id)
+    if latitude is None:
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text="Сначала отправьте мне свою геопозицию через вложение.",
+        )
+        return
+    now = datetime.now(subscription_timezone)
+    # Если время рассылки сегодня уже прошло, первый прогноз придет завтра
+    delivered_on = now.date() if delivery_minute <= minute_of_day(now) else None
+    await subscribe(chat_id, delivery_minute, delivered_on)
+    logging.info(
+        "User with username: %s and chat_id: %s subscribed to daily forecast at %02d:%02d",
+        update.effective_user.username, chat_id, delivery_minute // 60, delivery_minute % 60,
+    )
+    await context.bot.send_message(
+        chat_id=chat_id,
+        text=f"Готово! Прогноз на день будет приходить каждый день в {delivery_minute // 60:02}:{delivery_minute % 60:02}.",
     )
 
+
+@observe_handler("unsubscribe")
+async def unsubscribe_forecast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Отменяет ежедневную рассылку прогноза.
+
+    :param update: Объект Update, содержащий информацию о событии Telegram
+    :param context: Контекст выполнения, предоставляет доступ к bot и другим полезным свойствам
+    :return: None
+    """
+    chat_id = update.effective_chat.id
+    if await unsubscribe(chat_id):
+        text = "Рассылка прогноза отменена."
+    else:
+        text = "Вы не подписаны на рассылку прогноза."
+    logging.info("User with chat_id: %s unsubscribed from daily forecast", chat_id)
+    await context.bot.send_message(chat_id=chat_id, text=text)
+
+
+async def prepare_storage() -> None:
+    """
+    Одновременно проверяет Postgres и Redis, если включено, создает схему базы,
+    затем прогревает кэши из снимка прогнозов на диске и для самых населенных
+    ячеек. Выполняется в фоне: бот начинает получать обновления, не дожидаясь базы.
+
+    :return: None
+    """
+    started = time.perf_counter()
     try:
-        create_data_base_and_tables()
-        logging.info("Database was created successfully")
+        for name, result in (await readiness.check(force=True)).items():
+            if result.ok:
+                logging.info(f"{name} is available, checked in {result.seconds * 1000:.0f} ms")
+            else:
+                logging.error(f"{name} is unavailable: {result.error}")
+        if DB_SCHEMA_ON_STARTUP:
+            try:
+                await migrate()
+            except Exception as e:
+                logging.error(f"Database was not created. We got an error: {e}")
+    finally:
+        readiness.done("startup")
+        logging.info(f"Startup checks finished in {time.perf_counter() - started:.2f} s")
+    # Прогрев не задерживает готовность реплики
+    try:
+        restored = await restore_cached_forecasts(await forecast_snapshot.load())
+        logging.info(f"Forecast cache was restored from snapshot: {restored} forecasts")
+    except Exception as e:
+        logging.error(f"Forecast cache was not restored from snapshot: {e}")
+    try:
+        await warm_populated_cells()
     except Exception as e:
-        logging.error(f"Database was not created. We got an error: {e}")
-    application = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+        logging.error(f"Forecast cache was not warmed: {e}")
+
+
+async def on_startup(application: Application) -> None:
+    """
+    Подготавливает ресурсы приложения перед началом обработки обновлений.
+
+    Проверки зависимостей и создание схемы выполняются в фоне, готовность
+    реплики сообщает /health/ready.
+
+    :param application: Объект Application
+    :return: None
+    """
+    global startup_task
+    readiness.begin("startup")
+    await start_health_server()
+    await start_http_session(application)
+    await start_metrics_server()
+    await start_invalidation_listener()
+    await forecast_snapshot.start()
+    prefetcher.fetch = prefetch_forecast
+    prefetcher.start(application)
+    delivery_engine.fetch = fetch_subscription_forecast
+    delivery_engine.start(application)
+    history_maintenance.start(application)
+    if COORDINATES_BUFFER_ENABLED:
+        coordinates_buffer.start()
+    startup_task = asyncio.create_task(prepare_storage())
+
+
+async def on_shutdown(application: Application) -> None:
+    """
+    Освобождает ресурсы приложения при остановке.
+
+    :param application: Объект Application
+    :return: None
+    """
+    global startup_task
+    if startup_task is not None:
+        startup_task.cancel()
+        try:
+            await startup_task
+        except asyncio.CancelledError:
+            pass
+        startup_task = None
+    await close_http_session(application)
+    await stop_metrics_server()
+    await stop_health_server()
+    await stop_invalidation_listener()
+    await prefetcher.stop()
+    await delivery_engine.stop()
+    await history_maintenance.stop()
+    await coordinates_buffer.stop()
+    await forecast_snapshot.stop()
+    await close_redis_clients()
+    await dispose_engine()
+
+
+def register_handlers(application: Application) -> None:
+    """
+    Регистрирует обработчики команд и сообщений.
+
+    :param application: Объект Application
+    :return: None
+    """
     starting = CommandHandler("start", start)
     current_weather = CommandHandler("current_weather", get_current_weather)
 
@@ -332,6 +688,8 @@ def main():
     forecast_weather_tomorrow = CommandHandler(
         "weather_tomorrow", get_forecast_tomorrow
     )
+    subscription = CommandHandler("subscribe", subscribe_forecast)
+    unsubscription = CommandHandler("unsubscribe", unsubscribe_forecast)
     special_thing = MessageHandler(filters.TEXT, special_cases)
     coordinate = MessageHandler(filters.LOCATION, get_coordinate)
 
@@ -339,10 +697,40 @@ def main():
     application.add_handler(current_weather)
     application.add_handler(forecast_weather_today)
     application.add_handler(forecast_weather_tomorrow)
+    application.add_handler(subscription)
+    application.add_handler(unsubscription)
     application.add_handler(coordinate)
     application.add_handler(special_thing)
 
-    application.run_polling()
+
+def main():
+    """
+    Основная функция запуска бота.
+
+    :return: None
+    """
+    setup_logging()
+    missing = missing_settings()
+    if missing:
+        logging.critical(f"Required environment variables are not set: {', '.join(missing)}")
+        raise SystemExit(1)
+
+    builder = (
+        ApplicationBuilder()
+        .token(TELEGRAM_TOKEN)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .concurrent_updates(ChatOrderedUpdateProcessor())
+    )
+    if BOT_MODE == "webhook":
+        builder = builder.updater(None)
+    application = builder.build()
+    register_handlers(application)
+
+    if BOT_MODE == "webhook":
+        run_webhook(application)
+    else:
+        application.run_polling()
 
 
 if __name__ == "__main__":
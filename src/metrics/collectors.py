@@ -0,0 +1,71 @@
+from typing import List
+
+from api.resilience import CLOSED, HALF_OPEN, OPEN, breaker
+from bot.subscriptions import delivery_engine
+from cache.memory_cache import memory_cache
+from cache.prefetch import prefetcher
+from cache.redis_cache import cache_stats
+from cache.snapshot import forecast_snapshot
+from db.write_buffer import coordinates_buffer
+from metrics.registry import Counter, Gauge, Metric
+
+BREAKER_STATES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+def collect_modules() -> List[Metric]:
+    """
+    Значения счетчиков, которые модули ведут сами, в виде метрик.
+
+    :return: Список метрик
+    """
+    l1 = memory_cache.stats()
+    return [
+        Counter.snapshot(
+            "cache_requests_total",
+            "Forecast cache lookups by outcome: fresh, stale, miss, error, revalidated",
+            ("kind", "outcome"),
+            cache_stats,
+        ),
+        Gauge.snapshot(
+            "l1_cache",
+            "In-process forecast cache state",
+            ("field",),
+            {(field,): value for field, value in l1.items() if isinstance(value, (int, float))},
+        ),
+        Counter.snapshot(
+            "prefetch_events_total",
+            "Prefetch scheduler events",
+            ("event",),
+            {(event,): count for event, count in prefetcher.metrics.items()},
+        ),
+        Counter.snapshot(
+            "subscription_events_total",
+            "Daily forecast delivery events",
+            ("event",),
+            {(event,): count for event, count in delivery_engine.metrics.items()},
+        ),
+        Counter.snapshot(
+            "coordinates_buffer_events_total",
+            "Coordinates write buffer events: added, flushes, rows, flush_errors, dropped",
+            ("event",),
+            {(event,): count for event, count in coordinates_buffer.metrics.items()},
+        ),
+        Gauge.snapshot(
+            "coordinates_buffer_pending",
+            "Coordinates updates waiting for the next flush",
+            (),
+            {(): len(coordinates_buffer.updates)},
+        ),
+        Counter.snapshot(
+            "forecast_snapshot_events_total",
+            "Forecast snapshot events: lookups, hits, flushes, written, removed, errors",
+            ("event",),
+            {(event,): count for event, count in forecast_snapshot.metrics.items()},
+        ),
+        Gauge.snapshot(
+            "gismeteo_circuit_state",
+            "Gismeteo circuit breaker state: 0 closed, 1 half-open, 2 open",
+            (),
+            {(): BREAKER_STATES[breaker.state]},
+        ),
+    ]
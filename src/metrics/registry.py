@@ -0,0 +1,248 @@
+import functools
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from config import METRICS_ENABLED
+
+PREFIX = "weather_bot_"
+# Секунды: от быстрого чтения из Redis до медленного ответа Gismeteo
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class Metric:
+    """
+    Метрика с набором меток. Значения хранятся по кортежу значений меток.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, object] = {}
+
+    def samples(self) -> Iterable[Sample]:
+        for labelvalues, value in self._values.items():
+            yield self.name, dict(zip(self.labelnames, labelvalues)), value
+
+    @classmethod
+    def snapshot(
+        cls, name: str, documentation: str, labelnames: Sequence[str], values: Dict[tuple, float]
+    ) -> "Metric":
+        """
+        Метрика из уже посчитанных значений, например счетчиков модуля.
+
+        :param name: Имя без префикса
+        :param documentation: Описание
+        :param labelnames: Имена меток
+        :param values: Dict вида {(значения меток): значение}
+        :return: Metric
+        """
+        metric = cls(name, documentation, labelnames)
+        metric._values = dict(values)
+        return metric
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labelvalues, amount: float = 1) -> None:
+        if METRICS_ENABLED:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labelvalues) -> None:
+        if METRICS_ENABLED:
+            self._values[labelvalues] = value
+
+    def inc(self, *labelvalues, amount: float = 1) -> None:
+        if METRICS_ENABLED:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def dec(self, *labelvalues, amount: float = 1) -> None:
+        self.inc(*labelvalues, amount=-amount)
+
+
+class Timer:
+    __slots__ = ("histogram", "labelvalues", "started")
+
+    def __init__(self, histogram: "Histogram", labelvalues: tuple):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self) -> "Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.histogram.observe(time.perf_counter() - self.started, *self.labelvalues)
+
+
+class NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self) -> "NoopTimer":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+NOOP_TIMER = NoopTimer()
+
+
+class Histogram(Metric):
+    """
+    Гистограмма с фиксированными границами корзин. Для каждого набора меток
+    хранится список счетчиков корзин, сумма и количество наблюдений.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labelvalues) -> None:
+        if not METRICS_ENABLED:
+            return
+        state = self._values.get(labelvalues)
+        if state is None:
+            # Счетчики корзин, +Inf, сумма
+            state = self._values[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def time(self, *labelvalues):
+        """
+        Контекстный менеджер, измеряющий длительность блока.
+
+        :param labelvalues: Значения меток
+        :return: Timer
+        """
+        if not METRICS_ENABLED:
+            return NOOP_TIMER
+        return Timer(self, labelvalues)
+
+    def samples(self) -> Iterable[Sample]:
+        for labelvalues, state in self._values.items():
+            labels = dict(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                yield f"{self.name}_bucket", {**labels, "le": repr(float(bound))}, cumulative
+            cumulative += state[len(self.buckets)]
+            yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, cumulative
+            yield f"{self.name}_sum", labels, state[-1]
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Registry:
+    """
+    Набор метрик и функций, собирающих значения из существующих счетчиков модулей.
+    """
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+        self.collectors: List[Callable[[], Iterable[Metric]]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[Metric]]) -> None:
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        """
+        Текстовый формат Prometheus (version 0.0.4).
+
+        :return: Текст ответа эндпоинта /metrics
+        """
+        lines = []
+        metrics = list(self.metrics)
+        for collector in self.collectors:
+            metrics.extend(collector())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HANDLER_LATENCY = registry.register(
+    Histogram("handler_duration_seconds", "Handler latency per command", ("command",))
+)
+HANDLER_ERRORS = registry.register(
+    Counter("handler_errors_total", "Handler calls finished with an exception", ("command",))
+)
+IN_FLIGHT = registry.register(
+    Gauge("in_flight_requests", "Requests being processed", ("target",))
+)
+REDIS_LATENCY = registry.register(
+    Histogram("redis_duration_seconds", "Redis forecast cache latency", ("operation",))
+)
+DB_LATENCY = registry.register(
+    Histogram("db_duration_seconds", "Postgres query latency", ("query",))
+)
+GISMETEO_LATENCY = registry.register(
+    Histogram("gismeteo_duration_seconds", "Gismeteo API latency", ("status",))
+)
+PARSE_LATENCY = registry.register(
+    Histogram("parse_duration_seconds", "Forecast parse time", ("offset",))
+)
+RENDER_LATENCY = registry.register(
+    Histogram("render_duration_seconds", "Forecast message render time", ("kind",))
+)
+
+
+def observe_handler(command: str):
+    """
+    Декоратор обработчика команды: длительность, ошибки и число выполняемых обработчиков.
+
+    :param command: Имя команды для метки command
+    :return: Декоратор
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            if not METRICS_ENABLED:
+                return await handler(*args, **kwargs)
+            IN_FLIGHT.inc("handler")
+            started = time.perf_counter()
+            try:
+                return await handler(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(command)
+                raise
+            finally:
+                HANDLER_LATENCY.observe(time.perf_counter() - started, command)
+                IN_FLIGHT.dec("handler")
+        return wrapper
+    return decorator
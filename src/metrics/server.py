@@ -0,0 +1,47 @@
+import logging
+
+from aiohttp import web
+
+from config import METRICS_ENABLED, METRICS_HOST, METRICS_PORT
+from metrics.collectors import collect_modules
+from metrics.registry import registry
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+runner: web.AppRunner = None
+
+registry.register_collector(collect_modules)
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=registry.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+def create_metrics_app() -> web.Application:
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    return app
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> None:
+    """
+    Запускает HTTP-сервер с эндпоинтом /metrics, если метрики включены.
+
+    :param host: Адрес HTTP-сервера
+    :param port: Порт HTTP-сервера
+    :return: None
+    """
+    global runner
+    if not METRICS_ENABLED or runner is not None:
+        return
+    runner = web.AppRunner(create_metrics_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Metrics are served on {host}:{port}/metrics")
+
+
+async def stop_metrics_server() -> None:
+    global runner
+    if runner is not None:
+        await runner.cleanup()
+        runner = None
@@ -0,0 +1,168 @@
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+from api.parser import ForecastRecord
+from cache.memory_cache import MemoryCache
+from config import (LOCALE, OFFSET_DATE, OFFSET_TIME, REDIS_TTL,
+                    RENDER_CACHE_MAX_BYTES, RENDER_CACHE_MAX_ENTRIES,
+                    TELEGRAM_MESSAGE_LIMIT, WIND_DIRECTION)
+
+ROW_FIELDS = 7
+
+
+class Template(NamedTuple):
+    """
+    Шаблон сообщения для локали.
+
+    header принимает дату, row — поля интервала в порядке: время, температура,
+    влажность, давление, направление ветра, скорость ветра, описание.
+    """
+    header: str
+    row: str
+    wind_directions: Tuple[str, ...]
+
+
+def compile_template(header: str, row: str, wind_directions: Dict[int, str]) -> Template:
+    """
+    Подготавливает шаблон локали и переводит словарь направлений ветра в кортеж.
+
+    :param header: Шаблон заголовка (%-формат) с датой
+    :param row: Шаблон строки интервала (%-формат)
+    :param wind_directions: Названия направлений ветра по шкале 0-8
+    :return: Template
+    :raise ValueError: Если число полей в шаблоне строки не совпадает с ожидаемым
+    """
+    try:
+        row % (("",) * ROW_FIELDS)
+    except TypeError as e:
+        raise ValueError(f"Row template must have {ROW_FIELDS} fields: {e}") from e
+    return Template(
+        header,
+        row,
+        tuple(wind_directions[index] for index in range(len(wind_directions))),
+    )
+
+
+TEMPLATES = {
+    "ru": compile_template(
+        "Погода на %s:\n",
+        "%s: "
+        "Температура воздуха составит: %s° С. "
+        "Влажность воздуха: %s%%. "
+        "Давление: %s мм. рт. ст. "
+        "Ветер: %s, "
+        "%s м/с, "
+        "%s.\n\n",
+        WIND_DIRECTION,
+    ),
+}
+
+render_cache = MemoryCache(RENDER_CACHE_MAX_ENTRIES, RENDER_CACHE_MAX_BYTES)
+
+
+def build_message(data: Sequence[ForecastRecord], locale: str = LOCALE) -> str:
+    """
+    Формирует текст прогноза по шаблону локали.
+
+    :param data: Список ForecastRecord
+    :param locale: Локаль шаблона
+    :return: Текст сообщения
+    """
+    template = TEMPLATES[locale]
+    row = template.row
+    directions = template.wind_directions
+    parts = [template.header % data[0].time[:OFFSET_DATE]]
+    parts.extend(
+        [
+            row % (
+                time[OFFSET_TIME:],
+                temperature,
+                humidity,
+                pressure,
+                directions[wind_direction],
+                wind,
+                description,
+            )
+            for time, description, humidity, pressure, temperature, wind, wind_direction in data
+        ]
+    )
+    return "".join(parts)
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """
+    Делит текст на части не длиннее limit, по возможности по границам интервалов.
+
+    :param text: Текст сообщения
+    :param limit: Максимальная длина сообщения Telegram
+    :return: Список частей сообщения
+    """
+    if len(text) <= limit:
+        return [text]
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n\n", 0, limit)
+        cut = cut + 2 if cut > 0 else limit
+        parts.append(text[:cut])
+        text = text[cut:]
+    if text:
+        parts.append(text)
+    return parts
+
+
+def render_forecast(kind: str, data: Sequence[ForecastRecord], locale: str = LOCALE) -> List[str]:
+    """
+    Возвращает готовые сообщения с прогнозом, форматируя одинаковые прогнозы один раз.
+
+    Ключом служат тип прогноза и содержимое прогноза: все пользователи одного
+    ключа кэша получают одинаковые данные, а после обновления прогноза
+    текст формируется заново.
+
+    :param kind: Тип прогноза: now, today, tomorrow
+    :param data: Список ForecastRecord
+    :param locale: Локаль шаблона
+    :return: Список сообщений не длиннее лимита Telegram
+    """
+    key = (kind, locale, tuple(data))
+    messages = render_cache.get(key)
+    if messages is None:
+        messages = split_message(build_message(data, locale))
+        render_cache.set(key, messages, REDIS_TTL, sum(len(message) for message in messages))
+    return messages
+
+
+if __name__ == "__main__":
+    import time
+
+    from api.parser import parse_forecast
+    from api.samples import forecast_response
+
+    ROUNDS = 20000
+
+    def legacy_message(data) -> str:
+        forecast = f"Погода на {data[0][0][:OFFSET_DATE]}:\n"
+        for row in data:
+            forecast += (
+                f"{row[0][OFFSET_TIME:]}: "
+                f"Температура воздуха составит: {row[4]}° С. "
+                f"Влажность воздуха: {row[2]}%. "
+                f"Давление: {row[3]} мм. рт. ст. "
+                f"Ветер: {WIND_DIRECTION[row[6]]}, "
+                f"{row[5]} м/с, "
+                f"{row[1]}.\n\n"
+            )
+        return forecast
+
+    def measure(func, *args) -> float:
+        started = time.perf_counter()
+        for _ in range(ROUNDS):
+            func(*args)
+        return (time.perf_counter() - started) / ROUNDS * 1e6
+
+    for size in (1, 8, 16):
+        data = parse_forecast(forecast_response(size), False)
+        assert legacy_message(data) == build_message(data)
+        print(
+            f"{size:>2} intervals: legacy {measure(legacy_message, data):.1f} us, "
+            f"templates {measure(build_message, data):.1f} us, "
+            f"memoized {measure(render_forecast, 'today', data):.1f} us"
+        )